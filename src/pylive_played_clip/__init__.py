@@ -3,14 +3,32 @@ The initialization code for the pylive_played_clip module
 '''
 __version_info__ = ('1', '1', '7')
 __version__ = ".".join(__version_info__)
+import functools
 import logging
+import math
+import queue
 import re
+import threading
 import time
 
-from typing import Dict, Optional, Tuple
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple, Union
 
-import colorsys
-import live  # type: ignore
+from pylive_played_clip.lazy_import import LazyModule
+from pylive_played_clip.metrics import MonitorMetrics, write_atomically
+from pylive_played_clip.output import BackgroundWriter, PrefixedWriter
+from pylive_played_clip.scheduler import (OVERRUN_POLICIES, AdaptivePollingDelay, BeatBoundaryScheduler, ClipEndPredictor, FixedRateScheduler,
+                                          quantization_to_beats)
+from pylive_played_clip.write_queue import DIM, RESTORE, WriteQueue
+
+# Imported when first used, so importing the package does not start the
+# pylive OSC stack.
+colorsys = LazyModule('colorsys')
+difflib = LazyModule('difflib')
+live = LazyModule('live')
+
+if TYPE_CHECKING:
+    from pylive_played_clip.journal import ColorJournal
+    from pylive_played_clip.recording import SessionRecorder
 
 
 def hexToRgb(hex: str) -> Tuple[int, int, int]:
@@ -79,11 +97,195 @@ def colorIntToRgbString(color: int) -> str:
     return f"[{red}, {green}, {blue}]"
 
 
+DIM_COLOR_CACHE_SIZE: int = 4096
+
+# The clip colors offered by the Ableton Live 10 and later color chooser,
+# row by row. Used to prewarm the dim color cache.
+LIVE_CLIP_COLOR_PALETTE: Tuple[int, ...] = (
+    0xFF94A6, 0xFFA529, 0xCC9927, 0xF7F47C, 0xBFFB00, 0x1AFF2F, 0x25FFA8,
+    0x5CFFE8, 0x8BC5FF, 0x5480E4, 0x92A7FF, 0xD86CE4, 0xE553A0, 0xFFFFFF,
+    0xFF3636, 0xF66C03, 0x99724B, 0xFFF034, 0x87FF67, 0x3DC300, 0x00BFAF,
+    0x19E9FF, 0x10A4EE, 0x007DC0, 0x886CE4, 0xB677C6, 0xFF39D4, 0xD0D0D0,
+    0xE2675A, 0xFFA374, 0xD3AD71, 0xEDFFAE, 0xD2E498, 0xBAD074, 0x9BC48D,
+    0xD4FDE1, 0xCDF1F8, 0xB9C1E3, 0xCDBBE4, 0xAE98E5, 0xE5DCE1, 0xA9A9A9,
+    0xC6928B, 0xB78256, 0x99836A, 0xBFBA69, 0xA6BE00, 0x7DB04D, 0x88C2BA,
+    0x9BB3C4, 0x85A5C2, 0x8393CC, 0xA595B5, 0xBF9FBE, 0xBC7196, 0x7B7B7B,
+    0xAF3333, 0xA95131, 0x724F41, 0xDBC300, 0x85961F, 0x539F31, 0x0A9C8E,
+    0x236384, 0x1A2F96, 0x2F52A2, 0x624BAD, 0xA34BAD, 0xCC2E6E, 0x3C3C3C,
+)
+
+
+@functools.lru_cache(maxsize=DIM_COLOR_CACHE_SIZE)
+def dimColorInt(color: int, dim_ratio: float) -> int:
+    '''Dims a color by converting it to HLS, dividing the lightness by
+    dim_ratio and converting it back. Results are memoized by color and
+    ratio since Live clips use a small palette.
+
+    :param color: The single integer representing the color.
+    :type color: int
+    :param dim_ratio: The ratio to divide the lightness by.
+    :type dim_ratio: float
+
+    :returns: The single integer representing the dimmed color.
+    :rtype: int
+    '''
+    (red, green, blue) = colorIntToRgb(color)
+    (hue, lightness, saturation) = colorsys.rgb_to_hls(red, green, blue)
+    (dim_red, dim_green, dim_blue) = colorsys.hls_to_rgb(hue, lightness/dim_ratio, saturation)
+    return rgbToColorInt(int(dim_red), int(dim_green), int(dim_blue))
+
+
+def build_osc_bundle(address: str, args_list: Sequence[Tuple]) -> Any:
+    '''Packs one OSC message per entry in args_list into a single bundle
+    that is processed immediately.
+
+    :param address: The OSC address of every message.
+    :type address: str
+    :param args_list: The values of each message.
+    :type args_list: typing.Sequence[typing.Tuple]
+
+    :returns: The bundle, ready to send.
+    :rtype: pythonosc.osc_bundle.OscBundle
+    '''
+    from pythonosc.osc_bundle_builder import IMMEDIATELY, OscBundleBuilder
+    from pythonosc.osc_message_builder import OscMessageBuilder
+
+    bundle_builder = OscBundleBuilder(IMMEDIATELY)
+    for args in args_list:
+        message_builder = OscMessageBuilder(address)
+        for arg in args:
+            message_builder.add_arg(arg)
+        bundle_builder.add_content(message_builder.build())  # type: ignore
+    return bundle_builder.build()
+
+
+def map_track_indexes(old_track_names: Sequence[str], new_track_names: Sequence[str]) -> Dict[int, int]:
+    '''Works out where each track went after tracks were added, removed or
+    moved by matching the track names in order. The number Live puts in
+    front of default track names, such as 1-Audio, is ignored since Live
+    renumbers them. A run of tracks renamed in place keeps its indexes.
+
+    :param old_track_names: The track names before the change.
+    :type old_track_names: typing.Sequence[str]
+    :param new_track_names: The track names after the change.
+    :type new_track_names: typing.Sequence[str]
+
+    :returns: The new index of each old track index that still exists.
+    :rtype: typing.Dict[int, int]
+    '''
+    old_names: List[str] = [re.sub(r'^\d+[- ]', '', str(name)) for name in old_track_names]
+    new_names: List[str] = [re.sub(r'^\d+[- ]', '', str(name)) for name in new_track_names]
+    matcher = difflib.SequenceMatcher(None, old_names, new_names, autojunk=False)
+
+    track_map: Dict[int, int] = {}
+    for (tag, old_start, old_end, new_start, new_end) in matcher.get_opcodes():
+        if tag == 'equal' or (tag == 'replace' and old_end - old_start == new_end - new_start):
+            for offset in range(old_end - old_start):
+                track_map[old_start + offset] = new_start + offset
+    return track_map
+
+
 class AbletonClipMonitorException(Exception):
     '''Ableton Clip Monitor Exception Class'''
     pass
 
 
+MONITOR_MODES: Tuple[str, ...] = ('poll', 'events', 'quantized')
+
+CLIP_END_ADDRESSES: Tuple[str, ...] = (
+    '/live/clip/get/length',
+    '/live/clip/get/playing_position',
+    '/live/clip/get/looping')
+
+
+class PlayingClip():
+    '''The clip playing on a track, recorded when it starts so it can be
+    dimmed once it ends.
+
+    **Class Properties**
+
+    * clip_index: int - The index of the clip slot.
+    * color: int - The color of the clip when it started.
+    '''
+    __slots__ = ('clip_index', 'color')
+
+    def __init__(self, clip_index: int, color: int) -> None:
+        '''
+        :param clip_index: The index of the clip slot.
+        :type clip_index: int
+        :param color: The color of the clip when it started.
+        :type color: int
+        '''
+        self.clip_index: int = clip_index
+        self.color: int = color
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, PlayingClip):
+            return NotImplemented
+        return (self.clip_index, self.color) == (other.clip_index, other.color)
+
+    def __repr__(self) -> str:
+        return f"PlayingClip(clip_index={self.clip_index}, color={self.color})"
+
+
+class PendingQueries():
+    '''Collects the replies to a group of queries that were all sent to
+    the same address without waiting for each other. AbletonOSC echoes the
+    leading arguments of a query, such as the track index, at the start of
+    its reply so each reply is matched to its query by those arguments.
+    '''
+    def __init__(self, address: str, args_list: Sequence[Tuple], clock: Callable[[], float] = time.monotonic) -> None:
+        '''
+        :param address: The OSC address the queries are sent to.
+        :type address: str
+        :param args_list: The arguments of each query.
+        :type args_list: typing.Sequence[typing.Tuple]
+        :param clock: The clock the time the queries were sent is read from. Defaults to time.monotonic.
+        :type clock: typing.Callable[[], float]
+        '''
+        self.address: str = address
+        self.expected: Set[Tuple] = set(tuple(args) for args in args_list)
+        self.replies: Dict[Tuple, Tuple] = {}
+        self.sent: float = clock()
+        self.complete: threading.Event = threading.Event()
+        self.lock: threading.Lock = threading.Lock()
+
+        if not self.expected:
+            self.complete.set()
+
+    def add_reply(self, data: Tuple) -> bool:
+        '''Records a reply if it answers one of the expected queries.
+
+        :param data: The values of the OSC reply.
+        :type data: typing.Tuple
+
+        :returns: A boolean indicating if the reply answered a query.
+        :rtype: bool
+        '''
+        recorded: bool = False
+        with self.lock:
+            for key_length in {len(key) for key in self.expected}:
+                key = tuple(data[:key_length])
+                if key in self.expected and key not in self.replies:
+                    self.replies[key] = data
+                    recorded = True
+                    break
+
+            if len(self.replies) == len(self.expected):
+                self.complete.set()
+
+        return recorded
+
+    def missing(self) -> List[Tuple]:
+        '''Lists the queries that have not been answered yet.
+
+        :returns: The arguments of the unanswered queries.
+        :rtype: typing.List[typing.Tuple]
+        '''
+        with self.lock:
+            return [key for key in self.expected if key not in self.replies]
+
+
 class AbletonClipMonitor():
     '''
     This class is used to manage the variables for monitoring Ableton.
@@ -91,23 +293,127 @@ class AbletonClipMonitor():
     **Class Properties**
 
     * dim_color: Optional[str] - The color to dim to
+    * dim_color_int: Optional[int] - The color to dim to as a single integer,
+      parsed once from dim_color.
     * dim_ratio: float - The ratio to dim to.
     * polling_delay: float - The delay between scans of the live set tracks.
-    * polling_delay: float - The delay between scans of the live set tracks.
-    * ableton: live.Set - The pylive Set object
+    * scheduler: FixedRateScheduler - Paces the scans at polling_delay on
+      the monotonic clock and measures the jitter.
+    * adaptive_polling: Optional[AdaptivePollingDelay] - When requested,
+      adjusts polling_delay to how fast Live answers the sweeps.
+    * max_idle_delay: float - The longest wait between checks of the
+      transport while Ableton is stopped.
+    * idle_delay: float - The next wait while Ableton is stopped. It starts
+      at polling_delay and doubles after every wait, up to max_idle_delay.
+    * transport_listener: bool - If set, the is_playing listener of
+      AbletonOSC ends the waits as soon as the transport changes.
+    * transport_changed: threading.Event - Set by the is_playing listener
+      when the transport starts or stops.
+    * transport_playing: Optional[bool] - The state of the transport in the
+      last is_playing message, None before the first one.
+    * clock: typing.Callable[[], float] - The clock every timer of the monitor reads.
+    * mode: str - Either 'poll' to query every track each cycle, 'events'
+      to subscribe to AbletonOSC playing_slot_index listeners or 'quantized'
+      to scan just after each launch quantization boundary.
+    * listener_timeout: float - In 'events' mode, the number of seconds
+      without a listener message before the tracks are verified by polling.
+    * sweep_timeout: float - The number of seconds a pipelined sweep waits
+      for all of its replies.
+    * color_refresh_interval: float - The number of seconds between reloads
+      of the clip color grid.
+    * restore_bundle_size: int - The number of color commands packed into
+      each OSC bundle when the colors are restored.
+    * restore_max_in_flight: int - The number of restore commands sent
+      before waiting for Ableton to catch up.
+    * idle_sweep_share: float - The share of the idle tracks scanned each
+      cycle. Tracks with a playing clip are scanned every cycle.
+    * predict_clip_end: bool - If set, a track with a playing clip is only
+      scanned every cycle around the predicted end of its clip.
+    * clip_end_predictor: ClipEndPredictor - The predicted clip end times.
+    * sparse_polling_delay: float - In 'quantized' mode, the number of
+      seconds between scans between the quantization boundaries.
+    * beat_scheduler: BeatBoundaryScheduler - In 'quantized' mode, follows
+      Live's beat and schedules a scan after each quantization boundary.
+    * ableton: Optional[live.Set] - The pylive Set object. None when a
+      connection was passed in, or until monitor() opens it.
+    * connection: Any - The object used to talk to AbletonOSC. It provides
+      the query, cmd and add_handler methods of the pylive Query object.
+      None until connect() is called when no connection was passed in.
+    * record: Optional[str] - The file the session is recorded to, if any.
+    * recorder: Optional[SessionRecorder] - Writes the messages exchanged
+      with AbletonOSC to a log when a recording was requested.
     * num_of_tracks: int - The number of tracks in the live set.
-    * original_cell_color: typing.Dict - A dictionary tracking the original
-      color in the cells that have been changed.
+    * track_names: typing.List[str] - The track names, used to spot tracks
+      being added, removed or moved while monitoring.
+    * layout_check_interval: float - The number of seconds between checks
+      of the track names.
+    * original_cell_color: typing.Dict - The original color of the cells
+      that have been changed, keyed by (track index, clip index).
+    * journal: Optional[ColorJournal] - Keeps original_cell_color on disk
+      when a journal file was requested.
+    * recover: bool - If set, the colors in the journal are restored when
+      monitoring starts.
     * dim_clip_on_track: typing.Dict - When a track starts to play, we make
-      a record in this dictionary. When it is no longer playing, we know it
-      is time to dim the clip.
+      a PlayingClip record in this dictionary. When it is no longer playing,
+      we know it is time to dim the clip.
+    * metrics: MonitorMetrics - The counters and latency histograms of the
+      sweeps, queries, commands, dims and restores.
+    * print_stats: bool - If set, a summary of the metrics is printed every
+      stats_interval seconds.
+    * stats_file: Optional[str] - If set, the metrics are written to this
+      file in the Prometheus text format every stats_interval seconds.
+    * clip_color_grid: typing.Dict - The current color of every clip slot
+      keyed by track index, loaded at startup so a clip launch never waits
+      on a color query. Empty slots are None. It is updated as colors are
+      written, so a write of the color a clip already has is dropped.
+    * write_queue: WriteQueue - The clip color commands waiting to be sent,
+      dims before restores, at no more than write_rate commands per second.
+    * write_backlog_since: Optional[float] - The clock value when commands
+      started to wait on the rate limit, None when none are waiting.
+    * coalesce_window: float - The number of seconds a dim command is held
+      before it is sent, so a restore that follows it cancels both.
+    * output: Union[BackgroundWriter, PrefixedWriter] - Writes the messages of the monitor to
+      stdout from a background thread, so a slow terminal never delays a
+      scan.
     '''
     def __init__(
             self,
             dim_color: Optional[str] = None,
             dim_ratio: float = 2.0,
             polling_delay: float = 0.1,
-            no_reset: bool = False) -> None:
+            no_reset: bool = False,
+            mode: str = 'poll',
+            listener_timeout: float = 2.0,
+            sweep_timeout: float = 1.0,
+            connection: Any = None,
+            color_refresh_interval: float = 10.0,
+            restore_bundle_size: int = 16,
+            restore_max_in_flight: int = 64,
+            overrun: str = 'skip',
+            idle_sweep_share: float = 1.0,
+            predict_clip_end: bool = False,
+            prediction_window: float = 0.25,
+            prediction_fallback_interval: float = 1.0,
+            sparse_polling_delay: float = 1.0,
+            boundary_offset: float = 0.02,
+            layout_check_interval: float = 2.0,
+            print_stats: bool = False,
+            stats_file: Optional[str] = None,
+            stats_interval: float = 10.0,
+            record: Optional[str] = None,
+            journal: Optional[str] = None,
+            recover: bool = False,
+            coalesce_window: float = 0.0,
+            write_rate: float = 0.0,
+            write_burst: int = 16,
+            adaptive_polling: bool = False,
+            min_polling_delay: float = 0.02,
+            max_polling_delay: float = 0.5,
+            latency_target: float = 0.05,
+            max_idle_delay: Optional[float] = None,
+            transport_listener: bool = False,
+            clock: Callable[[], float] = time.monotonic,
+            sleep: Callable[[float], None] = time.sleep) -> None:
         '''
         :param dim_color: The color, in hex such as FFFFFF, to dim to.
         :type dim_color: Optional[str]
@@ -120,22 +426,205 @@ class AbletonClipMonitor():
         :type polling_delay: float
         :param no_reset: If set to true, ableton will not be reset when it stops playing.
         :type no_reset: bool
+        :param mode:
+            'poll' queries every track each polling cycle. 'events' subscribes
+            to the AbletonOSC playing_slot_index listener of every track and
+            only reacts to the changes Ableton pushes. 'quantized' follows the
+            beat of the song and scans just after each launch quantization
+            boundary, when launched clips actually start and stop, and every
+            sparse_polling_delay seconds in between.
+        :type mode: str
+        :param listener_timeout:
+            In 'events' mode, if no listener message arrives for this many
+            seconds, the tracks are polled once to verify the subscriptions.
+            If the poll finds a change the listeners missed, the monitor falls
+            back to polling.
+        :type listener_timeout: float
+        :param sweep_timeout:
+            Every track is queried at once during a sweep. This is the number
+            of seconds to wait for the replies. Tracks that have not replied
+            by then are checked again on the next sweep.
+        :type sweep_timeout: float
+        :param connection:
+            An object with the query, cmd and add_handler methods of the
+            pylive Query object. Defaults to the connection of a new live.Set,
+            which is opened by connect() when monitoring starts.
+        :type connection: Any
+        :param color_refresh_interval:
+            The colors of every clip slot are loaded when monitoring starts.
+            They are reloaded this often, in seconds, whether Ableton plays or
+            not, to pick up colors changed in Live.
+        :type color_refresh_interval: float
+        :param restore_bundle_size:
+            When the colors are restored, the commands are sorted by track and
+            packed this many to an OSC bundle. 1 sends single messages, which
+            older versions of AbletonOSC need.
+        :type restore_bundle_size: int
+        :param restore_max_in_flight:
+            When the colors are restored, after this many commands the monitor
+            waits for Ableton to answer a query before sending more.
+        :type restore_max_in_flight: int
+        :param overrun:
+            The scans start every polling_delay seconds no matter how long they
+            take. When a scan takes longer than polling_delay, 'skip' drops the
+            missed scans and 'catch-up' runs them back to back.
+        :type overrun: str
+        :param idle_sweep_share:
+            Tracks with a playing clip are scanned every cycle. Tracks without
+            one are scanned on a rotating sweep that covers this share of them
+            each cycle, so a launch on an idle track is seen within
+            1/idle_sweep_share cycles. 1.0 scans every track every cycle.
+        :type idle_sweep_share: float
+        :param predict_clip_end:
+            If set, the length, playing position and looping state of a clip
+            and the song tempo are queried when it starts, to predict when it
+            will end. Its track is then scanned every cycle only from
+            prediction_window seconds before that time, and every
+            prediction_fallback_interval seconds before then in case the clip
+            is stopped early. Looping clips are scanned every
+            prediction_fallback_interval seconds. Not used in 'events' mode.
+        :type predict_clip_end: bool
+        :param prediction_window: The number of seconds before the predicted end a track is scanned every cycle.
+        :type prediction_window: float
+        :param prediction_fallback_interval: The number of seconds between scans of a playing track away from its predicted end.
+        :type prediction_fallback_interval: float
+        :param sparse_polling_delay: In 'quantized' mode, the number of seconds between scans between the quantization boundaries.
+        :type sparse_polling_delay: float
+        :param boundary_offset: In 'quantized' mode, the number of seconds after a quantization boundary the scan runs.
+        :type boundary_offset: float
+        :param layout_check_interval:
+            The track names are read this often, in seconds, while monitoring.
+            When tracks are added, removed or moved, the state of every track
+            is moved to its new index and the new tracks are scanned.
+        :type layout_check_interval: float
+        :param print_stats: If set to true, a summary of the metrics is printed every stats_interval seconds.
+        :type print_stats: bool
+        :param stats_file:
+            If set, the metrics are written to this file in the Prometheus text
+            format every stats_interval seconds, replacing it atomically so the
+            node exporter textfile collector never reads a partial file.
+        :type stats_file: Optional[str]
+        :param stats_interval: The number of seconds between reports of the metrics.
+        :type stats_interval: float
+        :param record:
+            If set, every query, reply and command exchanged with AbletonOSC
+            is written to this file, which can be replayed with
+            pylive_played_clip.recording.
+        :type record: Optional[str]
+        :param journal:
+            If set, the original color of each clip is appended to this file,
+            synced to disk in batches off the scan loop, so the colors can be
+            restored after a crash. The colors left in the file by an earlier
+            run are restored with the others. The file is compacted each time
+            the colors are restored.
+        :type journal: Optional[str]
+        :param recover:
+            If set to true, the colors left in the journal by an earlier run
+            are restored in one bulk restore as soon as monitoring starts.
+        :type recover: bool
+        :param coalesce_window:
+            The number of seconds a dim command is held before it is sent. A
+            restore of the clip within that time cancels it, so neither is
+            sent. 0 sends the dims right away.
+        :type coalesce_window: float
+        :param write_rate:
+            The most clip color commands sent per second, so a large restore
+            or many clips ending at once do not stall Live's main thread,
+            where AbletonOSC applies them. Dims are sent before restores and a
+            restore is spread over the following cycles. 0 is unlimited.
+        :type write_rate: float
+        :param write_burst: The most clip color commands sent at once after a pause when write_rate is set.
+        :type write_burst: int
+        :param adaptive_polling:
+            If set, the polling delay starts at polling_delay and is adjusted
+            after every sweep between min_polling_delay and max_polling_delay.
+            It backs off when a sweep takes longer than latency_target or a
+            query times out, and shortens while Live answers quickly. Only
+            used in 'poll' mode.
+        :type adaptive_polling: bool
+        :param min_polling_delay: With adaptive_polling, the shortest number of seconds between scans.
+        :type min_polling_delay: float
+        :param max_polling_delay: With adaptive_polling, the longest number of seconds between scans.
+        :type max_polling_delay: float
+        :param latency_target: With adaptive_polling, a sweep answered slower than this many seconds backs off the polling.
+        :type latency_target: float
+        :param max_idle_delay:
+            While Ableton is stopped, the delay between checks of the
+            transport doubles from polling_delay up to this many seconds.
+            Defaults to polling_delay, which keeps the checks at polling_delay.
+        :type max_idle_delay: Optional[float]
+        :param transport_listener:
+            If set, the monitor subscribes to the is_playing listener of
+            AbletonOSC. A change of the transport then ends the wait at once,
+            so scanning starts the moment Live plays and the colors are
+            restored the moment it stops, however long max_idle_delay is.
+        :type transport_listener: bool
+        :param clock:
+            The clock, in seconds, every timer of the monitor reads, such as
+            the virtual clock of a replay. Defaults to time.monotonic.
+        :type clock: typing.Callable[[], float]
+        :param sleep: Sleeps on the clock. Defaults to time.sleep.
+        :type sleep: typing.Callable[[float], None]
 
         :returns: An instance of the AbletonClipMonitor object.
         :rtype: `AbletonClipMonitor`
         '''
+        self.clock: Callable[[], float] = clock
         self.dim_color: Optional[str] = dim_color
         self.dim_ratio: float = dim_ratio
         self.polling_delay = polling_delay
         self.no_reset = no_reset
-        self.ableton: live.Set = live.Set()
+        self.mode: str = mode
+        self.listener_timeout: float = listener_timeout
+        self.sweep_timeout: float = sweep_timeout
+        self.color_refresh_interval: float = color_refresh_interval
+        self.restore_bundle_size: int = max(1, restore_bundle_size)
+        self.restore_max_in_flight: int = max(1, restore_max_in_flight)
+        self.idle_sweep_share: float = idle_sweep_share
+        self.idle_sweep_position: int = 0
+        self.predict_clip_end: bool = predict_clip_end
+        self.prediction_fallback_interval: float = prediction_fallback_interval
+        self.clip_end_predictor: ClipEndPredictor = ClipEndPredictor(prediction_window, clock)
+        self.clips_to_predict: List[Tuple[int, int]] = []
+        self.sparse_polling_delay: float = sparse_polling_delay
+        self.beat_scheduler: BeatBoundaryScheduler = BeatBoundaryScheduler(offset=boundary_offset, clock=clock)
+        self.beat_listener_registered: bool = False
+        self.last_scanned: Dict[int, float] = {}
+        self.ableton: Any = None
+        self.record: Optional[str] = record
+        self.recorder: Optional['SessionRecorder'] = None
+        self.connection: Any = None
+        if connection is not None:
+            self.use_connection(connection)
         self.num_of_tracks: int = 0
+        self.num_tracks: int = 0
+        self.track_names: List[str] = []
+        self.metrics: MonitorMetrics = MonitorMetrics()
+        self.output: Union[BackgroundWriter, PrefixedWriter] = BackgroundWriter()
+        self.print_stats: bool = print_stats
+        self.stats_file: Optional[str] = stats_file
+        self.stats_interval: float = stats_interval
+        self.stats_reported: float = self.clock()
+        self.layout_check_interval: float = layout_check_interval
+        self.layout_checked: float = 0.0
+
+        self.listening: bool = False
+        self.listener_registered: bool = False
+        self.last_listener_message: float = 0.0
+        self.slot_events: queue.Queue = queue.Queue()
+        self.pending_queries: Dict[str, PendingQueries] = {}
+        self.reply_handlers: Set[str] = set()
 
         if dim_color is not None and dim_color.startswith('#'):
             self.dim_color = dim_color[1:]
 
-        self.original_cell_color: Dict = {}
-        self.dim_clip_on_track: Dict = {}
+        self.original_cell_color: Dict[Tuple[int, int], int] = {}
+        self.coalesce_window: float = max(0.0, coalesce_window)
+        self.write_queue: WriteQueue = WriteQueue(write_rate, write_burst, clock)
+        self.write_backlog_since: Optional[float] = None
+        self.dim_clip_on_track: Dict[int, Optional[PlayingClip]] = {}
+        self.clip_color_grid: Dict[int, List[Optional[int]]] = {}
+        self.clip_color_grid_loaded: float = 0.0
 
         if not self.dim_color_is_valid(self.dim_color):
             raise AbletonClipMonitorException('The dim_color can be null or '
@@ -148,6 +637,88 @@ class AbletonClipMonitor():
                                               'less. We received '
                                               f"\"{self.dim_ratio}\".")
 
+        self.dim_color_int: Optional[int] = None
+        if self.dim_color:
+            self.dim_color_int = rgbToColorInt(*hexToRgb(self.dim_color))
+        else:
+            self.prewarm_dim_colors(LIVE_CLIP_COLOR_PALETTE)
+
+        if overrun not in OVERRUN_POLICIES:
+            raise AbletonClipMonitorException('The overrun must be one of '
+                                              f"{', '.join(OVERRUN_POLICIES)}. "
+                                              f"We received \"{overrun}\".")
+        self.scheduler: FixedRateScheduler = FixedRateScheduler(float(self.polling_delay), overrun, clock=clock, sleep=sleep)
+
+        if not 0.0 < self.idle_sweep_share <= 1.0:
+            raise AbletonClipMonitorException('The idle_sweep_share must be '
+                                              'greater than 0 and at most 1. '
+                                              f"We received \"{self.idle_sweep_share}\".")
+
+        if self.mode not in MONITOR_MODES:
+            raise AbletonClipMonitorException('The mode must be one of '
+                                              f"{', '.join(MONITOR_MODES)}. "
+                                              f"We received \"{self.mode}\".")
+
+        if self.predict_clip_end and self.mode == 'events':
+            raise AbletonClipMonitorException('The clip end prediction cannot '
+                                              'be used in the events mode.')
+
+        self.max_idle_delay: float = max(float(self.polling_delay), float(self.polling_delay) if max_idle_delay is None else max_idle_delay)
+        self.idle_delay: float = float(self.polling_delay)
+        self.transport_listener: bool = transport_listener
+        self.transport_listener_registered: bool = False
+        self.transport_changed: threading.Event = threading.Event()
+        self.transport_playing: Optional[bool] = None
+
+        self.adaptive_polling: Optional[AdaptivePollingDelay] = None
+        self.polling_delay_logged: float = float(self.polling_delay)
+        if adaptive_polling:
+            if self.mode != 'poll':
+                raise AbletonClipMonitorException('The adaptive polling can only be used in the poll mode.')
+            try:
+                self.adaptive_polling = AdaptivePollingDelay(min_polling_delay, max_polling_delay, latency_target,
+                                                             initial_delay=float(self.polling_delay))
+            except ValueError as error:
+                raise AbletonClipMonitorException(str(error)) from error
+            self.polling_delay = self.scheduler.period = self.adaptive_polling.delay
+
+        self.recover: bool = recover
+        if self.recover and not journal:
+            raise AbletonClipMonitorException('The colors can only be recovered from a journal.')
+        self.journal: Optional['ColorJournal'] = None
+        if journal:
+            from pylive_played_clip import journal as color_journal
+            self.original_cell_color.update(color_journal.read_journal(journal))
+            self.journal = color_journal.ColorJournal(journal)
+
+    def connect(self) -> None:
+        '''Opens a pylive connection to Ableton, unless the monitor already
+        has a connection. It is called when monitoring starts, so a monitor
+        can be built without Ableton running.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        if self.connection is None:
+            self.ableton = live.Set()
+            self.use_connection(self.ableton.live)
+
+    def use_connection(self, connection: Any) -> None:
+        '''Talks to Ableton through a connection, recorded to the record
+        file when one was requested.
+
+        :param connection: An object with the query, cmd and add_handler methods of the pylive Query object.
+        :type connection: Any
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        if self.record:
+            from pylive_played_clip.recording import RecordingConnection, SessionRecorder
+            self.recorder = SessionRecorder(self.record)
+            connection = RecordingConnection(connection, self.recorder)
+        self.connection = connection
+
     def dim_color_is_valid(self, dim_color: Optional[str]) -> bool:
         '''Tests if the string defining the color is valid.
 
@@ -182,38 +753,352 @@ class AbletonClipMonitor():
 
         return ratio_is_ok
 
+    def query(self, address: str, args: Sequence = ()) -> Tuple:
+        '''Sends a query to AbletonOSC, waits for the reply and records its
+        round trip time.
+
+        :param address: The OSC address to query.
+        :type address: str
+        :param args: The values of the query.
+        :type args: typing.Sequence
+
+        :returns: The values of the reply.
+        :rtype: typing.Tuple
+        '''
+        start: float = self.clock()
+        reply: Tuple = self.connection.query(address, tuple(args))
+        self.metrics.increment('queries')
+        self.metrics.observe('query_seconds', self.clock() - start)
+        return reply
+
+    def cmd(self, address: str, args: Sequence = ()) -> None:
+        '''Sends a command to AbletonOSC and records it.
+
+        :param address: The OSC address of the command.
+        :type address: str
+        :param args: The values of the command.
+        :type args: typing.Sequence
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        start: float = self.clock()
+        self.connection.cmd(address, tuple(args))
+        self.metrics.increment('commands')
+        self.metrics.observe('command_seconds', self.clock() - start)
+
+    def report_stats(self, force: bool = False) -> None:
+        '''Prints the summary of the metrics and writes the Prometheus text
+        file, when requested, every stats_interval seconds.
+
+        :param force: If set to true, the metrics are reported right away.
+        :type force: bool
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        if not (self.print_stats or self.stats_file):
+            return
+        if not force and self.clock() - self.stats_reported < self.stats_interval:
+            return
+
+        self.stats_reported = self.clock()
+        if self.print_stats:
+            self.output.write(f"Stats: {self.metrics.summary()}")
+        if self.stats_file:
+            try:
+                write_atomically(self.stats_file, self.metrics.to_prometheus())
+            except OSError as error:
+                logging.warning('Could not write the stats file %s: %s', self.stats_file, error)
+
     def get_number_of_tracks(self) -> int:
         '''Queries Ableton to get the number of tracks in the open set.
 
         :returns: The number of tracks in the live set.
         :type: int
         '''
-        num_tracks: int = self.ableton.live.query('/live/song/get/num_tracks')[0]
+        num_tracks: int = self.query('/live/song/get/num_tracks')[0]
         return num_tracks
 
+    def get_track_names(self) -> List[str]:
+        '''Queries Ableton for the name of every track in the open set.
+
+        :returns: The track names in order.
+        :rtype: typing.List[str]
+        '''
+        return [str(name) for name in self.query('/live/song/get/track_names')]
+
+    def check_track_layout(self) -> bool:
+        '''Reads the track names every layout_check_interval seconds and
+        updates the monitor when tracks were added, removed or moved.
+
+        :returns: A boolean indicating if the tracks changed.
+        :rtype: bool
+        '''
+        if self.clock() - self.layout_checked < self.layout_check_interval:
+            return False
+
+        self.layout_checked = self.clock()
+        track_names: List[str] = self.get_track_names()
+        if track_names == self.track_names:
+            return False
+
+        # The listeners are keyed by the old track indexes.
+        listening: bool = self.listening
+        if listening:
+            self.process_slot_events(0)
+            self.stop_listeners()
+        new_tracks: List[int] = self.update_track_layout(track_names) or []
+        if listening:
+            self.start_listeners()
+        if new_tracks:
+            self.load_clip_color_grid(new_tracks)
+            for track_index in new_tracks:
+                self.scan_track(track_index)
+        return True
+
+    def update_track_layout(self, track_names: Sequence[str]) -> Optional[List[int]]:
+        '''Moves the state kept for every track to its new index when the
+        track names show that tracks were added, removed or moved. The
+        original colors of the clips on removed tracks are dropped.
+
+        :param track_names: The current track names.
+        :type track_names: typing.Sequence[str]
+
+        :returns: The indexes of the added tracks, or None if nothing changed.
+        :rtype: Optional[typing.List[int]]
+        '''
+        track_names = list(track_names)
+        if track_names == self.track_names:
+            return None
+
+        track_map: Dict[int, int] = map_track_indexes(self.track_names, track_names)
+        removed: int = len(self.track_names) - len(track_map)
+        new_tracks: List[int] = sorted(set(range(len(track_names))) - set(track_map.values()))
+        logging.info('The live set now has %d tracks, %d added and %d removed.',
+                     len(track_names), len(new_tracks), removed)
+
+        self.original_cell_color = {(track_map[track_index], clip_index): color
+                                    for ((track_index, clip_index), color) in self.original_cell_color.items()
+                                    if track_index in track_map}
+
+        self.dim_clip_on_track = {track_map[track_index]: info
+                                  for (track_index, info) in self.dim_clip_on_track.items() if track_index in track_map}
+        self.clip_color_grid = {track_map[track_index]: row
+                                for (track_index, row) in self.clip_color_grid.items() if track_index in track_map}
+        self.last_scanned = {track_map[track_index]: scanned
+                             for (track_index, scanned) in self.last_scanned.items() if track_index in track_map}
+        self.clips_to_predict = [(track_map[track_index], clip_index)
+                                 for (track_index, clip_index) in self.clips_to_predict if track_index in track_map]
+        self.write_queue.remap(track_map)
+        self.clip_end_predictor.remap(track_map)
+        if self.journal is not None:
+            self.journal.rewrite(self.original_cell_color)
+
+        self.track_names = track_names
+        self.num_tracks = len(track_names)
+        return new_tracks
+
+    def is_playing(self) -> bool:
+        '''Queries Ableton to find out if the transport is playing.
+
+        :returns: A boolean indicating if Ableton is playing.
+        :rtype: bool
+        '''
+        return bool(self.query('/live/song/get/is_playing')[0])
+
+    def load_quantization(self) -> None:
+        '''Queries the launch quantization and time signature of the song
+        and sets the number of beats between the boundaries the 'quantized'
+        mode scans after.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        quantization: int = self.query('/live/song/get/clip_trigger_quantization')[0]
+        signature_numerator: int = self.query('/live/song/get/signature_numerator')[0]
+        self.beat_scheduler.quantum = quantization_to_beats(quantization, signature_numerator)
+        logging.debug('Scanning every %s beats.', self.beat_scheduler.quantum)
+
+    def start_beat_listener(self) -> None:
+        '''Subscribes to the beat listener of the song. AbletonOSC then
+        pushes a message on every beat while Ableton is playing.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        if not self.beat_listener_registered:
+            self.connection.add_handler('/live/song/get/beat', self.beat_scheduler.on_beat)
+            self.beat_listener_registered = True
+
+        self.cmd('/live/song/start_listen/beat')
+
+    def stop_beat_listener(self) -> None:
+        '''Removes the beat listener of the song.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.cmd('/live/song/stop_listen/beat')
+
+    def wait_for_next_scan(self) -> None:
+        '''Waits until the next scan while Ableton is playing. In 'quantized'
+        mode this is just after the next quantization boundary or
+        sparse_polling_delay seconds after this scan, whichever comes first.
+        Without launch quantization, clips start right away so the scans
+        follow polling_delay.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        if self.mode != 'quantized' or self.beat_scheduler.quantum is None:
+            if not self.transport_listener:
+                self.scheduler.wait()
+                return
+            # The transport listener cuts the wait short when Live stops, so the colors are restored at once.
+            if self.transport_changed.wait(self.scheduler.next_delay()):
+                self.transport_changed.clear()
+            self.scheduler.mark_woken()
+            return
+
+        # The scheduler is restarted after every wait so its next tick is
+        # when this cycle started.
+        cycle_started: float = self.scheduler.next_tick or self.clock()
+        self.beat_scheduler.wait(cycle_started + self.sparse_polling_delay)
+        self.scheduler.start()
+
+    def wait_while_stopped(self) -> None:
+        '''Waits before the transport is checked again while Ableton is
+        stopped. The wait doubles every time, from polling_delay up to
+        max_idle_delay. With the transport listener, it ends as soon as Live
+        starts to play.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        if not self.transport_listener and self.max_idle_delay <= self.polling_delay:
+            self.scheduler.wait()
+            return
+
+        delay: float = self.next_idle_delay()
+        if not self.transport_listener:
+            self.scheduler.sleep(delay)
+        elif self.transport_changed.wait(delay):
+            self.transport_changed.clear()
+        # The wait does not follow the schedule, so it starts again from now.
+        self.scheduler.start()
+
+    def next_idle_delay(self) -> float:
+        '''Returns how long to wait while Ableton is stopped and doubles the
+        next wait, up to max_idle_delay. While color commands wait in the
+        write queue, the wait stays at polling_delay so they are sent at the
+        write rate.
+
+        :returns: The number of seconds to wait.
+        :rtype: float
+        '''
+        if len(self.write_queue):
+            self.idle_delay = float(self.polling_delay)
+            return self.idle_delay
+
+        delay: float = self.idle_delay
+        self.idle_delay = min(self.max_idle_delay, self.idle_delay * 2)
+        if delay < self.idle_delay == self.max_idle_delay:
+            logging.debug('Ableton is stopped, checking the transport every %.1f seconds.', self.max_idle_delay)
+        return delay
+
+    def start_transport_listener(self) -> None:
+        '''Subscribes to the is_playing listener of the song. AbletonOSC then
+        pushes a message whenever the transport starts or stops.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        if not self.transport_listener_registered:
+            self.connection.add_handler('/live/song/get/is_playing', self.on_is_playing)
+            self.transport_listener_registered = True
+
+        self.cmd('/live/song/start_listen/is_playing')
+
+    def stop_transport_listener(self) -> None:
+        '''Removes the is_playing listener of the song.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.cmd('/live/song/stop_listen/is_playing')
+
+    def note_transport(self, playing: int) -> bool:
+        '''Records the state of the transport seen in an is_playing message.
+
+        :param playing: 1 if the transport is playing, 0 if it is stopped.
+        :type playing: int
+
+        :returns: A boolean indicating if the transport changed since the previous message.
+        :rtype: bool
+        '''
+        previous: Optional[bool] = self.transport_playing
+        self.transport_playing = bool(playing)
+        return previous is not None and previous != self.transport_playing
+
+    def on_is_playing(self, playing: int, *args) -> None:
+        '''Handler for the is_playing messages. It runs on the OSC server
+        thread so it only wakes the monitor loop. The replies to the
+        is_playing queries arrive on the same address, so only a change of
+        the transport wakes it.
+
+        :param playing: 1 if the transport is playing, 0 if it is stopped.
+        :type playing: int
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        if not self.note_transport(playing):
+            return
+        self.transport_changed.set()
+        if self.listening:
+            # Ends the wait for listener messages in the 'events' mode.
+            self.slot_events.put(None)
+
     def capture_playing_clip_info(
             self,
             track_index: int,
-            playing_clip_index: int) -> None:
+            playing_clip_index: int,
+            color: Optional[int] = None) -> None:
         '''Records the information of the currently playing clip.
 
         :param track_index: The index of the live set track to query.
         :type track_index: int
         :param playing_clip_index: The index of the clip in the live set track to query.
         :type playing_clip_index: int
+        :param color: The color of the clip if it is already known. Otherwise Ableton is queried for it.
+        :type color: Optional[int]
 
         :returns: Nothing
         :rtype: None
         '''
         if not self.dim_clip_on_track.get(track_index):
-            cell_index = f"{track_index}.{playing_clip_index}"
-            color = self.get_clip_color(track_index, playing_clip_index)
-
-            print(f"Playing track {track_index}, clip {playing_clip_index} with color {colorIntToRgbString(color)}")
-            self.dim_clip_on_track[track_index] = {'clip_index': playing_clip_index, 'color': color}
-
-            if cell_index not in self.original_cell_color:
-                self.original_cell_color[cell_index] = color
+            if color is None:
+                color = self.get_known_clip_color(track_index, playing_clip_index)
+            if color is None:
+                color = self.get_clip_color(track_index, playing_clip_index)
+                self.set_known_clip_color(track_index, playing_clip_index, color)
+            queued: Optional[int] = self.write_queue.get(track_index, playing_clip_index)
+            if queued is not None:
+                # The clip is about to get the color waiting in the queue, such as its original color.
+                color = queued
+
+            self.output.write(f"Playing track {track_index}, clip {playing_clip_index} with color {colorIntToRgbString(color)}")
+            self.dim_clip_on_track[track_index] = PlayingClip(playing_clip_index, color)
+
+            # The first color recorded is the one from before the clip was first dimmed.
+            if (track_index, playing_clip_index) not in self.original_cell_color:
+                self.original_cell_color[(track_index, playing_clip_index)] = color
+                if self.journal is not None:
+                    self.journal.record(track_index, playing_clip_index, color)
+
+            if self.predict_clip_end:
+                self.clips_to_predict.append((track_index, playing_clip_index))
 
     def dim_color_of_played_clip(self, track_index: int) -> None:
         '''Records the information of the currently playing clip.
@@ -224,21 +1109,19 @@ class AbletonClipMonitor():
         :returns: Nothing
         :rtype: None
         '''
-        if self.dim_clip_on_track.get(track_index):
+        playing_clip: Optional[PlayingClip] = self.dim_clip_on_track.get(track_index)
+        if playing_clip is not None:
 
-            if self.dim_color:
-                (red, green, blue) = hexToRgb(self.dim_color)
-                dim_color = rgbToColorInt(red, green, blue)
+            if self.dim_color_int is not None:
+                dim_color = self.dim_color_int
             else:
                 dim_color = self.get_dimmed_color_int_from_ratio(track_index)
 
-            print(f"Dimming track {track_index}, clip {self.dim_clip_on_track[track_index]['clip_index']} to color {colorIntToRgbString(dim_color)}")
-            self.ableton.live.cmd(
-                '/live/clip/set/color',
-                (track_index,
-                 self.dim_clip_on_track[track_index]['clip_index'],
-                 dim_color))
+            if self.queue_clip_color(track_index, playing_clip.clip_index, dim_color):
+                self.output.write(f"Dimming track {track_index}, clip {playing_clip.clip_index} to color {colorIntToRgbString(dim_color)}")
+                self.flush_clip_colors()
             self.dim_clip_on_track[track_index] = None
+            self.clip_end_predictor.forget(track_index)
 
     def get_dimmed_color_int_from_ratio(self, track_index) -> int:
         '''Get the color we should dim to based on the recorded clip color
@@ -247,13 +1130,28 @@ class AbletonClipMonitor():
         :param track_index: The index of the live set track to query.
         :type track_index: int
 
+        :returns: The dimmed color as an integer.
+        :rtype: int
+        '''
+        return dimColorInt(self.dim_clip_on_track[track_index].color, self.dim_ratio)  # type: ignore
+
+    def prewarm_dim_colors(self, colors: Iterable[Optional[int]]) -> None:
+        '''Fills the dim color cache for the given colors so dimming a clip
+        of one of those colors is a table lookup. Does nothing when a fixed
+        dim_color is used.
+
+        :param colors: The clip colors, None values are skipped.
+        :type colors: typing.Iterable[Optional[int]]
+
         :returns: Nothing
         :rtype: None
         '''
-        (red, green, blue) = colorIntToRgb(self.dim_clip_on_track[track_index]['color'])
-        (hue, lightness, saturation) = colorsys.rgb_to_hls(red, green, blue)
-        (dim_red, dim_green, dim_blue) = colorsys.hls_to_rgb(hue, lightness/self.dim_ratio, saturation)
-        return rgbToColorInt(int(dim_red), int(dim_green), int(dim_blue))
+        if self.dim_color_int is not None:
+            return
+
+        for color in set(colors):
+            if color is not None:
+                dimColorInt(color, self.dim_ratio)
 
     def get_clip_color(self, track_index: int, playing_clip_index: int) -> int:
         '''Queries Ableton for the clip color.
@@ -266,31 +1164,648 @@ class AbletonClipMonitor():
         :returns: The clip color as a integer.
         :rtype: int
         '''
-        return int(self.ableton.live.query('/live/clip/get/color', (track_index, playing_clip_index))[2])
+        return int(self.query('/live/clip/get/color', (track_index, playing_clip_index))[2])
+
+    def load_clip_color_grid(self, track_indexes: Optional[Sequence[int]] = None) -> None:
+        '''Loads the color of every clip slot with one pipelined query per
+        track.
+
+        :param track_indexes: The tracks to load. Defaults to all of the tracks.
+        :type track_indexes: Optional[typing.Sequence[int]]
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        if track_indexes is None:
+            track_indexes = range(self.num_tracks)
+
+        replies = self.query_many('/live/track/get/clips/color', [(track_index,) for track_index in track_indexes])
+        for (key, reply) in replies.items():
+            self.store_clip_color_grid_row(key[0], reply[1:])
+
+        if track_indexes == range(self.num_tracks):
+            self.clip_color_grid_loaded = self.clock()
+        logging.debug('Loaded the clip colors of %d tracks', len(replies))
+
+    def store_clip_color_grid_row(self, track_index: int, colors: Sequence) -> None:
+        '''Stores the colors of the clip slots of a track, as returned by
+        /live/track/get/clips/color. A clip the monitor has changed the color
+        of keeps the color in the grid, as a reply to a reload can be older
+        than the last color sent to the clip.
+
+        :param track_index: The index of the live set track.
+        :type track_index: int
+        :param colors: The color of each clip slot, None for empty slots.
+        :type colors: typing.Sequence
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        row: List[Optional[int]] = [None if color is None else int(color) for color in colors]
+        for (clip_index, known) in enumerate(self.clip_color_grid.get(track_index, [])[:len(row)]):
+            if known is not None and row[clip_index] is not None and (track_index, clip_index) in self.original_cell_color:
+                row[clip_index] = known
+        self.clip_color_grid[track_index] = row
+        self.prewarm_dim_colors(self.clip_color_grid[track_index])
+
+    def get_known_clip_color(self, track_index: int, clip_index: int) -> Optional[int]:
+        '''Looks up the color of a clip in the clip color grid.
+
+        :param track_index: The index of the live set track.
+        :type track_index: int
+        :param clip_index: The index of the clip in the live set track.
+        :type clip_index: int
+
+        :returns: The clip color as an integer, or None if it is not known.
+        :rtype: Optional[int]
+        '''
+        row: Optional[List[Optional[int]]] = self.clip_color_grid.get(track_index)
+        if row is None or not 0 <= clip_index < len(row):
+            return None
+        return row[clip_index]
+
+    def set_known_clip_color(self, track_index: int, clip_index: int, color: int) -> None:
+        '''Updates the clip color grid after a color was read or written.
 
-    def restore_clip_colors(self) -> None:
-        '''Restores the clips to their original colors.
+        :param track_index: The index of the live set track.
+        :type track_index: int
+        :param clip_index: The index of the clip in the live set track.
+        :type clip_index: int
+        :param color: The clip color as an integer.
+        :type color: int
 
         :returns: Nothing
         :rtype: None
         '''
+        row: List[Optional[int]] = self.clip_color_grid.setdefault(track_index, [])
+        if clip_index >= len(row):
+            row.extend([None] * (clip_index + 1 - len(row)))
+        row[clip_index] = color
+
+    def queue_clip_color(self, track_index: int, clip_index: int, color: int, priority: int = DIM) -> bool:
+        '''Queues a /live/clip/set/color command, unless the clip already has
+        that color. See flush_clip_colors.
+
+        :param track_index: The index of the live set track.
+        :type track_index: int
+        :param clip_index: The index of the clip in the live set track.
+        :type clip_index: int
+        :param color: The clip color as an integer.
+        :type color: int
+        :param priority: DIM or RESTORE from pylive_played_clip.write_queue. Dims wait coalesce_window seconds.
+        :type priority: int
+
+        :returns: A boolean indicating if the command was queued.
+        :rtype: bool
+        '''
+        known: Optional[int] = self.get_known_clip_color(track_index, clip_index)
+        queued: Optional[int] = self.write_queue.get(track_index, clip_index)
+        if color == (known if queued is None else queued):
+            logging.debug('Track %d, clip %d already has color %d', track_index, clip_index, color)
+            self.metrics.increment('skipped_commands')
+            return False
+        if color == known:
+            # Going back to the color Live shows cancels the command waiting for the clip.
+            self.write_queue.cancel(track_index, clip_index)
+            self.metrics.increment('skipped_commands', 2)
+            return False
+
+        self.write_queue.put(priority, track_index, clip_index, color, self.coalesce_window if priority == DIM else 0.0)
+        return True
+
+    def flush_clip_colors(self, force: bool = False) -> int:
+        '''Sends the queued color commands that are ready, dims first, in
+        OSC bundles of up to restore_bundle_size commands. When write_rate
+        is set, only as many as it allows are sent and the rest wait for the
+        next call.
+
+        :param force: If set to true, every queued command is sent whatever the rate.
+        :type force: bool
+
+        :returns: The number of commands sent.
+        :rtype: int
+        '''
+        sent: int = 0
+        while True:
+            batch: List[Tuple[int, int, int]] = self.write_queue.take(self.restore_bundle_size, force)
+            if not batch:
+                break
+            self.send_clip_colors(batch)
+            sent += len(batch)
+
+        self.report_write_backlog()
+        return sent
+
+    def report_write_backlog(self) -> None:
+        '''Logs when clip color commands start to wait on write_rate, with
+        the time they will take to send, and when they have all been sent.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        if not self.write_queue.limited:
+            return
+
+        backlog: int = len(self.write_queue)
+        if backlog and self.write_backlog_since is None:
+            self.write_backlog_since = self.clock()
+            logging.info('%d clip color commands are waiting to be sent, about %.1f s at %g per second.',
+                         backlog, self.write_queue.drain_time(), self.write_queue.bucket.rate)
+        elif not backlog and self.write_backlog_since is not None:
+            logging.info('Sent the waiting clip color commands in %.1f s.', self.clock() - self.write_backlog_since)
+            self.write_backlog_since = None
+
+    def restore_clip_colors(self) -> int:
+        '''Restores the clips to their original colors. The commands are
+        sorted by track, packed into OSC bundles and sent with at most
+        restore_max_in_flight commands waiting on Ableton at any time. When
+        write_rate is set, they are queued behind the dims instead and sent
+        over the following cycles.
+
+        :returns: The number of clips restored.
+        :rtype: int
+        '''
         logging.debug('Reset colors')
-        for cell in self.original_cell_color:
-            (track_index, clip_index) = cell.split('.')
-            print(f"Reset color of track {track_index}, clip {clip_index} to original color {colorIntToRgbString(self.original_cell_color[cell])}")
-            self.ableton.live.cmd('/live/clip/set/color', (track_index, clip_index, self.original_cell_color[cell]))
+        start: float = self.clock()
+        batches: List[List[Tuple[int, int, int]]] = self.get_restore_batches()
+        if not self.queue_restore(batches):
+            in_flight: int = 0
+            for batch in batches:
+                self.send_color_batch(batch)
+                in_flight += len(batch)
+                if in_flight >= self.restore_max_in_flight or batch is batches[-1]:
+                    self.wait_for_clip_color(batch[-1])
+                    in_flight = 0
+
+        return self.finish_restore(batches, start)
+
+    def recover_clip_colors(self) -> int:
+        '''Restores the original colors left in the journal by an earlier
+        run in one bulk restore. Colors of tracks that no longer exist are
+        dropped.
+
+        :returns: The number of clips restored.
+        :rtype: int
+        '''
+        if not self.prepare_recovery():
+            return 0
+        return self.restore_clip_colors()
+
+    def prepare_recovery(self) -> bool:
+        '''Drops the colors left in the journal for tracks that no longer
+        exist and reports the recovery of the others.
+
+        :returns: A boolean indicating if there are colors to recover.
+        :rtype: bool
+        '''
+        self.original_cell_color = {(track_index, clip_index): color
+                                    for ((track_index, clip_index), color) in self.original_cell_color.items()
+                                    if track_index < self.num_tracks}
+        if not self.original_cell_color:
+            return False
+
+        self.output.write(f"Recovering the colors of {len(self.original_cell_color)} clips from the journal")
+        return True
+
+    def get_restore_batches(self) -> List[List[Tuple[int, int, int]]]:
+        '''Groups the original clip colors into batches of restore_bundle_size
+        commands, sorted by track and clip. Clips that still have their
+        original color are left out, as are the queued dims they cancel.
+
+        :returns: The batches of (track index, clip index, color) commands.
+        :rtype: typing.List[typing.List[typing.Tuple[int, int, int]]]
+        '''
+        commands: List[Tuple[int, int, int]] = []
+        skipped: int = 0
+        for ((track_index, clip_index), color) in sorted(self.original_cell_color.items()):
+            if self.get_known_clip_color(track_index, clip_index) == color:
+                skipped += 2 if self.write_queue.cancel(track_index, clip_index) else 1
+            else:
+                commands.append((track_index, clip_index, color))
+        if skipped:
+            self.metrics.increment('skipped_commands', skipped)
+
+        return [commands[index:index + self.restore_bundle_size]
+                for index in range(0, len(commands), self.restore_bundle_size)]
+
+    def queue_restore(self, batches: Sequence[Sequence[Tuple[int, int, int]]]) -> bool:
+        '''When write_rate is set, queues the restore commands behind the
+        dims, to be sent by flush_clip_colors over the following cycles.
+        Otherwise drops the queued commands they override, as the caller
+        sends them at once.
+
+        :param batches: The batches of commands from get_restore_batches.
+        :type batches: typing.Sequence[typing.Sequence[typing.Tuple[int, int, int]]]
+
+        :returns: A boolean indicating if the commands were queued.
+        :rtype: bool
+        '''
+        for batch in batches:
+            for (track_index, clip_index, color) in batch:
+                if not self.write_queue.limited:
+                    self.write_queue.cancel(track_index, clip_index)
+                    continue
+                self.output.write(f"Reset color of track {track_index}, clip {clip_index} to original color {colorIntToRgbString(color)}")
+                self.write_queue.put(RESTORE, track_index, clip_index, color)
+
+        if not self.write_queue.limited:
+            return False
+        self.flush_clip_colors()
+        return True
+
+    def send_color_batch(self, batch: Sequence[Tuple[int, int, int]]) -> None:
+        '''Sends a batch of /live/clip/set/color commands, as one OSC bundle
+        when the batch has more than one command.
+
+        :param batch: The (track index, clip index, color) commands.
+        :type batch: typing.Sequence[typing.Tuple[int, int, int]]
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        for (track_index, clip_index, color) in batch:
+            self.output.write(f"Reset color of track {track_index}, clip {clip_index} to original color {colorIntToRgbString(color)}")
+        self.send_clip_colors(batch)
 
+    def send_clip_colors(self, batch: Sequence[Tuple[int, int, int]]) -> None:
+        '''Sends /live/clip/set/color commands, as one OSC bundle when there
+        is more than one, and records the colors in the clip color grid.
+
+        :param batch: The (track index, clip index, color) commands.
+        :type batch: typing.Sequence[typing.Tuple[int, int, int]]
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        for (track_index, clip_index, color) in batch:
+            self.set_known_clip_color(track_index, clip_index, color)
+
+        if len(batch) == 1:
+            self.cmd('/live/clip/set/color', batch[0])
+            return
+
+        start: float = self.clock()
+        if hasattr(self.connection, 'send_bundle'):
+            self.connection.send_bundle('/live/clip/set/color', batch)
+        else:
+            self.connection.osc_client.send(build_osc_bundle('/live/clip/set/color', batch))
+        self.metrics.increment('commands', len(batch))
+        self.metrics.observe('command_seconds', self.clock() - start)
+
+    def wait_for_clip_color(self, command: Tuple[int, int, int]) -> None:
+        '''Waits for Ableton to answer a color query for the clip of a command
+        it was just sent. AbletonOSC handles messages in order, so the reply
+        means every command sent before it has been applied.
+
+        :param command: The (track index, clip index, color) command.
+        :type command: typing.Tuple[int, int, int]
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        try:
+            self.get_clip_color(command[0], command[1])
+        except live.exceptions.LiveConnectionError:
+            logging.warning('Ableton did not confirm the color of track %d, clip %d', command[0], command[1])
+
+    def finish_restore(self, batches: Sequence[Sequence[Tuple[int, int, int]]], start: float) -> int:
+        '''Forgets the original colors once they have been restored and
+        reports the restore.
+
+        :param batches: The batches of commands that were sent.
+        :type batches: typing.Sequence[typing.Sequence[typing.Tuple[int, int, int]]]
+        :param start: The clock value when the restore started.
+        :type start: float
+
+        :returns: The number of clips restored.
+        :rtype: int
+        '''
+        restored: int = sum(len(batch) for batch in batches)
         self.original_cell_color = {}
+        if self.journal is not None:
+            # The restores still waiting on write_rate stay in the journal.
+            self.journal.rewrite(self.write_queue.colors(RESTORE))
+        self.metrics.increment('restores')
+        self.metrics.increment('restored_clips', restored)
+        self.metrics.observe('restore_seconds', self.clock() - start)
+        self.output.write(f"Restored {restored} clips in {len(batches)} batches in {(self.clock() - start) * 1000:.1f} ms")
+        return restored
+
+    def query_many(
+            self,
+            address: str,
+            args_list: Sequence[Tuple],
+            timeout: Optional[float] = None) -> Dict[Tuple, Tuple]:
+        '''Sends one query per entry in args_list without waiting for the
+        replies in between, then waits for all of them up to a deadline.
+
+        :param address: The OSC address to query, such as /live/track/get/playing_slot_index.
+        :type address: str
+        :param args_list: The arguments of each query, such as [(0,), (1,)].
+        :type args_list: typing.Sequence[typing.Tuple]
+        :param timeout: The number of seconds to wait for all of the replies. Defaults to sweep_timeout.
+        :type timeout: Optional[float]
+
+        :returns: The reply values keyed by the arguments of the query they answer.
+            Queries that were not answered in time are left out.
+        :rtype: typing.Dict[typing.Tuple, typing.Tuple]
+        '''
+        return self.wait_for_replies(self.send_queries(address, args_list), timeout)
 
-    def scan_tracks(self) -> None:
-        '''Scans all of the tracks for clips that have started to play or
-        stopped and need to be dimmed.
+    def send_queries(self, address: str, args_list: Sequence[Tuple]) -> PendingQueries:
+        '''Sends one query per entry in args_list without waiting for the
+        replies. Several groups of queries to different addresses can be in
+        flight at once.
+
+        :param address: The OSC address to query.
+        :type address: str
+        :param args_list: The arguments of each query.
+        :type args_list: typing.Sequence[typing.Tuple]
+
+        :returns: The object collecting the replies. Pass it to wait_for_replies.
+        :rtype: PendingQueries
+        '''
+        if address not in self.reply_handlers:
+            self.connection.add_handler(address, lambda *data: self.on_reply(address, data))
+            self.reply_handlers.add(address)
+
+        pending = PendingQueries(address, args_list, self.clock)
+        self.pending_queries[address] = pending
+        try:
+            for args in args_list:
+                self.connection.cmd(address, tuple(args))
+            self.metrics.increment('queries', len(args_list))
+        except Exception:
+            del self.pending_queries[address]
+            raise
+
+        return pending
+
+    def wait_for_replies(self, pending: PendingQueries, timeout: Optional[float] = None) -> Dict[Tuple, Tuple]:
+        '''Waits up to a deadline for the replies to queries sent by send_queries.
+
+        :param pending: The object returned by send_queries.
+        :type pending: PendingQueries
+        :param timeout: The number of seconds to wait for all of the replies. Defaults to sweep_timeout.
+        :type timeout: Optional[float]
+
+        :returns: The reply values keyed by the arguments of the query they answer.
+            Queries that were not answered in time are left out.
+        :rtype: typing.Dict[typing.Tuple, typing.Tuple]
+        '''
+        if timeout is None:
+            timeout = self.sweep_timeout
+
+        try:
+            if not pending.complete.wait(timeout):
+                missing: List[Tuple] = pending.missing()
+                if len(missing) == len(pending.expected):
+                    raise live.exceptions.LiveConnectionError(
+                        f"Timed out waiting for all {len(missing)} responses to {pending.address}. "
+                        'Is Live running and AbletonOSC installed?')
+                self.metrics.increment('query_timeouts', len(missing))
+                logging.debug('No response from %s for %s within %s seconds', pending.address, missing, timeout)
+        finally:
+            del self.pending_queries[pending.address]
+
+        return pending.replies
+
+    def on_reply(self, address: str, data: Tuple) -> None:
+        '''Handler for the replies of the queries sent by query_many.
+
+        :param address: The OSC address of the reply.
+        :type address: str
+        :param data: The values of the reply.
+        :type data: typing.Tuple
 
         :returns: Nothing
         :rtype: None
         '''
+        pending: Optional[PendingQueries] = self.pending_queries.get(address)
+        if pending is not None and pending.add_reply(data):
+            self.metrics.observe('query_seconds', self.clock() - pending.sent)
+
+    def query_playing_slot_indexes(self, track_indexes: Optional[Sequence[int]] = None) -> Dict[int, int]:
+        '''Queries the playing slot index of the tracks in one pipelined sweep.
+
+        :param track_indexes: The tracks to query. Defaults to all of the tracks.
+        :type track_indexes: Optional[typing.Sequence[int]]
+
+        :returns: The playing clip index keyed by track index for the tracks that replied in time.
+        :rtype: typing.Dict[int, int]
+        '''
+        if track_indexes is None:
+            track_indexes = range(self.num_tracks)
+
+        replies = self.query_many('/live/track/get/playing_slot_index',
+                                  [(track_index,) for track_index in track_indexes])
+        return {key[0]: reply[1] for (key, reply) in replies.items()}
+
+    def get_tracks_to_scan(self) -> List[int]:
+        '''Picks the tracks for the next scan: every track with a playing clip
+        plus the next idle_sweep_share of the idle tracks in a rotating sweep.
+
+        :returns: The sorted indexes of the tracks to scan.
+        :rtype: typing.List[int]
+        '''
+        if self.idle_sweep_share >= 1.0 and not self.predict_clip_end:
+            return list(range(self.num_tracks))
+
+        hot_tracks: List[int] = []
+        idle_tracks: List[int] = []
         for track_index in range(self.num_tracks):
-            self.scan_track(track_index)
+            if self.dim_clip_on_track.get(track_index):
+                hot_tracks.append(track_index)
+            else:
+                idle_tracks.append(track_index)
+
+        if self.predict_clip_end:
+            hot_tracks = self.get_playing_tracks_to_scan(hot_tracks)
+
+        if not idle_tracks:
+            return hot_tracks
+        if self.idle_sweep_share >= 1.0:
+            return sorted(hot_tracks + idle_tracks)
+
+        sweep_size: int = min(len(idle_tracks), math.ceil(len(idle_tracks) * self.idle_sweep_share))
+        start: int = self.idle_sweep_position % len(idle_tracks)
+        swept: List[int] = (idle_tracks + idle_tracks)[start:start + sweep_size]
+        self.idle_sweep_position = start + sweep_size
+
+        return sorted(hot_tracks + swept)
+
+    def get_playing_tracks_to_scan(self, playing_tracks: Sequence[int]) -> List[int]:
+        '''Filters the tracks with a playing clip down to those near the
+        predicted end of their clip and those that have not been scanned for
+        prediction_fallback_interval seconds.
+
+        :param playing_tracks: The tracks with a playing clip.
+        :type playing_tracks: typing.Sequence[int]
+
+        :returns: The tracks with a playing clip to scan this cycle.
+        :rtype: typing.List[int]
+        '''
+        now: float = self.clock()
+        due: Set[int] = self.clip_end_predictor.due_tracks()
+        return [track_index for track_index in playing_tracks
+                if track_index in due
+                or now - self.last_scanned.get(track_index, 0.0) >= self.prediction_fallback_interval]
+
+    def predict_clip_ends(self) -> None:
+        '''Predicts when the clips that started during the last scan will
+        end. The length, playing position and looping state of every clip and
+        the song tempo are all queried at once.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        clips: List[Tuple[int, int]] = self.clips_to_predict
+        self.clips_to_predict = []
+        if not clips:
+            return
+
+        pending: List[PendingQueries] = [
+            self.send_queries(address, clips) for address in CLIP_END_ADDRESSES]
+        pending.append(self.send_queries('/live/song/get/tempo', [()]))
+        (lengths, positions, loopings, tempos) = [self.wait_for_replies(queries) for queries in pending]
+        self.record_clip_end_predictions(clips, lengths, positions, loopings, tempos)
+
+    def record_clip_end_predictions(
+            self,
+            clips: Sequence[Tuple[int, int]],
+            lengths: Dict[Tuple, Tuple],
+            positions: Dict[Tuple, Tuple],
+            loopings: Dict[Tuple, Tuple],
+            tempos: Dict[Tuple, Tuple]) -> None:
+        '''Records the predictions from the replies to the length,
+        playing_position, looping and tempo queries. Clips with a missing
+        reply get no prediction and are scanned at the fallback interval.
+
+        :param clips: The (track index, clip index) of each clip.
+        :type clips: typing.Sequence[typing.Tuple[int, int]]
+        :param lengths: The /live/clip/get/length replies.
+        :type lengths: typing.Dict[typing.Tuple, typing.Tuple]
+        :param positions: The /live/clip/get/playing_position replies.
+        :type positions: typing.Dict[typing.Tuple, typing.Tuple]
+        :param loopings: The /live/clip/get/looping replies.
+        :type loopings: typing.Dict[typing.Tuple, typing.Tuple]
+        :param tempos: The /live/song/get/tempo reply.
+        :type tempos: typing.Dict[typing.Tuple, typing.Tuple]
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        tempo: Optional[Tuple] = tempos.get(())
+        for clip in clips:
+            if tempo is None or clip not in lengths or clip not in positions or clip not in loopings:
+                continue
+            self.record_clip_end_prediction(
+                clip[0], clip[1], float(lengths[clip][2]), float(positions[clip][2]), bool(loopings[clip][2]), float(tempo[0]))
+
+    def record_clip_end_prediction(
+            self,
+            track_index: int,
+            clip_index: int,
+            length: float,
+            position: float,
+            looping: bool,
+            tempo: float) -> None:
+        '''Records when a clip that is still playing will end. Looping clips
+        only end when they are stopped, so they get no prediction.
+
+        :param track_index: The index of the live set track.
+        :type track_index: int
+        :param clip_index: The index of the clip in the live set track.
+        :type clip_index: int
+        :param length: The length of the clip in beats.
+        :type length: float
+        :param position: The playing position in the clip in beats.
+        :type position: float
+        :param looping: If the clip loops.
+        :type looping: bool
+        :param tempo: The song tempo in beats per minute.
+        :type tempo: float
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        playing_clip: Optional[PlayingClip] = self.dim_clip_on_track.get(track_index)
+        if playing_clip is None or playing_clip.clip_index != clip_index or looping or tempo <= 0:
+            return
+
+        seconds_left: float = ClipEndPredictor.seconds_until_end(length, position, tempo)
+        self.clip_end_predictor.predict(track_index, clip_index, seconds_left)
+        logging.debug('Track %d, clip %d should end in %.2f seconds', track_index, clip_index, seconds_left)
+
+    def scan_tracks(self) -> None:
+        '''Scans the tracks for clips that have started to play or stopped
+        and need to be dimmed. See get_tracks_to_scan for the tracks that are
+        scanned. The queries for all of the tracks are sent at once, so a
+        sweep costs about one round trip to Ableton no matter how many tracks
+        there are.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.finish_scan(self.start_scan())
+
+    def start_scan(self) -> PendingQueries:
+        '''Sends the queries of a scan without waiting for the replies, so
+        the scans of several monitors can be in flight at once.
+
+        :returns: The object collecting the replies. Pass it to finish_scan.
+        :rtype: PendingQueries
+        '''
+        return self.send_queries('/live/track/get/playing_slot_index',
+                                 [(track_index,) for track_index in self.get_tracks_to_scan()])
+
+    def finish_scan(self, pending: PendingQueries) -> None:
+        '''Waits for the replies of a scan started by start_scan and updates
+        the tracks that replied.
+
+        :param pending: The object returned by start_scan.
+        :type pending: PendingQueries
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        replies: Dict[Tuple, Tuple] = self.wait_for_replies(pending)
+        answered: float = self.clock() - pending.sent
+        for (key, reply) in sorted(replies.items()):
+            self.update_track(key[0], reply[1])
+
+        self.predict_clip_ends()
+        self.metrics.increment('sweeps')
+        self.metrics.observe('sweep_seconds', self.clock() - pending.sent)
+        self.adapt_polling_delay(answered, len(replies) < len(pending.expected))
+
+    def adapt_polling_delay(self, sweep_seconds: float, timed_out: bool) -> None:
+        '''Adjusts the polling delay after a sweep when adaptive polling was
+        requested, and logs the delay when it backs off or has shortened by
+        a quarter since it was last logged.
+
+        :param sweep_seconds: The time the sweep took to be answered.
+        :type sweep_seconds: float
+        :param timed_out: If any query of the sweep was not answered in time.
+        :type timed_out: bool
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        if self.adaptive_polling is None:
+            return
+
+        previous: float = self.scheduler.period
+        backed_off: bool = self.adaptive_polling.update(sweep_seconds, timed_out)
+        self.polling_delay = self.scheduler.period = self.adaptive_polling.delay
+        if backed_off and self.polling_delay > previous:
+            logging.info('Live answered in %.1f ms%s, polling every %.0f ms (%.1f scans per second).',
+                         sweep_seconds * 1000, ' with timeouts' if timed_out else '',
+                         self.polling_delay * 1000, self.adaptive_polling.rate)
+            self.polling_delay_logged = self.polling_delay
+        elif self.polling_delay < 0.75 * self.polling_delay_logged:
+            logging.info('Polling every %.0f ms (%.1f scans per second).', self.polling_delay * 1000, self.adaptive_polling.rate)
+            self.polling_delay_logged = self.polling_delay
 
     def scan_track(self, track_index: int) -> None:
         '''Scans a single tracks for clips that have started to play or
@@ -302,18 +1817,185 @@ class AbletonClipMonitor():
         :returns: Nothing
         :rtype: None
         '''
-        logging.debug(f"Check track {track_index}")
-        playing_clip_index = self.ableton.live.query('/live/track/get/playing_slot_index', (track_index,))[1]
+        logging.debug('Check track %d', track_index)
+        playing_clip_index = self.query('/live/track/get/playing_slot_index', (track_index,))[1]
+        self.update_track(track_index, playing_clip_index)
 
-        logging.debug(f"Playing clip {playing_clip_index}")
-        dim_clip_info: Optional[Dict] = self.dim_clip_on_track.get(track_index)
-        if isinstance(dim_clip_info, Dict) and self.should_dim_clip_that_just_ended(track_index, playing_clip_index):
-            logging.debug(f"Dim clip color {track_index}:{playing_clip_index}:{dim_clip_info.get('clip_index')}")
+    def update_track(
+            self,
+            track_index: int,
+            playing_clip_index: int,
+            color: Optional[int] = None,
+            changed_at: Optional[float] = None) -> None:
+        '''Dims the clip that just ended and records the clip that started
+        to play on a track. Used by both the polling and the listener modes.
+
+        :param track_index: The index of the live set track.
+        :type track_index: int
+        :param playing_clip_index: The index of the clip playing in the track, or a negative value if none.
+        :type playing_clip_index: int
+        :param color: The color of the playing clip if it is already known.
+        :type color: Optional[int]
+        :param changed_at: The clock value when a listener reported the change, if it did.
+        :type changed_at: Optional[float]
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        logging.debug('Playing clip %d', playing_clip_index)
+        now: float = self.clock()
+        previous_scan: float = self.last_scanned.get(track_index, now)
+        self.last_scanned[track_index] = now
+        playing_clip: Optional[PlayingClip] = self.dim_clip_on_track.get(track_index)
+        if playing_clip is not None and self.should_dim_clip_that_just_ended(track_index, playing_clip_index):
+            logging.debug('Dim clip color %d:%d:%d', track_index, playing_clip_index, playing_clip.clip_index)
+            self.metrics.observe('dim_lag_seconds', self.get_dim_lag(track_index, changed_at or previous_scan, now))
+            self.metrics.increment('dims')
             self.dim_color_of_played_clip(track_index)
 
         if playing_clip_index >= 0:
-            logging.debug(f"Capture clip info {track_index}:{playing_clip_index}")
-            self.capture_playing_clip_info(track_index, playing_clip_index)
+            logging.debug('Capture clip info %d:%d', track_index, playing_clip_index)
+            self.capture_playing_clip_info(track_index, playing_clip_index, color)
+
+    def get_dim_lag(self, track_index: int, ended_after: float, now: float) -> float:
+        '''Works out how late a dim is. A clip that was seen playing on the
+        previous scan ended at some point since then, so the time since that
+        scan is the most the dim can be late by. When the end of the clip was
+        predicted and has passed, the time since the predicted end is used.
+
+        :param track_index: The index of the live set track.
+        :type track_index: int
+        :param ended_after: The clock value the clip was last seen playing, or the listener reported the change.
+        :type ended_after: float
+        :param now: The clock value of the dim.
+        :type now: float
+
+        :returns: The number of seconds from the end of the clip to the dim.
+        :rtype: float
+        '''
+        prediction: Optional[Tuple[float, int]] = self.clip_end_predictor.predictions.get(track_index)
+        if prediction is not None and ended_after <= prediction[0] <= now:
+            return now - prediction[0]
+        return now - ended_after
+
+    def needs_clip_color(self, track_index: int, playing_clip_index: int) -> bool:
+        '''Tests if update_track will need to query the color of the playing
+        clip, which is the case when a clip has just started to play and its
+        color is not in the clip color grid.
+
+        :param track_index: The index of the live set track.
+        :type track_index: int
+        :param playing_clip_index: The index of the clip playing in the track, or a negative value if none.
+        :type playing_clip_index: int
+
+        :returns: A boolean indicating if the clip color is needed.
+        :rtype: bool
+        '''
+        playing_clip: Optional[PlayingClip] = self.dim_clip_on_track.get(track_index)
+        return (playing_clip_index >= 0
+                and (playing_clip is None or playing_clip.clip_index != playing_clip_index)
+                and self.get_known_clip_color(track_index, playing_clip_index) is None)
+
+    def start_listeners(self) -> None:
+        '''Subscribes to the playing_slot_index listener of every track.
+        AbletonOSC then pushes a message whenever a track starts or stops
+        a clip.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        if not self.listener_registered:
+            self.connection.add_handler('/live/track/get/playing_slot_index', self.on_playing_slot_index)
+            self.listener_registered = True
+
+        for track_index in range(self.num_tracks):
+            self.cmd('/live/track/start_listen/playing_slot_index', (track_index,))
+
+        self.listening = True
+        self.last_listener_message = self.clock()
+
+    def stop_listeners(self) -> None:
+        '''Removes the playing_slot_index listener of every track.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        for track_index in range(self.num_tracks):
+            self.cmd('/live/track/stop_listen/playing_slot_index', (track_index,))
+
+        self.listening = False
+
+    def on_playing_slot_index(self, track_index: int, playing_clip_index: int, *args) -> None:
+        '''Handler for the playing_slot_index messages pushed by AbletonOSC.
+        It runs on the OSC server thread so it only queues the change for
+        the monitor loop.
+
+        :param track_index: The index of the live set track.
+        :type track_index: int
+        :param playing_clip_index: The index of the clip playing in the track, or a negative value if none.
+        :type playing_clip_index: int
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.slot_events.put((int(track_index), int(playing_clip_index), self.clock()))
+
+    def process_slot_events(self, timeout: float) -> int:
+        '''Waits up to timeout seconds for listener messages, then applies
+        every queued change.
+
+        :param timeout: The number of seconds to wait for the first message.
+        :type timeout: float
+
+        :returns: The number of messages processed.
+        :rtype: int
+        '''
+        try:
+            event = self.slot_events.get(timeout=timeout)
+        except queue.Empty:
+            return 0
+
+        processed: int = 0
+        # None is queued by on_is_playing to end the wait when the transport changes.
+        while event is not None:
+            (track_index, playing_clip_index, changed_at) = event
+            if track_index < self.num_tracks:
+                self.update_track(track_index, playing_clip_index, changed_at=changed_at)
+            processed += 1
+            try:
+                event = self.slot_events.get_nowait()
+            except queue.Empty:
+                break
+
+        if processed:
+            self.last_listener_message = self.clock()
+        return processed
+
+    def verify_listeners(self) -> bool:
+        '''Polls every track once and compares the result to the state
+        built from the listener messages. If the poll finds a change the
+        listeners did not report, the listeners are removed and the monitor
+        falls back to polling.
+
+        :returns: A boolean indicating if the listeners are still trusted.
+        :rtype: bool
+        '''
+        self.process_slot_events(0)
+        missed: int = 0
+        playing_clip_indexes: Dict[int, int] = self.query_playing_slot_indexes()
+        for (track_index, playing_clip_index) in sorted(playing_clip_indexes.items()):
+            playing_clip: Optional[PlayingClip] = self.dim_clip_on_track.get(track_index)
+            expected_clip_index: int = playing_clip.clip_index if playing_clip else -1
+            if max(playing_clip_index, -1) != expected_clip_index:
+                missed += 1
+            self.update_track(track_index, playing_clip_index)
+
+        self.last_listener_message = self.clock()
+        if missed:
+            logging.warning('The track listeners missed %d changes, falling back to polling.', missed)
+            self.stop_listeners()
+
+        return not missed
 
     def should_dim_clip_that_just_ended(
             self,
@@ -329,9 +2011,9 @@ class AbletonClipMonitor():
         :returns: A boolean indicating if the track should be dimmed
         :rtype: bool
         '''
-        dim_clip_info: Optional[Dict] = self.dim_clip_on_track.get(track_index)
-        return (dim_clip_info is not None
-                and playing_clip_index != dim_clip_info.get('clip_index'))
+        playing_clip: Optional[PlayingClip] = self.dim_clip_on_track.get(track_index)
+        return (playing_clip is not None
+                and playing_clip_index != playing_clip.clip_index)
 
     def monitor(self) -> None:
         '''The main routine
@@ -339,18 +2021,114 @@ class AbletonClipMonitor():
         :returns: Nothing
         :rtype: None
         '''
+        self.connect()
         self.num_tracks = self.get_number_of_tracks()
-        print('Monitoring Ableton')
-        print('press ctrl-c to exit')
-        logging.debug(f"There are {self.num_tracks} tracks.")
-
+        self.track_names = self.get_track_names()
+        self.layout_checked = self.clock()
+        self.output.write('Monitoring Ableton')
+        self.output.write('press ctrl-c to exit')
+        logging.debug('There are %d tracks.', self.num_tracks)
+        self.load_clip_color_grid()
+
+        if self.recover:
+            self.recover_clip_colors()
+
+        if self.mode == 'events':
+            self.scan_tracks()
+            self.start_listeners()
+        elif self.mode == 'quantized':
+            self.load_quantization()
+            self.start_beat_listener()
+        if self.transport_listener:
+            self.start_transport_listener()
+
+        self.scheduler.start()
         try:
             while True:
-                if self.ableton.is_playing:
+                self.report_stats()
+                # Reloaded a cycle after the last dims were sent, so the grid sees them.
+                self.refresh_clip_color_grid()
+                self.flush_clip_colors()
+                self.check_track_layout()
+                if self.listening:
+                    self.monitor_listeners()
+                elif self.is_playing():
+                    self.idle_delay = float(self.polling_delay)
                     self.scan_tracks()
-                elif self.original_cell_color and not self.no_reset:
-                    self.restore_clip_colors()
-
-                time.sleep(float(self.polling_delay))
+                    self.wait_for_next_scan()
+                else:
+                    self.reset_when_stopped()
+                    self.wait_while_stopped()
         except KeyboardInterrupt:
             pass
+        finally:
+            if self.listening:
+                self.stop_listeners()
+            if self.mode == 'quantized':
+                self.stop_beat_listener()
+            if self.transport_listener:
+                self.stop_transport_listener()
+            self.flush_clip_colors(force=True)
+            self.report_stats(force=True)
+            if self.recorder is not None:
+                self.recorder.close()
+            if self.journal is not None:
+                self.journal.close()
+            logging.debug('Scheduler: %s', self.scheduler.summary())
+            self.output.flush()
+
+    def monitor_listeners(self) -> None:
+        '''A single cycle of the 'events' mode. While Ableton is playing, the
+        changes pushed by the listeners are applied as they arrive and the
+        listeners are verified when they have been silent for
+        listener_timeout seconds.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        if self.is_playing():
+            self.idle_delay = float(self.polling_delay)
+            processed: int = self.process_slot_events(float(self.polling_delay))
+            silent_for: float = self.clock() - self.last_listener_message
+            if not processed and silent_for > self.listener_timeout:
+                self.verify_listeners()
+        else:
+            self.reset_when_stopped()
+            self.wait_while_stopped()
+
+    def reset_when_stopped(self) -> None:
+        '''Restores the clip colors once Ableton has stopped playing unless
+        no_reset was requested.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        if self.original_cell_color and not self.no_reset:
+            self.restore_clip_colors()
+
+    def refresh_clip_color_grid(self) -> bool:
+        '''Reloads the clip color grid every color_refresh_interval seconds,
+        while Ableton plays as well as while it is stopped, so a clip
+        recolored in Live keeps its new color without a launch waiting on a
+        color query. In 'quantized' mode the launch quantization is read
+        again with it.
+
+        :returns: A boolean indicating if the grid was reloaded.
+        :rtype: bool
+        '''
+        if self.clock() - self.clip_color_grid_loaded <= self.color_refresh_interval:
+            return False
+
+        self.load_clip_color_grid()
+        if self.mode == 'quantized':
+            self.load_quantization()
+        return True
+
+
+def __getattr__(name: str) -> Any:
+    '''Imports AsyncAbletonClipMonitor, and asyncio with it, the first time
+    it is used.'''
+    if name == 'AsyncAbletonClipMonitor':
+        from pylive_played_clip.async_monitor import AsyncAbletonClipMonitor
+        return AsyncAbletonClipMonitor
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
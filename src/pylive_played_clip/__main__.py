@@ -10,30 +10,70 @@ import argparse
 import logging
 import textwrap
 
-from typing import List
-
-import live  # type: ignore
+from typing import Any, Dict, List
 
 import pylive_played_clip
 
 from pylive_played_clip import AbletonClipMonitor
+from pylive_played_clip.lazy_import import LazyModule
+from pylive_played_clip.output import start_background_logging
+
+live = LazyModule('live')
 
 
 def _main() -> None:
     '''The main routine for the module.'''
     args: argparse.Namespace = _parse_arguments()
     set_log_level(args)
+    log_writer = start_background_logging()
 
     try:
-        ableton = AbletonClipMonitor(
+        options: Dict[str, Any] = dict(
             dim_color=args.dim_color,
             dim_ratio=float(args.dim_ratio),
             polling_delay=float(args.polling_delay),
-            no_reset=bool(args.no_reset)
+            no_reset=bool(args.no_reset),
+            mode=args.mode,
+            listener_timeout=float(args.listener_timeout),
+            sweep_timeout=float(args.sweep_timeout),
+            color_refresh_interval=float(args.color_refresh_interval),
+            restore_bundle_size=int(args.restore_bundle_size),
+            restore_max_in_flight=int(args.restore_max_in_flight),
+            coalesce_window=float(args.coalesce_window),
+            write_rate=float(args.write_rate),
+            write_burst=int(args.write_burst),
+            adaptive_polling=bool(args.adaptive_polling),
+            min_polling_delay=float(args.min_polling_delay),
+            max_polling_delay=float(args.max_polling_delay),
+            latency_target=float(args.latency_target),
+            max_idle_delay=args.max_idle_delay,
+            transport_listener=bool(args.transport_listener),
+            overrun=args.overrun,
+            idle_sweep_share=float(args.idle_sweep_share),
+            predict_clip_end=bool(args.predict_clip_end),
+            prediction_window=float(args.prediction_window),
+            prediction_fallback_interval=float(args.prediction_fallback_interval),
+            sparse_polling_delay=float(args.sparse_polling_delay),
+            boundary_offset=float(args.boundary_offset),
+            layout_check_interval=float(args.layout_check_interval),
+            print_stats=bool(args.stats),
+            stats_file=args.stats_file,
+            stats_interval=float(args.stats_interval),
+            journal=args.journal,
+            recover=bool(args.recover),
+            record=args.record
         )
+        ableton: Any
+        if args.hosts:
+            from pylive_played_clip.multi_host import MultiHostMonitor
+            ableton = MultiHostMonitor(args.hosts, listen_port=int(args.listen_port), **options)
+        else:
+            ableton = AbletonClipMonitor(**options)
         ableton.monitor()
     except live.exceptions.LiveConnectionError as error:
         print(str(error))
+    finally:
+        log_writer.stop()
 
 
 def _get_argument_parser() -> argparse.ArgumentParser:
@@ -50,6 +90,8 @@ def _get_argument_parser() -> argparse.ArgumentParser:
 Command Line Examples
 > {basename}
 > {basename} --dim-color 555555 --log-level debug
+> {basename} --mode events
+> {basename} --host 192.168.1.20 --host 192.168.1.21:11000
 
 """)
 
@@ -79,11 +121,234 @@ reset the colors.
                         type=float,
                         dest='polling_delay',
                         help=('Default 0.1 second. The polling delay'))
+    parser.add_argument('--adaptive-polling',
+                        action='store_true',
+                        dest='adaptive_polling',
+                        help=('If provided, the polling delay starts at '
+                              '--polling-delay and adapts to how fast Live '
+                              'answers, between --min-polling-delay and '
+                              '--max-polling-delay. Only in the poll mode.'))
+    parser.add_argument('--min-polling-delay',
+                        default=0.02,
+                        type=float,
+                        dest='min_polling_delay',
+                        help=('Default 0.02 second. With --adaptive-polling, '
+                              'the shortest polling delay.'))
+    parser.add_argument('--max-polling-delay',
+                        default=0.5,
+                        type=float,
+                        dest='max_polling_delay',
+                        help=('Default 0.5 second. With --adaptive-polling, '
+                              'the longest polling delay.'))
+    parser.add_argument('--latency-target',
+                        default=0.05,
+                        type=float,
+                        dest='latency_target',
+                        help=('Default 0.05 second. With --adaptive-polling, '
+                              'the polling backs off when Live takes longer '
+                              'than this to answer a scan.'))
+    parser.add_argument('--max-idle-delay',
+                        default=None,
+                        type=float,
+                        dest='max_idle_delay',
+                        help=('Default --polling-delay. While Ableton is '
+                              'stopped, the delay between checks of the '
+                              'transport doubles up to this many seconds.'))
+    parser.add_argument('--transport-listener',
+                        action='store_true',
+                        dest='transport_listener',
+                        help=('If provided, AbletonOSC reports when the '
+                              'transport starts or stops, so scanning starts '
+                              'and the colors are restored right away.'))
+    parser.add_argument('--idle-sweep-share',
+                        default=1.0,
+                        type=float,
+                        dest='idle_sweep_share',
+                        help=('Default 1.0. Tracks with a playing clip are '
+                              'scanned every polling cycle. This share of the '
+                              'other tracks is scanned each cycle on a rotating '
+                              'sweep. 0.25 scans each idle track every fourth '
+                              'cycle.'))
+    parser.add_argument('--predict-clip-end',
+                        action='store_true',
+                        dest='predict_clip_end',
+                        help=('If provided, the end of each clip is predicted '
+                              'from its length, position and the tempo when it '
+                              'starts, and its track is only scanned every '
+                              'cycle around that time. Not used in events '
+                              'mode.'))
+    parser.add_argument('--prediction-window',
+                        default=0.25,
+                        type=float,
+                        dest='prediction_window',
+                        help=('Default 0.25 seconds. With --predict-clip-end, '
+                              'a track is scanned every cycle from this long '
+                              'before its clip is predicted to end.'))
+    parser.add_argument('--prediction-fallback-interval',
+                        default=1.0,
+                        type=float,
+                        dest='prediction_fallback_interval',
+                        help=('Default 1.0 second. With --predict-clip-end, a '
+                              'track with a playing clip is still scanned this '
+                              'often in case the clip is stopped early or '
+                              'loops.'))
+    parser.add_argument('--overrun',
+                        default='skip',
+                        choices=['skip', 'catch-up'],
+                        dest='overrun',
+                        help=('Default skip. Scans start every polling delay '
+                              'no matter how long they take. When a scan runs '
+                              'long, skip drops the missed scans and catch-up '
+                              'runs them back to back.'))
+    parser.add_argument('--mode',
+                        default='poll',
+                        choices=['poll', 'events', 'quantized'],
+                        dest='mode',
+                        help=('Default poll. With poll, every track is queried '
+                              'each polling cycle. With events, the tool '
+                              'subscribes to the AbletonOSC listeners of each '
+                              'track and reacts to the changes Ableton pushes. '
+                              'With quantized, the tracks are scanned just '
+                              'after each launch quantization boundary of the '
+                              'song and sparsely in between.'))
+    parser.add_argument('--sparse-polling-delay',
+                        default=1.0,
+                        type=float,
+                        dest='sparse_polling_delay',
+                        help=('Default 1.0 second. In quantized mode, the '
+                              'tracks are scanned this often between the '
+                              'quantization boundaries.'))
+    parser.add_argument('--boundary-offset',
+                        default=0.02,
+                        type=float,
+                        dest='boundary_offset',
+                        help=('Default 0.02 seconds. In quantized mode, the '
+                              'tracks are scanned this long after each '
+                              'quantization boundary.'))
+    parser.add_argument('--listener-timeout',
+                        default=2.0,
+                        type=float,
+                        dest='listener_timeout',
+                        help=('Default 2.0 seconds. In events mode, the tracks '
+                              'are polled once to verify the listeners after '
+                              'this much silence. If the listeners missed a '
+                              'change, the tool falls back to polling.'))
+    parser.add_argument('--sweep-timeout',
+                        default=1.0,
+                        type=float,
+                        dest='sweep_timeout',
+                        help=('Default 1.0 second. All of the tracks are '
+                              'queried at once. Tracks that have not replied '
+                              'within this time are checked on the next scan.'))
+    parser.add_argument('--color-refresh-interval',
+                        default=10.0,
+                        type=float,
+                        dest='color_refresh_interval',
+                        help=('Default 10 seconds. The clip colors are loaded '
+                              'at startup. While Ableton is stopped, they are '
+                              'reloaded this often to pick up colors changed '
+                              'in Live.'))
+    parser.add_argument('--layout-check-interval',
+                        default=2.0,
+                        type=float,
+                        dest='layout_check_interval',
+                        help=('Default 2.0 seconds. The track names are read '
+                              'this often to pick up tracks added, removed or '
+                              'moved in Live.'))
+    parser.add_argument('--stats',
+                        action='store_true',
+                        dest='stats',
+                        help=('If provided, a summary of the sweep, query and '
+                              'dim latencies is printed every stats interval.'))
+    parser.add_argument('--stats-file',
+                        default=None,
+                        dest='stats_file',
+                        help=('If provided, the metrics are written to this '
+                              'file in the Prometheus text format every stats '
+                              'interval.'))
+    parser.add_argument('--stats-interval',
+                        default=10.0,
+                        type=float,
+                        dest='stats_interval',
+                        help=('Default 10 seconds. The time between reports of '
+                              'the metrics.'))
+    parser.add_argument('--host',
+                        action='append',
+                        default=[],
+                        dest='hosts',
+                        metavar='HOST[:PORT]',
+                        help=('Monitors AbletonOSC on this host, on port 11000 '
+                              'unless a port is given. Repeat it to monitor '
+                              'several hosts from one process. With --host, '
+                              'only the poll mode is supported.'))
+    parser.add_argument('--listen-port',
+                        default=11001,
+                        type=int,
+                        dest='listen_port',
+                        help=('Default 11001. With --host, the local port the '
+                              'replies of every host are received on.'))
+    parser.add_argument('--record',
+                        default=None,
+                        dest='record',
+                        help=('If provided, every query, reply and command '
+                              'exchanged with Ableton is written to this file. '
+                              'Replay it with python -m '
+                              'pylive_played_clip.recording.'))
+    parser.add_argument('--journal',
+                        default=None,
+                        dest='journal',
+                        metavar='FILE',
+                        help=('If provided, the original color of each dimmed '
+                              'clip is kept in this file, so the colors can be '
+                              'restored after a crash. With --host, the host '
+                              'is added to the name of the file.'))
+    parser.add_argument('--recover',
+                        action='store_true',
+                        dest='recover',
+                        help=('If provided, the colors left in the --journal '
+                              'file by a run that crashed are restored as soon '
+                              'as the utility connects to Ableton.'))
     parser.add_argument('--no-reset',
                         action='store_true',
                         dest='no_reset',
                         help=('If provided, the colors will not be reset '
                               'when Ableton stops.'))
+    parser.add_argument('--restore-bundle-size',
+                        default=16,
+                        type=int,
+                        dest='restore_bundle_size',
+                        help=('Default 16. When the colors are reset, this '
+                              'many commands are packed into each OSC bundle. '
+                              'Use 1 with versions of AbletonOSC that do not '
+                              'accept bundles.'))
+    parser.add_argument('--restore-max-in-flight',
+                        default=64,
+                        type=int,
+                        dest='restore_max_in_flight',
+                        help=('Default 64. When the colors are reset, the tool '
+                              'waits for Ableton to catch up after this many '
+                              'commands.'))
+    parser.add_argument('--coalesce-window',
+                        default=0.0,
+                        type=float,
+                        dest='coalesce_window',
+                        help=('Default 0. The number of seconds a dim is held '
+                              'before it is sent. If the colors are reset '
+                              'within that time, neither is sent.'))
+    parser.add_argument('--write-rate',
+                        default=0.0,
+                        type=float,
+                        dest='write_rate',
+                        help=('Default 0, unlimited. The most clip color '
+                              'commands sent to Ableton per second. Dims are '
+                              'sent before resets, and a large reset is spread '
+                              'over several seconds.'))
+    parser.add_argument('--write-burst',
+                        default=16,
+                        type=int,
+                        dest='write_burst',
+                        help=('Default 16. With --write-rate, the most clip '
+                              'color commands sent at once after a pause.'))
     parser.add_argument('--log-level', '-l',
                         dest='log_level',
                         default='info',
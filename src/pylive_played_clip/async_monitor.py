@@ -0,0 +1,538 @@
+'''
+An asyncio version of the Ableton clip monitor. It talks to AbletonOSC over
+a non-blocking datagram transport so it can share an event loop with other
+I/O instead of needing a thread of its own.
+'''
+import asyncio
+import logging
+
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from pythonosc.osc_message_builder import OscMessageBuilder
+from pythonosc.osc_packet import OscPacket, ParseError
+
+from pylive_played_clip import CLIP_END_ADDRESSES, AbletonClipMonitor, AbletonClipMonitorException, build_osc_bundle
+from pylive_played_clip.lazy_import import LazyModule
+from pylive_played_clip.metrics import MonitorMetrics
+
+live = LazyModule('live')
+
+
+class AsyncOscProtocol(asyncio.DatagramProtocol):
+    '''A datagram protocol that sends OSC messages to AbletonOSC and matches
+    the replies to the queries waiting on them. A reply answers the oldest
+    query sent to the same address whose arguments lead the reply, the same
+    way :class:`pylive_played_clip.PendingQueries` matches replies.
+
+    It provides the cmd and add_handler methods of the pylive Query object so
+    it can be used as the connection of an :class:`pylive_played_clip.AbletonClipMonitor`.
+    Its query method is a coroutine.
+    '''
+    def __init__(self, address: Tuple[str, int] = ('127.0.0.1', 11000)) -> None:
+        '''
+        :param address: The host and port AbletonOSC listens on.
+        :type address: typing.Tuple[str, int]
+        '''
+        self.address: Tuple[str, int] = address
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self.handlers: Dict[str, List[Callable]] = {}
+        self.pending: Dict[str, List[Tuple[Tuple, asyncio.Future]]] = {}
+        self.osc_timeout: float = 3.0
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport  # type: ignore
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.transport = None
+        for waiting in self.pending.values():
+            for (_, future) in waiting:
+                if not future.done():
+                    future.cancel()
+        self.pending = {}
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]) -> None:
+        try:
+            packet = OscPacket(data)
+        except ParseError as error:
+            logging.debug('Ignoring an OSC packet that could not be parsed: %s', error)
+            return
+
+        for timed_message in packet.messages:
+            message = timed_message.message
+            self.dispatch(message.address, tuple(message.params))
+
+    def dispatch(self, address: str, data: Tuple) -> None:
+        '''Runs the handlers registered for the address and resolves the
+        oldest query the message answers.
+
+        :param address: The OSC address of the message.
+        :type address: str
+        :param data: The values of the message.
+        :type data: typing.Tuple
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        for handler in self.handlers.get(address, []):
+            handler(*data)
+
+        waiting = self.pending.get(address, [])
+        for (index, (key, future)) in enumerate(waiting):
+            if future.done():
+                continue
+            if tuple(data[:len(key)]) == key:
+                future.set_result(data)
+                del waiting[index]
+                break
+
+    def cmd(self, msg: str, args: Sequence = ()) -> None:
+        '''Sends an OSC message without waiting for a reply. Sending a
+        datagram never blocks the event loop.
+
+        :param msg: The OSC address.
+        :type msg: str
+        :param args: The values of the message.
+        :type args: typing.Sequence
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        if self.transport is None:
+            raise live.exceptions.LiveConnectionError('The OSC transport is not connected.')
+
+        builder = OscMessageBuilder(msg)
+        for arg in args:
+            builder.add_arg(arg)
+        self.transport.sendto(builder.build().dgram, self.address)
+
+    def send_bundle(self, msg: str, args_list: Sequence[Tuple]) -> None:
+        '''Sends one message per entry in args_list as a single OSC bundle.
+
+        :param msg: The OSC address of every message.
+        :type msg: str
+        :param args_list: The values of each message.
+        :type args_list: typing.Sequence[typing.Tuple]
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        if self.transport is None:
+            raise live.exceptions.LiveConnectionError('The OSC transport is not connected.')
+
+        self.transport.sendto(build_osc_bundle(msg, args_list).dgram, self.address)
+
+    def send_query(self, msg: str, args: Sequence = ()) -> asyncio.Future:
+        '''Sends a query and returns a future resolved with its reply.
+
+        :param msg: The OSC address.
+        :type msg: str
+        :param args: The values of the query.
+        :type args: typing.Sequence
+
+        :returns: A future for the values of the reply.
+        :rtype: asyncio.Future
+        '''
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.pending.setdefault(msg, []).append((tuple(args), future))
+        self.cmd(msg, args)
+        return future
+
+    async def query(self, msg: str, args: Sequence = (), timeout: Optional[float] = None) -> Tuple:
+        '''Sends a query and waits for its reply.
+
+        :param msg: The OSC address.
+        :type msg: str
+        :param args: The values of the query.
+        :type args: typing.Sequence
+        :param timeout: The number of seconds to wait. Defaults to osc_timeout.
+        :type timeout: Optional[float]
+
+        :returns: The values of the reply.
+        :rtype: typing.Tuple
+        '''
+        if timeout is None:
+            timeout = self.osc_timeout
+
+        try:
+            return await asyncio.wait_for(self.send_query(msg, args), timeout)
+        except asyncio.TimeoutError:
+            raise live.exceptions.LiveConnectionError(
+                f"Timed out waiting for response to query: {msg} {tuple(args)}. "
+                'Is Live running and AbletonOSC installed?')
+
+    def add_handler(self, address: str, handler: Callable) -> None:
+        '''Registers a callback for every message received on an address.
+
+        :param address: The OSC address.
+        :type address: str
+        :param handler: The callback, called with the values of the message.
+        :type handler: typing.Callable
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.handlers.setdefault(address, []).append(handler)
+
+
+class AsyncAbletonClipMonitor():
+    '''
+    An asyncio version of :class:`pylive_played_clip.AbletonClipMonitor`.
+    The clip state and the dimming logic are those of the wrapped
+    AbletonClipMonitor; only the queries are awaited. Only the 'poll' mode
+    is supported.
+
+    **Class Properties**
+
+    * clip_monitor: AbletonClipMonitor - Holds the clip state and does the dimming.
+    * protocol: AsyncOscProtocol - The datagram protocol used to talk to AbletonOSC.
+    * host: str - The host AbletonOSC runs on.
+    * port: int - The port AbletonOSC listens on.
+    * listen_port: int - The local port AbletonOSC replies to.
+    '''
+    def __init__(
+            self,
+            host: str = '127.0.0.1',
+            port: int = 11000,
+            listen_port: int = 11001,
+            **kwargs: Any) -> None:
+        '''
+        :param host: The host AbletonOSC runs on.
+        :type host: str
+        :param port: The port AbletonOSC listens on.
+        :type port: int
+        :param listen_port: The local port AbletonOSC replies to.
+        :type listen_port: int
+        :param kwargs:
+            The keyword arguments of :class:`pylive_played_clip.AbletonClipMonitor`,
+            such as dim_color, dim_ratio, polling_delay and no_reset. Only the
+            'poll' mode is supported and a session cannot be recorded.
+        :type kwargs: typing.Any
+
+        :returns: An instance of the AsyncAbletonClipMonitor object.
+        :rtype: `AsyncAbletonClipMonitor`
+        '''
+        if kwargs.get('mode', 'poll') != 'poll':
+            raise AbletonClipMonitorException('Only the poll mode is supported by the asyncio monitor.')
+        if kwargs.get('record'):
+            raise AbletonClipMonitorException('A session cannot be recorded by the asyncio monitor.')
+
+        self.host: str = host
+        self.port: int = port
+        self.listen_port: int = listen_port
+        self.protocol: AsyncOscProtocol = AsyncOscProtocol((host, port))
+        self.clip_monitor: AbletonClipMonitor = AbletonClipMonitor(connection=self.protocol, **kwargs)
+
+    async def __aenter__(self) -> 'AsyncAbletonClipMonitor':
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        self.close()
+
+    async def connect(self) -> None:
+        '''Opens the datagram endpoint used to talk to AbletonOSC.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        if self.protocol.transport is None:
+            await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: self.protocol,
+                local_addr=('0.0.0.0', self.listen_port))
+
+    def close(self) -> None:
+        '''Closes the datagram endpoint and cancels the waiting queries.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        if self.protocol.transport is not None:
+            self.protocol.transport.close()
+
+    async def query_many(
+            self,
+            address: str,
+            args_list: Sequence[Tuple],
+            timeout: Optional[float] = None) -> Dict[Tuple, Tuple]:
+        '''Sends one query per entry in args_list at once and waits for the
+        replies up to a deadline. See :meth:`pylive_played_clip.AbletonClipMonitor.query_many`.
+
+        :param address: The OSC address to query.
+        :type address: str
+        :param args_list: The arguments of each query.
+        :type args_list: typing.Sequence[typing.Tuple]
+        :param timeout: The number of seconds to wait for all of the replies. Defaults to sweep_timeout.
+        :type timeout: Optional[float]
+
+        :returns: The reply values keyed by the arguments of the query they answer.
+        :rtype: typing.Dict[typing.Tuple, typing.Tuple]
+        '''
+        if timeout is None:
+            timeout = self.clip_monitor.sweep_timeout
+        if not args_list:
+            return {}
+
+        metrics: MonitorMetrics = self.clip_monitor.metrics
+        clock: Callable[[], float] = self.clip_monitor.clock
+        sent: float = clock()
+
+        def record_round_trip(future: asyncio.Future) -> None:
+            if not future.cancelled():
+                metrics.observe('query_seconds', clock() - sent)
+
+        futures: Dict[Tuple, asyncio.Future] = {
+            tuple(args): self.protocol.send_query(address, args) for args in args_list}
+        for future in futures.values():
+            future.add_done_callback(record_round_trip)
+        metrics.increment('queries', len(futures))
+        try:
+            await asyncio.wait(futures.values(), timeout=timeout)
+        finally:
+            for future in futures.values():
+                if not future.done():
+                    future.cancel()
+
+        replies: Dict[Tuple, Tuple] = {
+            key: future.result() for (key, future) in futures.items() if not future.cancelled()}
+        if not replies:
+            raise live.exceptions.LiveConnectionError(
+                f"Timed out waiting for all {len(futures)} responses to {address}. "
+                'Is Live running and AbletonOSC installed?')
+        if len(replies) < len(futures):
+            metrics.increment('query_timeouts', len(futures) - len(replies))
+            logging.debug('No response from %s for %d queries within %s seconds', address, len(futures) - len(replies), timeout)
+
+        return replies
+
+    async def load_clip_color_grid(self, track_indexes: Optional[Sequence[int]] = None) -> None:
+        '''Loads the color of every clip slot with one query per track, all
+        sent at once.
+
+        :param track_indexes: The tracks to load. Defaults to every track.
+        :type track_indexes: Optional[typing.Sequence[int]]
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        monitor: AbletonClipMonitor = self.clip_monitor
+        if track_indexes is None:
+            track_indexes = range(monitor.num_tracks)
+        replies = await self.query_many(
+            '/live/track/get/clips/color',
+            [(track_index,) for track_index in track_indexes])
+        for (key, reply) in replies.items():
+            monitor.store_clip_color_grid_row(key[0], reply[1:])
+        monitor.clip_color_grid_loaded = monitor.clock()
+
+    async def get_number_of_tracks(self) -> int:
+        '''Queries Ableton to get the number of tracks in the open set.
+
+        :returns: The number of tracks in the live set.
+        :rtype: int
+        '''
+        return int((await self.protocol.query('/live/song/get/num_tracks'))[0])
+
+    async def get_track_names(self) -> List[str]:
+        '''Queries Ableton for the name of every track in the open set.
+
+        :returns: The track names in order.
+        :rtype: typing.List[str]
+        '''
+        return [str(name) for name in await self.protocol.query('/live/song/get/track_names')]
+
+    async def check_track_layout(self) -> bool:
+        '''Reads the track names every layout_check_interval seconds and
+        updates the monitor when tracks were added, removed or moved.
+
+        :returns: A boolean indicating if the tracks changed.
+        :rtype: bool
+        '''
+        monitor: AbletonClipMonitor = self.clip_monitor
+        if monitor.clock() - monitor.layout_checked < monitor.layout_check_interval:
+            return False
+
+        monitor.layout_checked = monitor.clock()
+        new_tracks: Optional[List[int]] = monitor.update_track_layout(await self.get_track_names())
+        if new_tracks is None:
+            return False
+
+        if new_tracks:
+            await self.load_clip_color_grid(new_tracks)
+        return True
+
+    async def is_playing(self) -> bool:
+        '''Queries Ableton to find out if the transport is playing.
+
+        :returns: A boolean indicating if Ableton is playing.
+        :rtype: bool
+        '''
+        return bool((await self.protocol.query('/live/song/get/is_playing'))[0])
+
+    async def scan_tracks(self) -> None:
+        '''Scans all of the tracks for clips that have started to play or
+        stopped and need to be dimmed. The tracks picked by get_tracks_to_scan
+        are queried at once and the colors of the clips that just started,
+        if they are not in the clip color grid, are then queried at once.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        monitor: AbletonClipMonitor = self.clip_monitor
+        start: float = monitor.clock()
+        tracks: List[int] = monitor.get_tracks_to_scan()
+        slot_replies = await self.query_many('/live/track/get/playing_slot_index', [(track_index,) for track_index in tracks])
+        answered: float = monitor.clock() - start
+        playing_clip_indexes: Dict[int, int] = {key[0]: reply[1] for (key, reply) in slot_replies.items()}
+
+        launched: List[Tuple[int, int]] = [
+            (track_index, playing_clip_index)
+            for (track_index, playing_clip_index) in playing_clip_indexes.items()
+            if monitor.needs_clip_color(track_index, playing_clip_index)]
+        colors: Dict[Tuple, Tuple] = {}
+        if launched:
+            colors = await self.query_many('/live/clip/get/color', launched)
+
+        for (track_index, playing_clip_index) in sorted(playing_clip_indexes.items()):
+            color: Optional[int] = None
+            if monitor.needs_clip_color(track_index, playing_clip_index):
+                color_reply: Optional[Tuple] = colors.get((track_index, playing_clip_index))
+                if color_reply is None:
+                    # The color did not arrive in time, try again on the next scan.
+                    continue
+                color = int(color_reply[2])
+                monitor.set_known_clip_color(track_index, playing_clip_index, color)
+            monitor.update_track(track_index, playing_clip_index, color)
+
+        await self.predict_clip_ends()
+        monitor.metrics.increment('sweeps')
+        monitor.metrics.observe('sweep_seconds', monitor.clock() - start)
+        monitor.adapt_polling_delay(answered, len(slot_replies) < len(tracks))
+
+    async def predict_clip_ends(self) -> None:
+        '''Predicts when the clips that started during the last scan will
+        end. See :meth:`pylive_played_clip.AbletonClipMonitor.predict_clip_ends`.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        monitor: AbletonClipMonitor = self.clip_monitor
+        clips: List[Tuple[int, int]] = monitor.clips_to_predict
+        monitor.clips_to_predict = []
+        if not clips:
+            return
+
+        (lengths, positions, loopings, tempos) = await asyncio.gather(
+            *[self.query_many(address, clips) for address in CLIP_END_ADDRESSES],
+            self.query_many('/live/song/get/tempo', [()]))
+        monitor.record_clip_end_predictions(clips, lengths, positions, loopings, tempos)
+
+    async def restore_clip_colors(self) -> int:
+        '''Restores the clips to their original colors in OSC bundles. After
+        every restore_max_in_flight commands, the restore awaits a color query
+        so Ableton is never sent more than that at once.
+
+        :returns: The number of clips restored.
+        :rtype: int
+        '''
+        monitor: AbletonClipMonitor = self.clip_monitor
+        start: float = monitor.clock()
+        batches: List[List[Tuple[int, int, int]]] = monitor.get_restore_batches()
+        if monitor.queue_restore(batches):
+            return monitor.finish_restore(batches, start)
+
+        in_flight: int = 0
+        for batch in batches:
+            monitor.send_color_batch(batch)
+            in_flight += len(batch)
+            if in_flight >= monitor.restore_max_in_flight or batch is batches[-1]:
+                (track_index, clip_index, _) = batch[-1]
+                try:
+                    await self.protocol.query('/live/clip/get/color', (track_index, clip_index))
+                except live.exceptions.LiveConnectionError:
+                    logging.warning('Ableton did not confirm the color of track %d, clip %d', track_index, clip_index)
+                in_flight = 0
+
+        return monitor.finish_restore(batches, start)
+
+    async def recover_clip_colors(self) -> int:
+        '''Restores the original colors left in the journal by an earlier
+        run. See :meth:`pylive_played_clip.AbletonClipMonitor.recover_clip_colors`.
+
+        :returns: The number of clips restored.
+        :rtype: int
+        '''
+        if not self.clip_monitor.prepare_recovery():
+            return 0
+        return await self.restore_clip_colors()
+
+    async def wait(self, transport_changed: asyncio.Event, delay: float) -> None:
+        '''Sleeps for a delay, or until the transport listener reports that
+        the transport started or stopped.
+
+        :param transport_changed: Set by the transport listener.
+        :type transport_changed: asyncio.Event
+        :param delay: The most number of seconds to sleep.
+        :type delay: float
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        try:
+            await asyncio.wait_for(transport_changed.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+        transport_changed.clear()
+
+    async def monitor(self) -> None:
+        '''The main routine. It runs until the task is cancelled.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        monitor: AbletonClipMonitor = self.clip_monitor
+        await self.connect()
+        try:
+            monitor.num_tracks = await self.get_number_of_tracks()
+            monitor.track_names = await self.get_track_names()
+            monitor.layout_checked = monitor.clock()
+            logging.debug('There are %d tracks.', monitor.num_tracks)
+            await self.load_clip_color_grid()
+            if monitor.recover:
+                await self.recover_clip_colors()
+            transport_changed: asyncio.Event = asyncio.Event()
+            if monitor.transport_listener:
+                def on_is_playing(playing: int, *args: Any) -> None:
+                    if monitor.note_transport(playing):
+                        transport_changed.set()
+
+                self.protocol.add_handler('/live/song/get/is_playing', on_is_playing)
+                self.protocol.cmd('/live/song/start_listen/is_playing')
+
+            monitor.scheduler.start()
+            while True:
+                monitor.report_stats()
+                if monitor.clock() - monitor.clip_color_grid_loaded > monitor.color_refresh_interval:
+                    await self.load_clip_color_grid()
+                monitor.flush_clip_colors()
+                await self.check_track_layout()
+                if await self.is_playing():
+                    monitor.idle_delay = float(monitor.polling_delay)
+                    await self.scan_tracks()
+                    await self.wait(transport_changed, monitor.scheduler.next_delay())
+                    monitor.scheduler.mark_woken()
+                else:
+                    if monitor.original_cell_color and not monitor.no_reset:
+                        await self.restore_clip_colors()
+                    await self.wait(transport_changed, monitor.next_idle_delay())
+                    # The wait does not follow the schedule, so it starts again from now.
+                    monitor.scheduler.start()
+        finally:
+            if monitor.transport_listener and self.protocol.transport is not None:
+                self.protocol.cmd('/live/song/stop_listen/is_playing')
+            monitor.flush_clip_colors(force=True)
+            monitor.report_stats(force=True)
+            if monitor.recorder is not None:
+                monitor.recorder.close()
+            if monitor.journal is not None:
+                monitor.journal.close()
+            self.close()
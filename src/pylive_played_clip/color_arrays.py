@@ -0,0 +1,183 @@
+'''
+Batch versions of the color utilities that work on whole arrays of colors,
+such as an export of a clip grid. NumPy is used when it is installed,
+otherwise the colors are converted one by one in pure Python.
+
+Every function takes a backend argument that can be 'numpy', 'python' or
+None to pick NumPy when it is available. The NumPy backend returns NumPy
+arrays, the Python backend returns lists.
+'''
+from typing import Any, List, Optional, Sequence, Tuple
+
+from pylive_played_clip import colorIntToRgb, colorIntToRgbString, dimColorInt, rgbToColorInt
+
+try:
+    import numpy  # type: ignore
+except ImportError:
+    numpy = None  # type: ignore
+
+BACKENDS: Tuple[str, ...] = ('numpy', 'python')
+
+ONE_THIRD: float = 1.0/3.0
+ONE_SIXTH: float = 1.0/6.0
+TWO_THIRD: float = 2.0/3.0
+
+
+def get_backend(backend: Optional[str] = None) -> str:
+    '''Picks the backend used by the batch functions.
+
+    :param backend: 'numpy', 'python' or None to use NumPy when it is installed.
+    :type backend: Optional[str]
+
+    :returns: The name of the backend to use.
+    :rtype: str
+    '''
+    if backend is None:
+        return 'python' if numpy is None else 'numpy'
+    if backend not in BACKENDS:
+        raise ValueError(f"The backend must be one of {', '.join(BACKENDS)}. We received \"{backend}\".")
+    if backend == 'numpy' and numpy is None:
+        raise ValueError('The numpy backend was requested but numpy is not installed.')
+    return backend
+
+
+def hexToColorIntBatch(hex_values: Sequence[str], backend: Optional[str] = None) -> Any:
+    '''Converts hex colors without a leading #, such as FFFFFF, into
+    single color integers.
+
+    :param hex_values: The color hex values.
+    :type hex_values: typing.Sequence[str]
+    :param backend: 'numpy', 'python' or None to use NumPy when it is installed.
+    :type backend: Optional[str]
+
+    :returns: The color integers.
+    :rtype: typing.Any
+    '''
+    colors: List[int] = [int(hex_value[0:6], 16) for hex_value in hex_values]
+    if get_backend(backend) == 'numpy':
+        return numpy.array(colors, dtype=numpy.int64)
+    return colors
+
+
+def rgbToColorIntBatch(
+        reds: Sequence[int],
+        greens: Sequence[int],
+        blues: Sequence[int],
+        backend: Optional[str] = None) -> Any:
+    '''Converts arrays of red, green and blue values into single color integers.
+
+    :param reds: The red values between 0 and 255.
+    :type reds: typing.Sequence[int]
+    :param greens: The green values between 0 and 255.
+    :type greens: typing.Sequence[int]
+    :param blues: The blue values between 0 and 255.
+    :type blues: typing.Sequence[int]
+    :param backend: 'numpy', 'python' or None to use NumPy when it is installed.
+    :type backend: Optional[str]
+
+    :returns: The color integers.
+    :rtype: typing.Any
+    '''
+    if get_backend(backend) == 'numpy':
+        return ((2**16 * numpy.asarray(reds, dtype=numpy.int64))
+                + (2**8 * numpy.asarray(greens, dtype=numpy.int64))
+                + numpy.asarray(blues, dtype=numpy.int64))
+    return [rgbToColorInt(red, green, blue) for (red, green, blue) in zip(reds, greens, blues)]
+
+
+def colorIntToRgbBatch(colors: Sequence[int], backend: Optional[str] = None) -> Tuple[Any, Any, Any]:
+    '''Converts color integers into arrays of red, green and blue values.
+
+    :param colors: The color integers.
+    :type colors: typing.Sequence[int]
+    :param backend: 'numpy', 'python' or None to use NumPy when it is installed.
+    :type backend: Optional[str]
+
+    :returns: The red, green and blue values.
+    :rtype: typing.Tuple[typing.Any, typing.Any, typing.Any]
+    '''
+    if get_backend(backend) == 'numpy':
+        color_array = numpy.asarray(colors, dtype=numpy.int64)
+        return ((color_array & 0xFF0000) >> 16, (color_array & 0x00FF00) >> 8, color_array & 0x0000FF)
+
+    triplets: List[Tuple[int, int, int]] = [colorIntToRgb(color) for color in colors]
+    return ([red for (red, _, _) in triplets],
+            [green for (_, green, _) in triplets],
+            [blue for (_, _, blue) in triplets])
+
+
+def colorIntToRgbStringBatch(colors: Sequence[int]) -> List[str]:
+    '''Converts color integers into strings such as [255, 0, 0] that are
+    easy to put into logs or reports.
+
+    :param colors: The color integers.
+    :type colors: typing.Sequence[int]
+
+    :returns: The strings showing the red, green and blue values.
+    :rtype: typing.List[str]
+    '''
+    return [colorIntToRgbString(int(color)) for color in colors]
+
+
+def dimColorIntBatch(colors: Sequence[int], dim_ratio: float, backend: Optional[str] = None) -> Any:
+    '''Dims every color the way :func:`pylive_played_clip.dimColorInt` does:
+    the color is converted to HLS, the lightness is divided by dim_ratio and
+    the result is converted back. Both backends give the same integers.
+
+    :param colors: The color integers.
+    :type colors: typing.Sequence[int]
+    :param dim_ratio: The ratio to divide the lightness by.
+    :type dim_ratio: float
+    :param backend: 'numpy', 'python' or None to use NumPy when it is installed.
+    :type backend: Optional[str]
+
+    :returns: The dimmed color integers.
+    :rtype: typing.Any
+    '''
+    if get_backend(backend) == 'python':
+        return [dimColorInt(int(color), dim_ratio) for color in colors]
+
+    (reds, greens, blues) = colorIntToRgbBatch(colors, backend='numpy')
+    red = reds.astype(numpy.float64)
+    green = greens.astype(numpy.float64)
+    blue = blues.astype(numpy.float64)
+
+    # colorsys.rgb_to_hls, one operation at a time so the floats match.
+    maxc = numpy.maximum(numpy.maximum(red, green), blue)
+    minc = numpy.minimum(numpy.minimum(red, green), blue)
+    sumc = maxc + minc
+    rangec = maxc - minc
+    lightness = sumc / 2.0
+    grey = minc == maxc
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        saturation = numpy.where(lightness <= 0.5, rangec / sumc, rangec / (2.0 - maxc - minc))
+        range_or_one = numpy.where(grey, 1.0, rangec)
+        rc = (maxc - red) / range_or_one
+        gc = (maxc - green) / range_or_one
+        bc = (maxc - blue) / range_or_one
+    hue = numpy.where(red == maxc, bc - gc, numpy.where(green == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+    hue = numpy.remainder(hue / 6.0, 1.0)
+    hue = numpy.where(grey, 0.0, hue)
+    saturation = numpy.where(grey, 0.0, saturation)
+
+    # colorsys.hls_to_rgb with the dimmed lightness.
+    lightness = lightness / dim_ratio
+    m2 = numpy.where(lightness <= 0.5, lightness * (1.0 + saturation), lightness + saturation - (lightness * saturation))
+    m1 = 2.0 * lightness - m2
+    dim_channels = []
+    for offset in (ONE_THIRD, 0.0, -ONE_THIRD):
+        channel = _hue_to_channel(m1, m2, hue + offset)
+        channel = numpy.where(saturation == 0.0, lightness, channel)
+        dim_channels.append(numpy.trunc(channel).astype(numpy.int64))
+
+    (dim_red, dim_green, dim_blue) = dim_channels
+    return rgbToColorIntBatch(dim_red, dim_green, dim_blue, backend='numpy')
+
+
+def _hue_to_channel(m1: Any, m2: Any, hue: Any) -> Any:
+    '''The array version of colorsys._v.'''
+    hue = numpy.remainder(hue, 1.0)
+    return numpy.select(
+        [hue < ONE_SIXTH, hue < 0.5, hue < TWO_THIRD],
+        [m1 + (m2 - m1) * hue * 6.0, m2, m1 + (m2 - m1) * (TWO_THIRD - hue) * 6.0],
+        default=m1)
@@ -0,0 +1,478 @@
+'''
+A local stand-in for AbletonOSC, used to test the monitor and measure how
+it scales without a copy of Live. It simulates a grid of tracks and
+scenes, the transport, clip launches and ends, clip colors and network
+latency, and answers the OSC addresses the monitor uses.
+
+It can also be run on its own for load testing, for example::
+
+    python -m pylive_played_clip.fake_ableton --tracks 256 --launch-rate 4
+'''
+import argparse
+import heapq
+import itertools
+import logging
+import random
+import socket
+import threading
+import time
+
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from pythonosc.osc_message_builder import OscMessageBuilder
+from pythonosc.osc_packet import OscPacket, ParseError
+
+from pylive_played_clip import LIVE_CLIP_COLOR_PALETTE
+from pylive_played_clip.osc_connection import RECEIVE_BUFFER_SIZE
+
+CLIP_SETTINGS: Tuple[str, ...] = ('color', 'length', 'playing_position', 'looping')
+
+
+class FakeAbletonOSCServer():
+    '''
+    Listens for OSC messages like AbletonOSC does and answers them from a
+    simulated live set. Clips play from when they are launched until they
+    have played for their length in beats at the song tempo, unless they
+    loop. Stopping the transport stops every clip. Clips fired over OSC
+    start right away, without launch quantization.
+
+    **Class Properties**
+
+    * num_scenes: int - The number of clip slots on each track.
+    * clip_colors: typing.List[typing.List[Optional[int]]] - The color of every clip slot by track. Empty slots are None.
+    * clip_lengths: typing.List[typing.List[float]] - The length of every clip in beats.
+    * clip_looping: typing.List[typing.List[bool]] - If every clip loops.
+    * track_names: typing.List[str] - The name of every track.
+    * playing: bool - If the transport is playing.
+    * tempo: float - The song tempo in beats per minute.
+    * latency: float - The number of seconds every reply is held back.
+    * jitter: float - Up to this many seconds are added at random to the latency.
+    * commands: typing.List[typing.Tuple] - Every message received that is not a query, with its values.
+    * port: int - The port the server listens on.
+    '''
+    def __init__(
+            self,
+            num_tracks: int = 8,
+            num_scenes: int = 8,
+            host: str = '127.0.0.1',
+            port: int = 11000,
+            reply_port: Optional[int] = 11001,
+            latency: float = 0.0,
+            jitter: float = 0.0,
+            tempo: float = 120.0,
+            clip_length: float = 16.0,
+            signature_numerator: int = 4,
+            clip_trigger_quantization: int = 4) -> None:
+        '''
+        :param num_tracks: The number of tracks in the simulated set.
+        :type num_tracks: int
+        :param num_scenes: The number of clip slots on each track. Every slot holds a clip.
+        :type num_scenes: int
+        :param host: The address to listen on.
+        :type host: str
+        :param port: The port to listen on, 11000 like AbletonOSC. 0 picks a free port.
+        :type port: int
+        :param reply_port:
+            The port replies are sent to, on the host that sent the query.
+            AbletonOSC replies on 11001. None replies to the port the query
+            came from.
+        :type reply_port: Optional[int]
+        :param latency: The number of seconds every reply is held back.
+        :type latency: float
+        :param jitter: Up to this many seconds are added at random to the latency.
+        :type jitter: float
+        :param tempo: The song tempo in beats per minute.
+        :type tempo: float
+        :param clip_length: The length of every clip in beats.
+        :type clip_length: float
+        :param signature_numerator: The number of beats in a bar.
+        :type signature_numerator: int
+        :param clip_trigger_quantization: The launch quantization value reported to the monitor.
+        :type clip_trigger_quantization: int
+
+        :returns: An instance of the FakeAbletonOSCServer object.
+        :rtype: `FakeAbletonOSCServer`
+        '''
+        self.num_scenes: int = num_scenes
+        self.reply_port: Optional[int] = reply_port
+        self.latency: float = latency
+        self.jitter: float = jitter
+        self.tempo: float = tempo
+        self.clip_length: float = clip_length
+        self.signature_numerator: int = signature_numerator
+        self.clip_trigger_quantization: int = clip_trigger_quantization
+
+        self.lock: threading.RLock = threading.RLock()
+        self.track_names: List[str] = []
+        self.clip_colors: List[List[Optional[int]]] = []
+        self.clip_lengths: List[List[float]] = []
+        self.clip_looping: List[List[bool]] = []
+        self.playing_slots: List[int] = []
+        self.clip_started: List[float] = []
+        for _ in range(num_tracks):
+            self.add_track()
+
+        self.playing: bool = False
+        self.song_started: float = 0.0
+        self.last_beat: int = -1
+        self.commands: List[Tuple] = []
+        self.slot_listeners: Set[int] = set()
+        self.listener_addresses: Set[Tuple[str, int]] = set()
+        self.beat_listener: bool = False
+        self.is_playing_listener: bool = False
+
+        self.outbox: List[Tuple[float, int, bytes, Tuple[str, int]]] = []
+        self.outbox_order: Callable[[], int] = itertools.count().__next__
+        self.outbox_ready: threading.Condition = threading.Condition()
+
+        self.socket: socket.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # A sweep of a large set sends or receives a burst of one datagram per
+        # track. The default buffer drops part of the burst.
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_SIZE)
+        self.socket.bind((host, port))
+        self.port: int = self.socket.getsockname()[1]
+        self.running: bool = False
+        self.threads: List[threading.Thread] = []
+
+    def __enter__(self) -> 'FakeAbletonOSCServer':
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        '''Starts the threads that answer the messages, send the delayed
+        replies and play the clips.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.running = True
+        self.threads = [threading.Thread(target=target, daemon=True)
+                        for target in (self.receive, self.send_replies, self.play)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self) -> None:
+        '''Stops the threads and closes the socket.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.running = False
+        with self.outbox_ready:
+            self.outbox_ready.notify()
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+        for thread in self.threads:
+            thread.join(1.0)
+
+    def add_track(self, name: Optional[str] = None, index: Optional[int] = None) -> int:
+        '''Adds a track whose slots all hold a clip, colored from the Live palette.
+
+        :param name: The name of the track. Defaults to a name like 3-Audio.
+        :type name: Optional[str]
+        :param index: Where to insert the track. Defaults to the end.
+        :type index: Optional[int]
+
+        :returns: The index of the new track.
+        :rtype: int
+        '''
+        with self.lock:
+            if index is None:
+                index = len(self.track_names)
+            if name is None:
+                name = f"{len(self.track_names) + 1}-Audio"
+
+            self.track_names.insert(index, name)
+            self.clip_colors.insert(index, [
+                LIVE_CLIP_COLOR_PALETTE[(len(self.track_names) * 7 + scene) % len(LIVE_CLIP_COLOR_PALETTE)]
+                for scene in range(self.num_scenes)])
+            self.clip_lengths.insert(index, [self.clip_length] * self.num_scenes)
+            self.clip_looping.insert(index, [False] * self.num_scenes)
+            self.playing_slots.insert(index, -1)
+            self.clip_started.insert(index, 0.0)
+            return index
+
+    def remove_track(self, index: int) -> None:
+        '''Deletes a track.
+
+        :param index: The index of the track.
+        :type index: int
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        with self.lock:
+            for track_state in (self.track_names, self.clip_colors, self.clip_lengths,
+                                self.clip_looping, self.playing_slots, self.clip_started):
+                del track_state[index]
+
+    def set_playing(self, playing: bool) -> None:
+        '''Starts or stops the transport. Stopping it stops every clip.
+
+        :param playing: True to start playing.
+        :type playing: bool
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        with self.lock:
+            if playing == self.playing:
+                return
+            self.playing = playing
+            self.song_started = time.monotonic()
+            self.last_beat = -1
+            if not playing:
+                for track_index in range(len(self.playing_slots)):
+                    self.set_playing_slot(track_index, -1)
+            if self.is_playing_listener:
+                self.push('/live/song/get/is_playing', (int(playing),))
+
+    def launch_clip(self, track_index: int, clip_index: int) -> None:
+        '''Launches a clip right away and starts the transport if needed.
+
+        :param track_index: The index of the track.
+        :type track_index: int
+        :param clip_index: The index of the clip slot.
+        :type clip_index: int
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        with self.lock:
+            self.set_playing(True)
+            self.clip_started[track_index] = time.monotonic()
+            self.set_playing_slot(track_index, clip_index)
+
+    def stop_clip(self, track_index: int) -> None:
+        '''Stops the clip playing on a track.
+
+        :param track_index: The index of the track.
+        :type track_index: int
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        with self.lock:
+            self.set_playing_slot(track_index, -1)
+
+    def set_playing_slot(self, track_index: int, clip_index: int) -> None:
+        '''Changes the clip playing on a track and tells the listeners.'''
+        if self.playing_slots[track_index] == clip_index:
+            return
+        self.playing_slots[track_index] = clip_index
+        if track_index in self.slot_listeners:
+            self.push('/live/track/get/playing_slot_index', (track_index, clip_index))
+
+    def clip_seconds(self, track_index: int, clip_index: int) -> float:
+        '''The number of seconds a clip plays for at the current tempo.'''
+        return self.clip_lengths[track_index][clip_index] * 60.0 / self.tempo
+
+    def playing_position(self, track_index: int, clip_index: int) -> float:
+        '''The playing position of a clip in beats.'''
+        if self.playing_slots[track_index] != clip_index:
+            return 0.0
+        position: float = (time.monotonic() - self.clip_started[track_index]) * self.tempo / 60.0
+        return position % self.clip_lengths[track_index][clip_index]
+
+    def end_clips(self) -> None:
+        '''Stops the clips that have played for their length.'''
+        now: float = time.monotonic()
+        with self.lock:
+            for (track_index, clip_index) in enumerate(self.playing_slots):
+                if (clip_index >= 0
+                        and not self.clip_looping[track_index][clip_index]
+                        and now - self.clip_started[track_index] >= self.clip_seconds(track_index, clip_index)):
+                    self.set_playing_slot(track_index, -1)
+
+    def play(self) -> None:
+        '''The loop of the thread that ends the clips and sends the beats.'''
+        while self.running:
+            if self.playing:
+                self.end_clips()
+                beat: int = int((time.monotonic() - self.song_started) * self.tempo / 60.0)
+                if beat != self.last_beat:
+                    self.last_beat = beat
+                    if self.beat_listener:
+                        self.push('/live/song/get/beat', (beat,))
+            time.sleep(0.002)
+
+    def receive(self) -> None:
+        '''The loop of the thread that answers the messages.'''
+        while self.running:
+            try:
+                (data, address) = self.socket.recvfrom(65536)
+            except OSError:
+                return
+            if not self.running:
+                return
+            try:
+                packet = OscPacket(data)
+            except ParseError:
+                logging.debug('Ignoring a datagram that is not OSC')
+                continue
+            for timed_message in packet.messages:
+                try:
+                    self.handle(timed_message.message.address, tuple(timed_message.message.params), address)
+                except Exception as error:
+                    # Like AbletonOSC, report the message on /live/error and keep serving.
+                    logging.debug('Could not handle %s: %r', timed_message.message.address, error)
+                    self.reply('/live/error', (f"Error handling OSC message: {error!r}",), address)
+
+    def handle(self, address: str, params: Tuple, sender: Tuple[str, int]) -> None:
+        '''Answers a single OSC message.
+
+        :param address: The OSC address.
+        :type address: str
+        :param params: The values of the message.
+        :type params: typing.Tuple
+        :param sender: The host and port the message came from.
+        :type sender: typing.Tuple[str, int]
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        with self.lock:
+            self.end_clips()
+            reply: Optional[Sequence] = self.answer(address, params, sender)
+        if reply is not None:
+            self.reply(address, reply, sender)
+        else:
+            self.commands.append((address,) + params)
+
+    def answer(self, address: str, params: Tuple, sender: Tuple[str, int]) -> Optional[Sequence]:
+        '''Works out the reply to a message.
+
+        :returns: The values of the reply, or None for a command.
+        :rtype: Optional[typing.Sequence]
+        '''
+        song_values: Dict[str, Sequence] = {
+            '/live/song/get/num_tracks': (len(self.track_names),),
+            '/live/song/get/is_playing': (int(self.playing),),
+            '/live/song/get/tempo': (self.tempo,),
+            '/live/song/get/track_names': tuple(self.track_names),
+            '/live/song/get/signature_numerator': (self.signature_numerator,),
+            '/live/song/get/clip_trigger_quantization': (self.clip_trigger_quantization,),
+        }
+        if address in song_values:
+            return song_values[address]
+
+        if address == '/live/track/get/playing_slot_index':
+            return (params[0], self.playing_slots[params[0]])
+        if address == '/live/track/get/clips/color':
+            return (params[0],) + tuple(self.clip_colors[params[0]])
+        if address.startswith('/live/clip/get/') and address.rsplit('/', 1)[1] in CLIP_SETTINGS:
+            (track_index, clip_index) = params[0:2]
+            value: Dict[str, object] = {
+                'color': self.clip_colors[track_index][clip_index],
+                'length': self.clip_lengths[track_index][clip_index],
+                'playing_position': self.playing_position(track_index, clip_index),
+                'looping': int(self.clip_looping[track_index][clip_index]),
+            }
+            return (track_index, clip_index, value[address.rsplit('/', 1)[1]])
+
+        if address == '/live/clip/set/color':
+            self.clip_colors[params[0]][params[1]] = int(params[2])
+        elif address == '/live/clip/set/looping':
+            self.clip_looping[params[0]][params[1]] = bool(params[2])
+        elif address == '/live/clip/fire':
+            self.launch_clip(params[0], params[1])
+        elif address == '/live/clip/stop':
+            self.stop_clip(params[0])
+        elif address in ('/live/song/start_playing', '/live/song/stop_playing'):
+            self.set_playing('start' in address)
+        elif address == '/live/track/start_listen/playing_slot_index':
+            self.slot_listeners.add(params[0])
+            self.listener_addresses.add(sender)
+        elif address == '/live/track/stop_listen/playing_slot_index':
+            self.slot_listeners.discard(params[0])
+        elif address in ('/live/song/start_listen/beat', '/live/song/stop_listen/beat'):
+            self.beat_listener = 'start' in address
+            self.listener_addresses.add(sender)
+        elif address in ('/live/song/start_listen/is_playing', '/live/song/stop_listen/is_playing'):
+            self.is_playing_listener = 'start' in address
+            self.listener_addresses.add(sender)
+        return None
+
+    def push(self, address: str, values: Sequence) -> None:
+        '''Sends a listener message to every client that subscribed.'''
+        for sender in list(self.listener_addresses):
+            self.reply(address, values, sender)
+
+    def reply(self, address: str, values: Sequence, sender: Tuple[str, int]) -> None:
+        '''Sends a reply, after the simulated latency.
+
+        :param address: The OSC address.
+        :type address: str
+        :param values: The values of the reply.
+        :type values: typing.Sequence
+        :param sender: The host and port the query came from.
+        :type sender: typing.Tuple[str, int]
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        builder = OscMessageBuilder(address)
+        for value in values:
+            builder.add_arg(value)
+        destination: Tuple[str, int] = sender if self.reply_port is None else (sender[0], self.reply_port)
+        dgram: bytes = builder.build().dgram
+
+        delay: float = self.latency + (random.uniform(0.0, self.jitter) if self.jitter else 0.0)
+        if delay <= 0:
+            self.socket.sendto(dgram, destination)
+            return
+        with self.outbox_ready:
+            heapq.heappush(self.outbox, (time.monotonic() + delay, self.outbox_order(), dgram, destination))
+            self.outbox_ready.notify()
+
+    def send_replies(self) -> None:
+        '''The loop of the thread that sends the delayed replies when they are due.'''
+        with self.outbox_ready:
+            while self.running:
+                if not self.outbox:
+                    self.outbox_ready.wait()
+                    continue
+                wait: float = self.outbox[0][0] - time.monotonic()
+                if wait > 0:
+                    self.outbox_ready.wait(wait)
+                    continue
+                (_, _, dgram, destination) = heapq.heappop(self.outbox)
+                try:
+                    self.socket.sendto(dgram, destination)
+                except OSError:
+                    return
+
+
+def main() -> None:
+    '''Runs the fake server from the command line, launching clips at random.'''
+    parser = argparse.ArgumentParser(description='A local stand-in for AbletonOSC.')
+    parser.add_argument('--tracks', default=8, type=int, dest='tracks', help='Default 8. The number of tracks.')
+    parser.add_argument('--scenes', default=8, type=int, dest='scenes', help='Default 8. The number of clip slots per track.')
+    parser.add_argument('--port', default=11000, type=int, dest='port', help='Default 11000. The port to listen on.')
+    parser.add_argument('--latency', default=0.0, type=float, dest='latency', help='Default 0 seconds. The delay of every reply.')
+    parser.add_argument('--jitter', default=0.0, type=float, dest='jitter', help='Default 0 seconds. Random extra delay of every reply.')
+    parser.add_argument('--clip-length', default=16.0, type=float, dest='clip_length', help='Default 16 beats. The length of every clip.')
+    parser.add_argument('--launch-rate', default=1.0, type=float, dest='launch_rate', help='Default 1. Clips launched per second at random.')
+    args = parser.parse_args()
+
+    server = FakeAbletonOSCServer(args.tracks, args.scenes, port=args.port, latency=args.latency,
+                                  jitter=args.jitter, clip_length=args.clip_length)
+    print(f"Fake AbletonOSC listening on port {server.port} with {args.tracks} tracks")
+    with server:
+        try:
+            while True:
+                time.sleep(1.0 / args.launch_rate if args.launch_rate > 0 else 1.0)
+                if args.launch_rate > 0:
+                    server.launch_clip(random.randrange(args.tracks), random.randrange(args.scenes))
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+'''
+A crash-safe journal of the original clip colors. The monitor only keeps
+the original colors in memory, so if the process dies mid-show every dimmed
+clip would stay dimmed. Each original color is appended to the journal by a
+background thread, which syncs the file to disk in batches. On startup the
+journal is read back so the colors can still be restored, and it is
+compacted each time the colors have been restored.
+
+The file starts with magic bytes, followed by one fixed size record of
+(track index, clip index, color) per clip. A record cut short by a crash is
+ignored.
+'''
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+
+from typing import BinaryIO, Dict, Mapping, Tuple, Union
+
+from pylive_played_clip import AbletonClipMonitorException
+
+MAGIC: bytes = b'PLPCJRN1'
+RECORD: struct.Struct = struct.Struct('<HHI')
+
+
+def read_journal(path: str) -> Dict[Tuple[int, int], int]:
+    '''Reads the original clip colors from a journal. When a clip appears
+    more than once, the first color is its original one.
+
+    :param path: The journal file.
+    :type path: str
+
+    :returns: The original colors keyed by (track index, clip index). Empty if the file does not exist.
+    :rtype: typing.Dict[typing.Tuple[int, int], int]
+    '''
+    colors: Dict[Tuple[int, int], int] = {}
+    if not os.path.exists(path):
+        return colors
+
+    with open(path, 'rb') as journal:
+        data: bytes = journal.read()
+    if not data:
+        return colors
+    if not data.startswith(MAGIC):
+        raise AbletonClipMonitorException(f"{path} is not a pylive-played-clip journal.")
+
+    end: int = len(data) - (len(data) - len(MAGIC)) % RECORD.size
+    for (track_index, clip_index, color) in RECORD.iter_unpack(data[len(MAGIC):end]):
+        colors.setdefault((track_index, clip_index), color)
+    return colors
+
+
+def _sync_folder(path: str) -> None:
+    '''Syncs the folder of a file so a rename of the file survives a crash.
+    Not supported on Windows, where it is skipped.'''
+    try:
+        folder = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(folder)
+    except OSError:
+        pass
+    finally:
+        os.close(folder)
+
+
+class ColorJournal():
+    '''
+    Appends original clip colors to a journal from a background thread.
+    Recording a color only queues it, so the scan loop never waits on the
+    disk. The records queued within flush_interval seconds of each other
+    are written and synced to disk together.
+
+    **Class Properties**
+
+    * path: str - The journal file.
+    * flush_interval: float - The most number of seconds a record waits before it is synced to disk.
+    * records: queue.SimpleQueue - The records and requests waiting for the background thread.
+    '''
+    def __init__(self, path: str, flush_interval: float = 0.25) -> None:
+        '''
+        :param path: The journal file. New records are appended to it.
+        :type path: str
+        :param flush_interval: The most number of seconds a record waits before it is synced to disk.
+        :type flush_interval: float
+
+        :returns: An instance of the ColorJournal object.
+        :rtype: `ColorJournal`
+        '''
+        self.path: str = path
+        self.flush_interval: float = flush_interval
+        self.records: queue.SimpleQueue = queue.SimpleQueue()
+        self.file: BinaryIO = open(path, 'ab')
+        size: int = self.file.tell()
+        if size < len(MAGIC):
+            self.file.truncate(0)
+            self.write(MAGIC)
+        elif (size - len(MAGIC)) % RECORD.size:
+            # Drops a record cut short by a crash so the new ones line up.
+            self.file.truncate(size - (size - len(MAGIC)) % RECORD.size)
+        self.thread: threading.Thread = threading.Thread(target=self.run, name='pylive-played-clip-journal', daemon=True)
+        self.thread.start()
+
+    def record(self, track_index: int, clip_index: int, color: int) -> None:
+        '''Queues the original color of a clip. It never blocks.
+
+        :param track_index: The index of the track.
+        :type track_index: int
+        :param clip_index: The index of the clip.
+        :type clip_index: int
+        :param color: The original color of the clip.
+        :type color: int
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.records.put((int(track_index), int(clip_index), int(color)))
+
+    def rewrite(self, colors: Mapping[Tuple[int, int], int]) -> None:
+        '''Queues a replacement of the journal with just these colors, such
+        as none once they have been restored or the colors at their new
+        track indexes once tracks have moved.
+
+        :param colors: The original colors keyed by (track index, clip index).
+        :type colors: typing.Mapping[typing.Tuple[int, int], int]
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.records.put(dict(colors))
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        '''Waits for the queued records to be synced to disk.
+
+        :param timeout: The most number of seconds to wait.
+        :type timeout: float
+
+        :returns: A boolean indicating if every record was synced in time.
+        :rtype: bool
+        '''
+        synced = threading.Event()
+        self.records.put(synced)
+        return synced.wait(timeout)
+
+    def close(self) -> None:
+        '''Syncs the queued records and closes the journal.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        if self.thread.is_alive():
+            self.records.put(None)
+            self.thread.join(5.0)
+        self.file.close()
+
+    def run(self) -> None:
+        '''The loop of the background thread.'''
+        batch: bytearray = bytearray()
+        batch_started: float = 0.0
+        while True:
+            try:
+                item: Union[None, Tuple[int, int, int], Dict, threading.Event] = self.records.get(
+                    timeout=max(0.0, batch_started + self.flush_interval - time.monotonic()) if batch else None)
+            except queue.Empty:
+                self.write(batch)
+                batch = bytearray()
+                continue
+
+            if isinstance(item, tuple):
+                if not batch:
+                    batch_started = time.monotonic()
+                batch += RECORD.pack(*item)
+                if time.monotonic() - batch_started >= self.flush_interval:
+                    self.write(batch)
+                    batch = bytearray()
+                continue
+
+            self.write(batch)
+            batch = bytearray()
+            if item is None:
+                return
+            if isinstance(item, dict):
+                self.replace(item)
+            else:
+                item.set()
+
+    def write(self, data: Union[bytes, bytearray]) -> None:
+        '''Appends data to the journal and syncs it to disk.
+
+        :param data: The records.
+        :type data: Union[bytes, bytearray]
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        if not data:
+            return
+        try:
+            self.file.write(data)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        except OSError as error:
+            logging.warning('Could not write the journal %s: %s', self.path, error)
+
+    def replace(self, colors: Mapping[Tuple[int, int], int]) -> None:
+        '''Replaces the journal with just these colors. The new journal is
+        written next to it and renamed over it, so a crash leaves either the
+        old or the new journal.
+
+        :param colors: The original colors keyed by (track index, clip index).
+        :type colors: typing.Mapping[typing.Tuple[int, int], int]
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        temporary_path: str = self.path + '.tmp'
+        try:
+            with open(temporary_path, 'wb') as temporary_file:
+                temporary_file.write(MAGIC + b''.join(
+                    RECORD.pack(track_index, clip_index, color) for ((track_index, clip_index), color) in sorted(colors.items())))
+                temporary_file.flush()
+                os.fsync(temporary_file.fileno())
+            # Windows cannot rename over a file that is open.
+            self.file.close()
+            try:
+                os.replace(temporary_path, self.path)
+                _sync_folder(self.path)
+            finally:
+                self.file = open(self.path, 'ab')
+        except OSError as error:
+            logging.warning('Could not rewrite the journal %s: %s', self.path, error)
@@ -0,0 +1,40 @@
+'''
+Defers the import of a module until it is first used. Importing pylive
+starts its OSC stack, so the package only imports it once the monitor
+talks to Ableton, and ``--version``, ``--help`` and the color utilities
+work without it.
+'''
+import importlib
+
+from types import ModuleType
+from typing import Any, Optional
+
+
+class LazyModule():
+    '''
+    Stands in for a module and imports it the first time one of its
+    attributes is read. A missing module raises ImportError at that point
+    rather than when the package is imported.
+
+    **Class Properties**
+
+    * name: str - The name of the module, such as 'live'.
+    '''
+    def __init__(self, name: str) -> None:
+        '''
+        :param name: The name of the module, such as 'live'.
+        :type name: str
+
+        :returns: An instance of the LazyModule object.
+        :rtype: `LazyModule`
+        '''
+        self.name: str = name
+        self.module: Optional[ModuleType] = None
+
+    def __getattr__(self, attribute: str) -> Any:
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attribute)
+
+    def __repr__(self) -> str:
+        return f"LazyModule({self.name})"
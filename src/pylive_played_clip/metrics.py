@@ -0,0 +1,255 @@
+'''
+Counters and latency histograms kept by the monitor, so polling_delay and
+the other options can be tuned from data. The metrics can be printed as a
+summary line or written as a Prometheus text file.
+'''
+import os
+import threading
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Upper bounds of the histogram buckets in seconds, from 0.5 ms to about 33 s.
+LATENCY_BUCKETS: Tuple[float, ...] = tuple(0.0005 * 2**power for power in range(17))
+
+COUNTERS: Dict[str, str] = {
+    'sweeps': 'Scans of the live set tracks.',
+    'queries': 'Queries sent to AbletonOSC.',
+    'query_timeouts': 'Queries that were not answered in time.',
+    'commands': 'Commands sent to AbletonOSC.',
+    'skipped_commands': 'Color commands dropped because the clip already had the color.',
+    'dims': 'Clips dimmed after they ended.',
+    'restores': 'Restores of the original clip colors.',
+    'restored_clips': 'Clips whose original color was restored.',
+}
+
+HISTOGRAMS: Dict[str, str] = {
+    'sweep_seconds': 'Time taken by each scan of the tracks.',
+    'query_seconds': 'Round trip time of each query.',
+    'command_seconds': 'Time taken to send each command or bundle.',
+    'dim_lag_seconds': 'Time from the end of a clip to its dim command, at most.',
+    'restore_seconds': 'Time taken by each restore of the clip colors.',
+}
+
+
+class Histogram():
+    '''
+    A latency histogram with fixed buckets.
+
+    **Class Properties**
+
+    * buckets: typing.Tuple[float, ...] - The upper bound of each bucket in seconds.
+    * counts: typing.List[int] - The number of values in each bucket, the last one being unbounded.
+    * count: int - The number of values observed.
+    * total: float - The sum of the values observed.
+    * maximum: float - The largest value observed.
+    '''
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        '''
+        :param buckets: The upper bound of each bucket in seconds, in increasing order.
+        :type buckets: typing.Sequence[float]
+
+        :returns: An instance of the Histogram object.
+        :rtype: `Histogram`
+        '''
+        self.buckets: Tuple[float, ...] = tuple(buckets)
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.count: int = 0
+        self.total: float = 0.0
+        self.maximum: float = 0.0
+
+    def observe(self, value: float) -> None:
+        '''Adds a value to the histogram.
+
+        :param value: The value in seconds.
+        :type value: float
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        index: int = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+
+    @property
+    def mean(self) -> float:
+        '''The mean of the values observed, 0 if there are none.'''
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, quantile: float) -> float:
+        '''Estimates a quantile as the upper bound of the bucket it falls in.
+
+        :param quantile: The quantile between 0 and 1, such as 0.99.
+        :type quantile: float
+
+        :returns: The estimated value in seconds, 0 if there are no values.
+        :rtype: float
+        '''
+        if not self.count:
+            return 0.0
+
+        rank: float = quantile * self.count
+        seen: int = 0
+        for (index, count) in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.buckets[index], self.maximum) if index < len(self.buckets) else self.maximum
+        return self.maximum
+
+
+class MonitorMetrics():
+    '''
+    The counters and histograms of a monitor. Values may be recorded from
+    the OSC server thread as well as the monitor loop.
+
+    **Class Properties**
+
+    * counters: typing.Dict[str, int] - The counters by name.
+    * histograms: typing.Dict[str, Histogram] - The histograms by name.
+    '''
+    def __init__(self) -> None:
+        '''
+        :returns: An instance of the MonitorMetrics object.
+        :rtype: `MonitorMetrics`
+        '''
+        self.counters: Dict[str, int] = {name: 0 for name in COUNTERS}
+        self.histograms: Dict[str, Histogram] = {name: Histogram() for name in HISTOGRAMS}
+        self.lock: threading.Lock = threading.Lock()
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        '''Adds to a counter.
+
+        :param name: The name of the counter, such as 'dims'.
+        :type name: str
+        :param amount: The amount to add.
+        :type amount: int
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        with self.lock:
+            self.counters[name] += amount
+
+    def observe(self, name: str, seconds: float) -> None:
+        '''Adds a latency to a histogram.
+
+        :param name: The name of the histogram, such as 'sweep_seconds'.
+        :type name: str
+        :param seconds: The latency in seconds.
+        :type seconds: float
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        with self.lock:
+            self.histograms[name].observe(seconds)
+
+    def summary(self) -> str:
+        '''Describes the metrics in one line.
+
+        :returns: The summary of the counters and latencies.
+        :rtype: str
+        '''
+        def latency(name: str) -> str:
+            histogram: Histogram = self.histograms[name]
+            return (f"p50 {histogram.quantile(0.5) * 1000:.1f} ms "
+                    f"p99 {histogram.quantile(0.99) * 1000:.1f} ms "
+                    f"max {histogram.maximum * 1000:.1f} ms")
+
+        with self.lock:
+            return (f"{self.counters['sweeps']} sweeps {latency('sweep_seconds')} | "
+                    f"{self.counters['queries']} queries {latency('query_seconds')}, "
+                    f"{self.counters['query_timeouts']} timed out | "
+                    f"{self.counters['commands']} commands, {self.counters['skipped_commands']} skipped | "
+                    f"{self.counters['dims']} dims lag {latency('dim_lag_seconds')} | "
+                    f"{self.counters['restores']} restores of {self.counters['restored_clips']} clips")
+
+    def to_prometheus(self, prefix: str = 'pylive_played_clip', labels: Optional[Dict[str, str]] = None) -> str:
+        '''Formats the metrics in the Prometheus text exposition format.
+
+        :param prefix: The prefix of every metric name.
+        :type prefix: str
+        :param labels: Labels added to every sample, such as the host.
+        :type labels: Optional[typing.Dict[str, str]]
+
+        :returns: The metrics as text.
+        :rtype: str
+        '''
+        return format_prometheus([(self, labels or {})], prefix)
+
+
+def format_prometheus(sources: Sequence[Tuple[MonitorMetrics, Dict[str, str]]], prefix: str = 'pylive_played_clip') -> str:
+    '''Formats the metrics of one or more monitors in the Prometheus text
+    exposition format. The samples of every monitor are grouped under one
+    HELP and TYPE line per metric, told apart by their labels.
+
+    :param sources: The metrics of each monitor with the labels of its samples, such as the host.
+    :type sources: typing.Sequence[typing.Tuple[MonitorMetrics, typing.Dict[str, str]]]
+    :param prefix: The prefix of every metric name.
+    :type prefix: str
+
+    :returns: The metrics as text.
+    :rtype: str
+    '''
+    lines: List[str] = []
+
+    def sample(name: str, value: float, labels: Dict[str, str], extra: str = '') -> None:
+        label_text: str = ','.join(f'{key}="{label_value}"' for (key, label_value) in sorted(labels.items()))
+        sample_labels: str = ','.join(text for text in (label_text, extra) if text)
+        lines.append(f"{name}{{{sample_labels}}} {value}" if sample_labels else f"{name} {value}")
+
+    for (name, help_text) in COUNTERS.items():
+        lines.append(f"# HELP {prefix}_{name}_total {help_text}")
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        for (metrics, labels) in sources:
+            with metrics.lock:
+                sample(f"{prefix}_{name}_total", metrics.counters[name], labels)
+
+    for (name, help_text) in HISTOGRAMS.items():
+        lines.append(f"# HELP {prefix}_{name} {help_text}")
+        lines.append(f"# TYPE {prefix}_{name} histogram")
+        for (metrics, labels) in sources:
+            with metrics.lock:
+                histogram: Histogram = metrics.histograms[name]
+                cumulative: int = 0
+                for (bound, count) in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    sample(f"{prefix}_{name}_bucket", cumulative, labels, f'le="{bound:g}"')
+                sample(f"{prefix}_{name}_bucket", histogram.count, labels, 'le="+Inf"')
+                sample(f"{prefix}_{name}_sum", histogram.total, labels)
+                sample(f"{prefix}_{name}_count", histogram.count, labels)
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_atomically(path: str, text: str) -> None:
+    '''Writes a file so that readers, such as the Prometheus node exporter,
+    only ever see the old or the new content. The text is written to a
+    temporary file in the same folder, which then replaces the file.
+
+    :param path: The file to write.
+    :type path: str
+    :param text: The content of the file.
+    :type text: str
+
+    :returns: Nothing
+    :rtype: None
+    '''
+    import tempfile
+
+    folder: str = os.path.dirname(os.path.abspath(path))
+    (handle, temporary_path) = tempfile.mkstemp(dir=folder, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'w') as temporary_file:
+            temporary_file.write(text)
+            temporary_file.flush()
+            os.fsync(temporary_file.fileno())
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
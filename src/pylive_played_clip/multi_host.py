@@ -0,0 +1,335 @@
+'''
+Monitors several Ableton Live hosts from one process, such as a main and a
+backup machine. One scheduler paces the scans of every host and one socket
+and receive thread carries their OSC traffic. Each host keeps the state and
+metrics of its own AbletonClipMonitor. The queries of every host are sent
+before any reply is waited on, so a cycle costs about one round trip to the
+slowest host rather than one round trip per host.
+'''
+import logging
+import time
+
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from pylive_played_clip import AbletonClipMonitor, AbletonClipMonitorException, PendingQueries
+from pylive_played_clip.lazy_import import LazyModule
+from pylive_played_clip.metrics import format_prometheus, write_atomically
+from pylive_played_clip.osc_connection import OscConnection, OscSocket
+from pylive_played_clip.output import BackgroundWriter, PrefixedWriter
+from pylive_played_clip.scheduler import FixedRateScheduler
+
+live = LazyModule('live')
+
+IS_PLAYING_ADDRESS: str = '/live/song/get/is_playing'
+
+
+def parse_host(text: str, default_port: int = 11000) -> Tuple[str, int]:
+    '''Splits a host such as 192.168.1.20:11000 into its host and port.
+
+    :param text: The host, followed by a colon and the port if it is not the default.
+    :type text: str
+    :param default_port: The port used when none is given.
+    :type default_port: int
+
+    :returns: The host and the port.
+    :rtype: typing.Tuple[str, int]
+    '''
+    (host, separator, port) = text.rpartition(':')
+    if not separator:
+        return (text, default_port)
+    if not port.isdigit():
+        raise AbletonClipMonitorException(f"The port of the host \"{text}\" is not a number.")
+    return (host, int(port))
+
+
+class MultiHostMonitor():
+    '''
+    Runs an AbletonClipMonitor for each of several hosts on one scheduler
+    and one socket. A host that stops answering is left out of the scans
+    and probed without waiting until it answers again, so it never slows
+    down the other hosts. Only the 'poll' mode is supported.
+
+    **Class Properties**
+
+    * monitors: typing.Dict[str, AbletonClipMonitor] - The monitor of each host, keyed by host:port.
+    * online: typing.Dict[str, bool] - If each host answered its last query.
+    * osc_socket: OscSocket - The socket shared by the connections to every host.
+    * scheduler: FixedRateScheduler - Paces the cycles of every host. With
+      adaptive polling, its period follows the slowest host.
+    * adaptive_polling: bool - If the polling delay of each host adapts to how fast it answers.
+    * output: BackgroundWriter - The output thread shared by every monitor.
+      The lines of each host start with its name.
+    * reconnect_interval: float - The number of seconds between probes of a host that is not answering.
+    * print_stats: bool - If set, a summary of the metrics of each host is printed every stats_interval seconds.
+    * stats_file: Optional[str] - If set, the metrics of every host are
+      written to this file in the Prometheus text format, labelled by host.
+    * stats_interval: float - The number of seconds between reports of the metrics.
+    * clock: typing.Callable[[], float] - The clock the scheduler, the stats and every monitor read.
+    '''
+    def __init__(
+            self,
+            hosts: Sequence[str],
+            listen_port: int = 11001,
+            timeout: float = 2.0,
+            polling_delay: float = 0.1,
+            overrun: str = 'skip',
+            reconnect_interval: float = 5.0,
+            print_stats: bool = False,
+            stats_file: Optional[str] = None,
+            stats_interval: float = 10.0,
+            clock: Callable[[], float] = time.monotonic,
+            sleep: Callable[[float], None] = time.sleep,
+            **monitor_options: Any) -> None:
+        '''
+        :param hosts: The hosts running AbletonOSC, each followed by a colon and its port if it is not 11000.
+        :type hosts: typing.Sequence[str]
+        :param listen_port: The local port replies are received on. 0 picks a free port.
+        :type listen_port: int
+        :param timeout: The number of seconds a query waits for its reply.
+        :type timeout: float
+        :param polling_delay: The number of seconds between the cycles that scan every host.
+        :type polling_delay: float
+        :param overrun: What the scheduler does when a cycle takes longer than polling_delay. See AbletonClipMonitor.
+        :type overrun: str
+        :param reconnect_interval: The number of seconds between probes of a host that is not answering.
+        :type reconnect_interval: float
+        :param print_stats: If set to true, a summary of the metrics of each host is printed every stats_interval seconds.
+        :type print_stats: bool
+        :param stats_file: If set, the metrics of every host are written to this file in the Prometheus text format.
+        :type stats_file: Optional[str]
+        :param stats_interval: The number of seconds between reports of the metrics.
+        :type stats_interval: float
+        :param clock: The clock, in seconds, of the scheduler, the stats and every monitor. Defaults to time.monotonic.
+        :type clock: typing.Callable[[], float]
+        :param sleep: Sleeps on the clock. Defaults to time.sleep.
+        :type sleep: typing.Callable[[float], None]
+        :param monitor_options: The other options of each AbletonClipMonitor, such as dim_color.
+
+        :returns: An instance of the MultiHostMonitor object.
+        :rtype: `MultiHostMonitor`
+        '''
+        if not hosts:
+            raise AbletonClipMonitorException('At least one host is needed.')
+        if monitor_options.get('mode', 'poll') != 'poll':
+            raise AbletonClipMonitorException('Only the poll mode can monitor several hosts.')
+        if monitor_options.get('record'):
+            raise AbletonClipMonitorException('A session cannot be recorded while monitoring several hosts.')
+        if monitor_options.get('transport_listener') or monitor_options.get('max_idle_delay') is not None:
+            raise AbletonClipMonitorException('The hosts share one schedule, so the transport cannot be watched per host.')
+
+        self.clock: Callable[[], float] = clock
+        self.scheduler: FixedRateScheduler = FixedRateScheduler(float(polling_delay), overrun, clock=clock, sleep=sleep)
+        self.reconnect_interval: float = reconnect_interval
+        self.adaptive_polling: bool = bool(monitor_options.get('adaptive_polling'))
+        self.print_stats: bool = print_stats
+        self.stats_file: Optional[str] = stats_file
+        self.stats_interval: float = stats_interval
+        self.stats_reported: float = clock()
+        self.output: BackgroundWriter = BackgroundWriter()
+        self.monitors: Dict[str, AbletonClipMonitor] = {}
+        self.online: Dict[str, bool] = {}
+        self.probes: Dict[str, PendingQueries] = {}
+        self.osc_socket: OscSocket = OscSocket(listen_port)
+
+        try:
+            for text in hosts:
+                (host, port) = parse_host(text)
+                name: str = f"{host}:{port}"
+                if name in self.monitors:
+                    raise AbletonClipMonitorException(f"The host {name} was given twice.")
+                connection = OscConnection(host, port, timeout=timeout, osc_socket=self.osc_socket)
+                host_options: Dict[str, Any] = dict(monitor_options)
+                if host_options.get('journal'):
+                    # Each host keeps its own journal, as the clips are different.
+                    host_options['journal'] = f"{host_options['journal']}.{host}_{port}"
+                monitor = AbletonClipMonitor(connection=connection, polling_delay=polling_delay,
+                                             overrun=overrun, clock=clock, sleep=sleep, **host_options)
+                monitor.output = PrefixedWriter(self.output, f"[{name}] ")
+                self.monitors[name] = monitor
+                self.online[name] = False
+        except BaseException:
+            self.close()
+            raise
+
+    def start_host(self, name: str) -> bool:
+        '''Reads the tracks and clip colors of a host before it is scanned.
+
+        :param name: The host:port of the host.
+        :type name: str
+
+        :returns: A boolean indicating if the host answered.
+        :rtype: bool
+        '''
+        monitor: AbletonClipMonitor = self.monitors[name]
+        try:
+            monitor.num_tracks = monitor.get_number_of_tracks()
+            monitor.track_names = monitor.get_track_names()
+            monitor.layout_checked = monitor.clock()
+            monitor.load_clip_color_grid()
+            if monitor.recover:
+                monitor.recover_clip_colors()
+                monitor.recover = False
+        except live.exceptions.LiveConnectionError:
+            self.set_online(name, False)
+            return False
+
+        self.set_online(name, True)
+        logging.debug('Host %s has %d tracks.', name, monitor.num_tracks)
+        return True
+
+    def set_online(self, name: str, online: bool) -> None:
+        '''Records if a host is answering and reports the changes.
+
+        :param name: The host:port of the host.
+        :type name: str
+        :param online: If the host answered.
+        :type online: bool
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        if online and not self.online[name]:
+            self.monitors[name].output.write('Monitoring Ableton')
+        elif not online and self.online[name]:
+            logging.warning('Host %s stopped answering.', name)
+        self.online[name] = online
+
+    def probe_offline_hosts(self) -> None:
+        '''Sends an is_playing query to each host that is not answering,
+        without waiting for the reply. A host that answered the previous
+        probe is started.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        for (name, monitor) in self.monitors.items():
+            if self.online[name]:
+                continue
+
+            probe: Optional[PendingQueries] = self.probes.get(name)
+            if probe is not None and probe.complete.is_set():
+                del self.probes[name]
+                monitor.pending_queries.pop(IS_PLAYING_ADDRESS, None)
+                self.start_host(name)
+            elif probe is None or monitor.clock() - probe.sent > self.reconnect_interval:
+                self.probes[name] = monitor.send_queries(IS_PLAYING_ADDRESS, [()])
+
+    def get_playing_hosts(self) -> List[str]:
+        '''Queries every host that is answering for its transport at once.
+
+        :returns: The host:port of the hosts that are playing.
+        :rtype: typing.List[str]
+        '''
+        pending: Dict[str, PendingQueries] = {
+            name: monitor.send_queries(IS_PLAYING_ADDRESS, [()])
+            for (name, monitor) in self.monitors.items() if self.online[name]}
+
+        playing: List[str] = []
+        for (name, queries) in pending.items():
+            try:
+                replies: Dict[Tuple, Tuple] = self.monitors[name].wait_for_replies(queries)
+            except live.exceptions.LiveConnectionError:
+                self.set_online(name, False)
+                continue
+            if bool(replies[()][0]):
+                playing.append(name)
+        return playing
+
+    def cycle(self) -> None:
+        '''Scans every host that is playing and restores the colors of the
+        hosts that stopped. The scans of every host are in flight at once.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.probe_offline_hosts()
+        playing: List[str] = self.get_playing_hosts()
+
+        scans: Dict[str, PendingQueries] = {name: self.monitors[name].start_scan() for name in playing}
+        for (name, pending) in scans.items():
+            try:
+                self.monitors[name].finish_scan(pending)
+            except live.exceptions.LiveConnectionError:
+                self.set_online(name, False)
+
+        if self.adaptive_polling:
+            # The hosts share one schedule, which follows the slowest of them.
+            periods: List[float] = [self.monitors[name].scheduler.period for name in scans if self.online[name]]
+            if periods:
+                self.scheduler.period = max(periods)
+
+        for (name, monitor) in self.monitors.items():
+            if not self.online[name]:
+                continue
+            try:
+                monitor.refresh_clip_color_grid()
+                monitor.flush_clip_colors()
+                if name not in scans:
+                    monitor.reset_when_stopped()
+                monitor.check_track_layout()
+            except live.exceptions.LiveConnectionError:
+                self.set_online(name, False)
+
+    def report_stats(self, force: bool = False) -> None:
+        '''Prints the summary of the metrics of each host and writes the
+        Prometheus text file, when requested, every stats_interval seconds.
+
+        :param force: If set to true, the metrics are reported right away.
+        :type force: bool
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        if not (self.print_stats or self.stats_file):
+            return
+        if not force and self.clock() - self.stats_reported < self.stats_interval:
+            return
+
+        self.stats_reported = self.clock()
+        if self.print_stats:
+            for (name, monitor) in self.monitors.items():
+                self.output.write(f"Stats {name}: {monitor.metrics.summary()}")
+        if self.stats_file:
+            text: str = format_prometheus([(monitor.metrics, {'host': name}) for (name, monitor) in self.monitors.items()])
+            try:
+                write_atomically(self.stats_file, text)
+            except OSError as error:
+                logging.warning('Could not write the stats file %s: %s', self.stats_file, error)
+
+    def monitor(self) -> None:
+        '''The main routine
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        for name in self.monitors:
+            if not self.start_host(name):
+                logging.warning('Host %s is not answering, it will be monitored once it does.', name)
+        self.output.write('press ctrl-c to exit')
+
+        self.scheduler.start()
+        try:
+            while True:
+                self.report_stats()
+                self.cycle()
+                self.scheduler.wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for (name, monitor) in self.monitors.items():
+                if self.online[name]:
+                    monitor.flush_clip_colors(force=True)
+            self.report_stats(force=True)
+            self.output.flush()
+            self.close()
+
+    def close(self) -> None:
+        '''Closes the journals and the shared socket.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        for monitor in self.monitors.values():
+            if monitor.journal is not None:
+                monitor.journal.close()
+        self.osc_socket.close()
@@ -0,0 +1,304 @@
+'''
+A plain UDP connection to AbletonOSC that can be pointed at any host and
+port, unlike the pylive Query object which always talks to 127.0.0.1:11000
+and listens on 11001. It provides the query, cmd and add_handler methods
+the monitor expects from a connection, plus send_bundle. The connections to
+several hosts can share one socket and receive thread.
+'''
+import logging
+import socket
+import threading
+
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from pythonosc.osc_message_builder import OscMessageBuilder
+from pythonosc.osc_packet import OscPacket, ParseError
+
+from pylive_played_clip import build_osc_bundle
+from pylive_played_clip.lazy_import import LazyModule
+
+live = LazyModule('live')
+
+RECEIVE_BUFFER_SIZE: int = 4 * 1024 * 1024
+
+
+class _Waiter():
+    '''A query waiting for its reply.'''
+    def __init__(self, address: str, args: Tuple) -> None:
+        self.address: str = address
+        self.args: Tuple = args
+        self.reply: Tuple = ()
+        self.answered: threading.Event = threading.Event()
+
+
+class OscSocket():
+    '''
+    A UDP socket and the background thread that reads from it, shared by
+    the connections to one or more AbletonOSC hosts. Each datagram is passed
+    to the connection of the host and port it came from.
+
+    **Class Properties**
+
+    * listen_port: int - The local port replies are received on.
+    * connections: typing.Dict - The connections by the address of their host.
+    '''
+    def __init__(self, listen_port: int = 0) -> None:
+        '''
+        :param listen_port: The local port replies are received on. 0 picks a free port.
+        :type listen_port: int
+
+        :returns: An instance of the OscSocket object.
+        :rtype: `OscSocket`
+        '''
+        self.connections: Dict[Tuple[str, int], 'OscConnection'] = {}
+        self.closed: bool = False
+        self.socket: socket.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # A sweep of a large set sends or receives a burst of one datagram per
+        # track. The default buffer drops part of the burst.
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_SIZE)
+        self.socket.bind(('0.0.0.0', listen_port))
+        self.listen_port: int = self.socket.getsockname()[1]
+        self.thread: threading.Thread = threading.Thread(target=self.receive, daemon=True)
+        self.thread.start()
+
+    def register(self, connection: 'OscConnection') -> None:
+        '''Routes the datagrams from the host of a connection to it.
+
+        :param connection: The connection.
+        :type connection: OscConnection
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.connections[connection.address] = connection
+
+    def unregister(self, connection: 'OscConnection') -> None:
+        '''Stops routing the datagrams from the host of a connection.
+
+        :param connection: The connection.
+        :type connection: OscConnection
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        if self.connections.get(connection.address) is connection:
+            del self.connections[connection.address]
+
+    def send(self, dgram: bytes, address: Tuple[str, int]) -> None:
+        '''Sends a datagram.
+
+        :param dgram: The encoded OSC message or bundle.
+        :type dgram: bytes
+        :param address: The host and port to send to.
+        :type address: typing.Tuple[str, int]
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.socket.sendto(dgram, address)
+
+    def receive(self) -> None:
+        '''The loop of the background thread that reads the replies.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        while True:
+            try:
+                (data, sender) = self.socket.recvfrom(65536)
+            except OSError:
+                return
+            if self.closed:
+                return
+
+            connection: Optional[OscConnection] = self.connections.get(sender)
+            if connection is None:
+                logging.debug('Ignoring a datagram from %s:%d', sender[0], sender[1])
+                continue
+            try:
+                packet = OscPacket(data)
+            except ParseError:
+                logging.debug('Ignoring a datagram that is not OSC')
+                continue
+            for timed_message in packet.messages:
+                connection.dispatch(timed_message.message.address, tuple(timed_message.message.params))
+
+    def close(self) -> None:
+        '''Closes the socket, which stops the background thread.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.closed = True
+        try:
+            # Wakes up the background thread blocked on recvfrom.
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+        self.thread.join(1.0)
+
+
+class OscConnection():
+    '''
+    Sends OSC messages to AbletonOSC and dispatches its replies. Replies are
+    matched to queries by address and by the leading arguments AbletonOSC
+    echoes back, so queries can be sent from several threads at once.
+
+    **Class Properties**
+
+    * host: str - The host running AbletonOSC.
+    * port: int - The port AbletonOSC listens on.
+    * address: typing.Tuple[str, int] - The IP address and port of AbletonOSC.
+    * timeout: float - The number of seconds a query waits for its reply.
+    * handlers: typing.Dict - The callbacks of each OSC address.
+    * osc_socket: OscSocket - The socket the connection sends and receives on.
+    '''
+    def __init__(
+            self,
+            host: str = '127.0.0.1',
+            port: int = 11000,
+            listen_port: int = 0,
+            timeout: float = 2.0,
+            osc_socket: Optional[OscSocket] = None) -> None:
+        '''
+        :param host: The host running AbletonOSC.
+        :type host: str
+        :param port: The port AbletonOSC listens on.
+        :type port: int
+        :param listen_port: The local port replies are received on. 0 picks a free port. Not used with osc_socket.
+        :type listen_port: int
+        :param timeout: The number of seconds a query waits for its reply.
+        :type timeout: float
+        :param osc_socket: A socket shared with the connections to other hosts. Defaults to a socket of its own.
+        :type osc_socket: Optional[OscSocket]
+
+        :returns: An instance of the OscConnection object.
+        :rtype: `OscConnection`
+        '''
+        self.host: str = host
+        self.port: int = port
+        self.address: Tuple[str, int] = (socket.gethostbyname(host), port)
+        self.timeout: float = timeout
+        self.handlers: Dict[str, List[Callable]] = {}
+        self.waiters: List[_Waiter] = []
+        self.lock: threading.Lock = threading.Lock()
+        self.owns_socket: bool = osc_socket is None
+        self.osc_socket: OscSocket = osc_socket if osc_socket is not None else OscSocket(listen_port)
+        self.listen_port: int = self.osc_socket.listen_port
+        self.osc_socket.register(self)
+
+    def send(self, dgram: bytes) -> None:
+        '''Sends a datagram to AbletonOSC.
+
+        :param dgram: The encoded OSC message or bundle.
+        :type dgram: bytes
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.osc_socket.send(dgram, self.address)
+
+    def cmd(self, msg: str, args: Sequence = ()) -> None:
+        '''Sends a command.
+
+        :param msg: The OSC address.
+        :type msg: str
+        :param args: The values of the command.
+        :type args: typing.Sequence
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        builder = OscMessageBuilder(msg)
+        for arg in args:
+            builder.add_arg(arg)
+        self.send(builder.build().dgram)
+
+    def send_bundle(self, msg: str, args_list: Sequence[Tuple]) -> None:
+        '''Sends one command per entry in args_list in a single OSC bundle.
+
+        :param msg: The OSC address of every command.
+        :type msg: str
+        :param args_list: The values of each command.
+        :type args_list: typing.Sequence[typing.Tuple]
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.send(build_osc_bundle(msg, args_list).dgram)
+
+    def query(self, msg: str, args: Sequence = (), timeout: Optional[float] = None) -> Tuple:
+        '''Sends a query and waits for its reply.
+
+        :param msg: The OSC address.
+        :type msg: str
+        :param args: The values of the query.
+        :type args: typing.Sequence
+        :param timeout: The number of seconds to wait. Defaults to timeout.
+        :type timeout: Optional[float]
+
+        :returns: The values of the reply.
+        :rtype: typing.Tuple
+        '''
+        waiter = _Waiter(msg, tuple(args))
+        with self.lock:
+            self.waiters.append(waiter)
+        try:
+            self.cmd(msg, args)
+            if not waiter.answered.wait(self.timeout if timeout is None else timeout):
+                raise live.exceptions.LiveConnectionError(
+                    f"Timed out waiting for response to query: {msg} {tuple(args)}. "
+                    f"Is Live running on {self.host}:{self.port} and AbletonOSC installed?")
+        finally:
+            with self.lock:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+        return waiter.reply
+
+    def add_handler(self, address: str, handler: Callable) -> None:
+        '''Registers a callback for every message received on an address.
+
+        :param address: The OSC address.
+        :type address: str
+        :param handler: Called with the values of each message.
+        :type handler: typing.Callable
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.handlers.setdefault(address, []).append(handler)
+
+    def dispatch(self, address: str, data: Tuple) -> None:
+        '''Passes a message to the handlers of its address and to the first
+        query it answers.
+
+        :param address: The OSC address.
+        :type address: str
+        :param data: The values of the message.
+        :type data: typing.Tuple
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        for handler in self.handlers.get(address, []):
+            handler(*data)
+
+        with self.lock:
+            for waiter in self.waiters:
+                if (waiter.address == address
+                        and not waiter.answered.is_set()
+                        and data[:len(waiter.args)] == waiter.args):
+                    waiter.reply = data
+                    waiter.answered.set()
+                    break
+
+    def close(self) -> None:
+        '''Stops receiving replies. The socket is closed unless it is shared.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.osc_socket.unregister(self)
+        if self.owns_socket:
+            self.osc_socket.close()
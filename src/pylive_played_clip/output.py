@@ -0,0 +1,171 @@
+'''
+Writes the messages of the monitor and its log records from a background
+thread. When stdout is a slow pipe or a remote terminal, a blocking write
+in the scan loop would delay the dims, so the loop only queues the lines.
+'''
+import queue
+import sys
+import threading
+
+from typing import Any, List, Optional, TextIO, Union
+
+
+class BackgroundWriter():
+    '''
+    Writes lines to a stream from a background thread, which is started
+    with the first line.
+
+    **Class Properties**
+
+    * stream: Optional[typing.TextIO] - The stream written to. None writes
+      to sys.stdout as it is when each line is written.
+    * lines: queue.SimpleQueue - The lines waiting to be written.
+    '''
+    def __init__(self, stream: Optional[TextIO] = None) -> None:
+        '''
+        :param stream: The stream to write to. Defaults to sys.stdout.
+        :type stream: Optional[typing.TextIO]
+
+        :returns: An instance of the BackgroundWriter object.
+        :rtype: `BackgroundWriter`
+        '''
+        self.stream: Optional[TextIO] = stream
+        self.lines: queue.SimpleQueue = queue.SimpleQueue()
+        self.thread: Optional[threading.Thread] = None
+        self.lock: threading.Lock = threading.Lock()
+
+    def write(self, line: str) -> None:
+        '''Queues a line to be written. It never blocks.
+
+        :param line: The line, without the line break.
+        :type line: str
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.lines.put(line)
+        if self.thread is None:
+            self.start()
+
+    def start(self) -> None:
+        '''Starts the background thread if it is not running.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='pylive-played-clip-output', daemon=True)
+                self.thread.start()
+
+    def run(self) -> None:
+        '''The loop of the background thread. The lines queued while a write
+        was blocked are written together.'''
+        while True:
+            item: Union[str, threading.Event] = self.lines.get()
+            text: str = ''
+            flushed: Optional[threading.Event] = None
+            while True:
+                if isinstance(item, threading.Event):
+                    flushed = item
+                    break
+                text += item + '\n'
+                try:
+                    item = self.lines.get_nowait()
+                except queue.Empty:
+                    break
+
+            if text:
+                stream: TextIO = self.stream or sys.stdout
+                try:
+                    stream.write(text)
+                    stream.flush()
+                except (OSError, ValueError):
+                    # A closed pipe or stream must not stop the monitor.
+                    pass
+            if flushed is not None:
+                flushed.set()
+
+    def flush(self, timeout: float = 1.0) -> bool:
+        '''Waits for the queued lines to be written.
+
+        :param timeout: The most number of seconds to wait.
+        :type timeout: float
+
+        :returns: A boolean indicating if every line was written in time.
+        :rtype: bool
+        '''
+        if self.thread is None:
+            return True
+        flushed = threading.Event()
+        self.lines.put(flushed)
+        return flushed.wait(timeout)
+
+
+class PrefixedWriter():
+    '''
+    Writes lines through a shared BackgroundWriter with a prefix, so the
+    monitors of several hosts share one output thread and their lines can
+    be told apart.
+
+    **Class Properties**
+
+    * writer: BackgroundWriter - The shared writer.
+    * prefix: str - Written in front of every line, such as '[main] '.
+    '''
+    def __init__(self, writer: BackgroundWriter, prefix: str) -> None:
+        '''
+        :param writer: The shared writer.
+        :type writer: BackgroundWriter
+        :param prefix: Written in front of every line, such as '[main] '.
+        :type prefix: str
+
+        :returns: An instance of the PrefixedWriter object.
+        :rtype: `PrefixedWriter`
+        '''
+        self.writer: BackgroundWriter = writer
+        self.prefix: str = prefix
+
+    def write(self, line: str) -> None:
+        '''Queues a line to be written with the prefix. It never blocks.
+
+        :param line: The line, without the line break.
+        :type line: str
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.writer.write(self.prefix + line)
+
+    def flush(self, timeout: float = 1.0) -> bool:
+        '''Waits for the queued lines of the shared writer to be written.
+
+        :param timeout: The most number of seconds to wait.
+        :type timeout: float
+
+        :returns: A boolean indicating if every line was written in time.
+        :rtype: bool
+        '''
+        return self.writer.flush(timeout)
+
+
+def start_background_logging() -> Any:
+    '''Moves the handlers of the root logger to a background thread. The
+    root logger only queues the records, so logging never blocks the caller
+    on a slow stream.
+
+    :returns: The started listener. Call its stop method to write the remaining records.
+    :rtype: logging.handlers.QueueListener
+    '''
+    import logging.handlers
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    root: logging.Logger = logging.getLogger()
+    handlers: List[logging.Handler] = list(root.handlers)
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(records))
+
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,663 @@
+'''
+Records the OSC messages the monitor exchanges with AbletonOSC to a compact
+binary log, and replays a log through the monitor on a virtual clock. A
+show recorded with ``--record`` can be re-run in seconds to check that a
+change does not add OSC traffic or detection latency, for example::
+
+    python -m pylive_played_clip.recording show.plpc --polling-delay 0.1
+
+The log starts with a header, the magic bytes and the wall clock time the
+recording started, followed by one record per message. Each record is the
+number of microseconds since the previous record, the kind of record, the
+index of its OSC address and the length of its values, followed by the
+values encoded as OSC arguments. An address is written once, in an
+'address' record, the first time it is used.
+'''
+import argparse
+import bisect
+import os
+import statistics
+import struct
+import threading
+import time
+
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from pythonosc.osc_message import OscMessage
+from pythonosc.osc_message_builder import OscMessageBuilder
+
+from pylive_played_clip import AbletonClipMonitor, AbletonClipMonitorException, build_osc_bundle
+from pylive_played_clip.lazy_import import LazyModule
+from pylive_played_clip.output import BackgroundWriter
+
+live = LazyModule('live')
+
+MAGIC: bytes = b'PLPCREC1'
+HEADER: struct.Struct = struct.Struct('<d')
+RECORD: struct.Struct = struct.Struct('<IBHH')
+
+ADDRESS: int = 0
+QUERY: int = 1
+REPLY: int = 2
+COMMAND: int = 3
+MESSAGE: int = 4
+
+RECORD_KINDS: Dict[int, str] = {
+    ADDRESS: 'address',
+    QUERY: 'query',
+    REPLY: 'reply',
+    COMMAND: 'command',
+    MESSAGE: 'message',
+}
+
+# The leading values of a reply that AbletonOSC echoes from the query, by
+# the OSC address prefix. They tell the replies of different clips apart.
+KEY_LENGTHS: Tuple[Tuple[str, int], ...] = (
+    ('/live/clip_slot/', 2),
+    ('/live/clip/', 2),
+    ('/live/track/', 1),
+)
+
+_EMPTY_ADDRESS: bytes = b'/\x00\x00\x00'
+
+
+def encode_values(values: Sequence) -> bytes:
+    '''Encodes the values of a message as OSC arguments, without the address.
+
+    :param values: The values of the message.
+    :type values: typing.Sequence
+
+    :returns: The OSC type tags followed by the arguments.
+    :rtype: bytes
+    '''
+    builder = OscMessageBuilder('/')
+    for value in values:
+        builder.add_arg(value)
+    return builder.build().dgram[len(_EMPTY_ADDRESS):]
+
+
+def decode_values(payload: bytes) -> Tuple:
+    '''Decodes the values written by encode_values.
+
+    :param payload: The OSC type tags followed by the arguments.
+    :type payload: bytes
+
+    :returns: The values of the message.
+    :rtype: typing.Tuple
+    '''
+    return tuple(OscMessage(_EMPTY_ADDRESS + payload).params)
+
+
+def key_length(address: str) -> int:
+    '''The number of leading values that identify what a query is about,
+    such as the track and clip indexes of a /live/clip/get/color query.
+
+    :param address: The OSC address.
+    :type address: str
+
+    :returns: The number of leading values.
+    :rtype: int
+    '''
+    for (prefix, length) in KEY_LENGTHS:
+        if address.startswith(prefix):
+            return length
+    return 0
+
+
+def is_query_address(address: str) -> bool:
+    '''Tests if an address is a query that AbletonOSC answers, such as
+    /live/song/get/is_playing, rather than a command.
+
+    :param address: The OSC address.
+    :type address: str
+
+    :returns: A boolean indicating if the address is a query.
+    :rtype: bool
+    '''
+    return '/get/' in address
+
+
+class SessionRecord():
+    '''
+    One message of a recorded session.
+
+    **Class Properties**
+
+    * time: float - The number of seconds since the recording started.
+    * kind: int - One of QUERY, REPLY, COMMAND or MESSAGE.
+    * address: str - The OSC address.
+    * values: typing.Tuple - The values of the message.
+    '''
+    __slots__ = ('time', 'kind', 'address', 'values')
+
+    def __init__(self, time: float, kind: int, address: str, values: Tuple) -> None:
+        self.time: float = time
+        self.kind: int = kind
+        self.address: str = address
+        self.values: Tuple = values
+
+    def __repr__(self) -> str:
+        return f"SessionRecord({self.time:.6f}, {RECORD_KINDS[self.kind]}, {self.address}, {self.values})"
+
+
+class SessionRecorder():
+    '''
+    Writes the messages of a session to a binary log. Messages may be
+    written from the OSC server thread as well as the monitor loop.
+
+    **Class Properties**
+
+    * path: str - The log file.
+    * clock: typing.Callable[[], float] - The clock, in seconds.
+    * started: float - The clock time the recording started.
+    * records: int - The number of messages written.
+    '''
+    def __init__(self, path: str, clock: Callable[[], float] = time.monotonic) -> None:
+        '''
+        :param path: The log file. It is replaced if it exists.
+        :type path: str
+        :param clock: The clock, in seconds. Defaults to time.monotonic.
+        :type clock: typing.Callable[[], float]
+
+        :returns: An instance of the SessionRecorder object.
+        :rtype: `SessionRecorder`
+        '''
+        self.path: str = path
+        self.clock: Callable[[], float] = clock
+        self.file: BinaryIO = open(path, 'wb')
+        self.file.write(MAGIC + HEADER.pack(time.time()))
+        self.started: float = clock()
+        self.last_microseconds: int = 0
+        self.address_indexes: Dict[str, int] = {}
+        self.records: int = 0
+        self.lock: threading.Lock = threading.Lock()
+
+    def write(self, kind: int, address: str, values: Sequence = ()) -> None:
+        '''Writes a message to the log. Messages written after close are ignored.
+
+        :param kind: One of QUERY, REPLY, COMMAND or MESSAGE.
+        :type kind: int
+        :param address: The OSC address.
+        :type address: str
+        :param values: The values of the message.
+        :type values: typing.Sequence
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        payload: bytes = encode_values(values)
+        with self.lock:
+            if self.file.closed:
+                return
+            microseconds: int = max(self.last_microseconds, int((self.clock() - self.started) * 1_000_000))
+            # A gap of more than 71 minutes without a message is shortened to
+            # fit the field. The monitor queries Live every cycle, so it
+            # never happens in practice.
+            delta: int = min(microseconds - self.last_microseconds, 0xFFFFFFFF)
+            self.last_microseconds += delta
+
+            address_index: Optional[int] = self.address_indexes.get(address)
+            if address_index is None:
+                address_index = len(self.address_indexes)
+                self.address_indexes[address] = address_index
+                encoded_address: bytes = address.encode('utf-8')
+                self.file.write(RECORD.pack(0, ADDRESS, address_index, len(encoded_address)) + encoded_address)
+
+            self.file.write(RECORD.pack(delta, kind, address_index, len(payload)) + payload)
+            self.records += 1
+
+    def close(self) -> None:
+        '''Flushes and closes the log.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+def read_session(path: str) -> Iterator[SessionRecord]:
+    '''Reads the messages of a log written by SessionRecorder. A record cut
+    short by a crash ends the session.
+
+    :param path: The log file.
+    :type path: str
+
+    :returns: The messages in the order they were recorded.
+    :rtype: typing.Iterator[SessionRecord]
+    '''
+    with open(path, 'rb') as log:
+        if log.read(len(MAGIC)) != MAGIC:
+            raise AbletonClipMonitorException(f"{path} is not a pylive-played-clip recording.")
+        log.read(HEADER.size)
+
+        addresses: List[str] = []
+        microseconds: int = 0
+        while True:
+            header: bytes = log.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            (delta, kind, address_index, length) = RECORD.unpack(header)
+            payload: bytes = log.read(length)
+            if len(payload) < length:
+                return
+
+            if kind == ADDRESS:
+                addresses.append(payload.decode('utf-8'))
+                continue
+            microseconds += delta
+            yield SessionRecord(microseconds / 1_000_000, kind, addresses[address_index], decode_values(payload))
+
+
+class RecordingConnection():
+    '''
+    Wraps a connection to AbletonOSC and writes every query, reply, command
+    and received message to a SessionRecorder. It provides the same
+    methods as the connection it wraps.
+
+    **Class Properties**
+
+    * connection: Any - The wrapped connection.
+    * recorder: SessionRecorder - Writes the log.
+    '''
+    def __init__(self, connection: Any, recorder: SessionRecorder) -> None:
+        '''
+        :param connection: An object with the query, cmd and add_handler methods of the pylive Query object.
+        :type connection: Any
+        :param recorder: Writes the log.
+        :type recorder: SessionRecorder
+
+        :returns: An instance of the RecordingConnection object.
+        :rtype: `RecordingConnection`
+        '''
+        self.connection: Any = connection
+        self.recorder: SessionRecorder = recorder
+
+    def query(self, msg: str, args: Sequence = (), **kwargs: Any) -> Tuple:
+        '''Sends a query, records it and its reply and returns the reply.
+
+        :param msg: The OSC address.
+        :type msg: str
+        :param args: The values of the query.
+        :type args: typing.Sequence
+
+        :returns: The values of the reply.
+        :rtype: typing.Tuple
+        '''
+        self.recorder.write(QUERY, msg, args)
+        reply: Tuple = tuple(self.connection.query(msg, args, **kwargs))
+        self.recorder.write(REPLY, msg, reply)
+        return reply
+
+    def cmd(self, msg: str, args: Sequence = ()) -> None:
+        '''Records and sends a command.
+
+        :param msg: The OSC address.
+        :type msg: str
+        :param args: The values of the command.
+        :type args: typing.Sequence
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.recorder.write(COMMAND, msg, args)
+        self.connection.cmd(msg, args)
+
+    def send_bundle(self, msg: str, args_list: Sequence[Tuple]) -> None:
+        '''Records every command of a bundle and sends the bundle.
+
+        :param msg: The OSC address of every command.
+        :type msg: str
+        :param args_list: The values of each command.
+        :type args_list: typing.Sequence[typing.Tuple]
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        for args in args_list:
+            self.recorder.write(COMMAND, msg, args)
+        if hasattr(self.connection, 'send_bundle'):
+            self.connection.send_bundle(msg, args_list)
+        else:
+            self.connection.osc_client.send(build_osc_bundle(msg, args_list))
+
+    def add_handler(self, address: str, handler: Callable) -> None:
+        '''Registers a callback that is passed every message received on an
+        address, after the message has been recorded.
+
+        :param address: The OSC address.
+        :type address: str
+        :param handler: Called with the values of each message.
+        :type handler: typing.Callable
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        def record_message(*data: Any) -> None:
+            self.recorder.write(MESSAGE, address, data)
+            handler(*data)
+
+        self.connection.add_handler(address, record_message)
+
+
+class EndOfSession(KeyboardInterrupt):
+    '''Raised when the monitor talks to a replayed session past its end.
+    It stops the monitor the same way ctrl-c does.'''
+
+
+class VirtualClock():
+    '''
+    A clock that only moves when it is asked to sleep, standing in for the
+    time module while a session is replayed.
+
+    **Class Properties**
+
+    * now: float - The current time in seconds since the session started.
+    * wall_clock_start: float - The wall clock time the session started.
+    '''
+    def __init__(self, now: float = 0.0, wall_clock_start: float = 0.0) -> None:
+        self.now: float = now
+        self.wall_clock_start: float = wall_clock_start
+
+    def monotonic(self) -> float:
+        '''The current time in seconds since the session started.'''
+        return self.now
+
+    def perf_counter(self) -> float:
+        '''The current time in seconds since the session started.'''
+        return self.now
+
+    def time(self) -> float:
+        '''The current wall clock time of the session.'''
+        return self.wall_clock_start + self.now
+
+    def sleep(self, seconds: float) -> None:
+        '''Moves the clock forward.
+
+        :param seconds: The number of seconds to move forward.
+        :type seconds: float
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.now += max(0.0, seconds)
+
+
+class ReplayConnection():
+    '''
+    Stands in for AbletonOSC while a session is replayed. The replies and
+    messages of the recording tell what Live reported about each track and
+    clip over time. A query is answered with the last value recorded for it
+    at the current time of the virtual clock, so the monitor sees the show
+    unfold as it did even if it sends different queries than the recorded
+    monitor did. Queries sent without waiting, as in a sweep, are answered
+    right away.
+
+    **Class Properties**
+
+    * clock: VirtualClock - The clock of the replay.
+    * round_trip: float - The number of seconds a query moves the clock forward.
+    * end: float - The time of the last recorded message.
+    * queries: int - The number of queries the monitor sent.
+    * commands: int - The number of commands the monitor sent.
+    * handlers: typing.Dict - The callbacks of each OSC address.
+    '''
+    def __init__(self, records: Sequence[SessionRecord], clock: VirtualClock, round_trip: float = 0.001) -> None:
+        '''
+        :param records: The recorded messages.
+        :type records: typing.Sequence[SessionRecord]
+        :param clock: The clock of the replay.
+        :type clock: VirtualClock
+        :param round_trip: The number of seconds a query moves the clock forward.
+        :type round_trip: float
+
+        :returns: An instance of the ReplayConnection object.
+        :rtype: `ReplayConnection`
+        '''
+        self.clock: VirtualClock = clock
+        self.round_trip: float = round_trip
+        self.end: float = records[-1].time if records else 0.0
+        self.queries: int = 0
+        self.commands: int = 0
+        self.handlers: Dict[str, List[Callable]] = {}
+        self.answers: Dict[Tuple[str, Tuple], Tuple[List[float], List[Tuple]]] = {}
+
+        for record in records:
+            if record.kind in (REPLY, MESSAGE):
+                key: Tuple[str, Tuple] = (record.address, record.values[:key_length(record.address)])
+                (times, values) = self.answers.setdefault(key, ([], []))
+                times.append(record.time)
+                values.append(record.values)
+
+    def answer(self, address: str, args: Sequence) -> Optional[Tuple]:
+        '''The last value recorded for a query at the current time, or the
+        first one if the query was only answered later in the session.
+
+        :param address: The OSC address.
+        :type address: str
+        :param args: The values of the query.
+        :type args: typing.Sequence
+
+        :returns: The values of the reply, None if the query was never answered.
+        :rtype: Optional[typing.Tuple]
+        '''
+        recorded = self.answers.get((address, tuple(args)[:key_length(address)]))
+        if recorded is None:
+            return None
+        (times, values) = recorded
+        index: int = bisect.bisect_right(times, self.clock.monotonic()) - 1
+        return values[max(0, index)]
+
+    def check_end(self) -> None:
+        '''Raises EndOfSession once the clock has passed the last recorded message.'''
+        if self.clock.monotonic() > self.end:
+            raise EndOfSession()
+
+    def query(self, msg: str, args: Sequence = (), **kwargs: Any) -> Tuple:
+        '''Answers a query from the recording.
+
+        :param msg: The OSC address.
+        :type msg: str
+        :param args: The values of the query.
+        :type args: typing.Sequence
+
+        :returns: The values of the reply.
+        :rtype: typing.Tuple
+        '''
+        self.check_end()
+        self.queries += 1
+        self.clock.sleep(self.round_trip)
+        reply: Optional[Tuple] = self.answer(msg, args)
+        if reply is None:
+            raise live.exceptions.LiveConnectionError(f"The recording has no reply to the query: {msg} {tuple(args)}")
+        return reply
+
+    def cmd(self, msg: str, args: Sequence = ()) -> None:
+        '''Counts a command. A query sent without waiting is answered by
+        passing the recorded reply to the handlers of its address.
+
+        :param msg: The OSC address.
+        :type msg: str
+        :param args: The values of the command.
+        :type args: typing.Sequence
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.check_end()
+        if not is_query_address(msg):
+            self.commands += 1
+            return
+
+        self.queries += 1
+        reply: Optional[Tuple] = self.answer(msg, args)
+        if reply is not None:
+            for handler in self.handlers.get(msg, []):
+                handler(*reply)
+
+    def send_bundle(self, msg: str, args_list: Sequence[Tuple]) -> None:
+        '''Counts the commands of a bundle.
+
+        :param msg: The OSC address of every command.
+        :type msg: str
+        :param args_list: The values of each command.
+        :type args_list: typing.Sequence[typing.Tuple]
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.check_end()
+        self.commands += len(args_list)
+
+    def add_handler(self, address: str, handler: Callable) -> None:
+        '''Registers a callback for the replies to the queries sent on an address.
+
+        :param address: The OSC address.
+        :type address: str
+        :param handler: Called with the values of each reply.
+        :type handler: typing.Callable
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.handlers.setdefault(address, []).append(handler)
+
+
+def count_traffic(records: Sequence[SessionRecord]) -> Tuple[int, int]:
+    '''Counts the queries and commands the recorded monitor sent.
+
+    :param records: The recorded messages.
+    :type records: typing.Sequence[SessionRecord]
+
+    :returns: The number of queries and the number of commands.
+    :rtype: typing.Tuple[int, int]
+    '''
+    queries: int = 0
+    commands: int = 0
+    for record in records:
+        if record.kind == QUERY or (record.kind == COMMAND and is_query_address(record.address)):
+            queries += 1
+        elif record.kind == COMMAND:
+            commands += 1
+    return (queries, commands)
+
+
+def measure_round_trip(records: Sequence[SessionRecord]) -> float:
+    '''The median time between a recorded query and its reply. A reply is
+    paired with the oldest query waiting for it, by address and the leading
+    values that identify the query, so each query of a pipelined sweep is
+    measured.
+
+    :param records: The recorded messages.
+    :type records: typing.Sequence[SessionRecord]
+
+    :returns: The round trip time in seconds, 1 ms if no query was recorded.
+    :rtype: float
+    '''
+    round_trips: List[float] = []
+    sent: Dict[Tuple[str, Tuple], List[float]] = {}
+    for record in records:
+        if record.kind not in (QUERY, REPLY):
+            continue
+        key: Tuple[str, Tuple] = (record.address, tuple(record.values)[:key_length(record.address)])
+        if record.kind == QUERY:
+            sent.setdefault(key, []).append(record.time)
+        elif sent.get(key):
+            round_trips.append(record.time - sent[key].pop(0))
+    return statistics.median(round_trips) if round_trips else 0.001
+
+
+class SessionReplay():
+    '''
+    Replays a recorded session through an AbletonClipMonitor on a virtual
+    clock. The clock only moves while the monitor waits between scans and
+    by the recorded round trip time of each query, so a long show replays
+    in a fraction of its length. Only the 'poll' mode can be replayed, as
+    the other modes wait on messages pushed by Live in real time.
+
+    **Class Properties**
+
+    * records: typing.List[SessionRecord] - The recorded messages.
+    * monitor_options: typing.Dict[str, Any] - The options of the replayed AbletonClipMonitor.
+    * monitor: Optional[AbletonClipMonitor] - The monitor of the last replay.
+    * connection: Optional[ReplayConnection] - The connection of the last replay.
+    * real_seconds: float - The time the last replay took.
+    '''
+    def __init__(self, path: str, **monitor_options: Any) -> None:
+        '''
+        :param path: The log written by SessionRecorder.
+        :type path: str
+        :param monitor_options: The options of the replayed AbletonClipMonitor, such as polling_delay.
+
+        :returns: An instance of the SessionReplay object.
+        :rtype: `SessionReplay`
+        '''
+        if monitor_options.get('mode', 'poll') != 'poll':
+            raise AbletonClipMonitorException('Only the poll mode can be replayed.')
+        if monitor_options.get('transport_listener'):
+            raise AbletonClipMonitorException('The transport listener cannot be replayed.')
+        self.records: List[SessionRecord] = list(read_session(path))
+        self.monitor_options: Dict[str, Any] = monitor_options
+        self.monitor: Optional[AbletonClipMonitor] = None
+        self.connection: Optional[ReplayConnection] = None
+        self.real_seconds: float = 0.0
+
+    def run(self) -> AbletonClipMonitor:
+        '''Runs the monitor over the whole session.
+
+        :returns: The monitor, with the metrics of the replay.
+        :rtype: AbletonClipMonitor
+        '''
+        clock = VirtualClock()
+        self.connection = ReplayConnection(self.records, clock, measure_round_trip(self.records))
+        started: float = time.perf_counter()
+        try:
+            self.monitor = AbletonClipMonitor(connection=self.connection, clock=clock.monotonic, sleep=clock.sleep,
+                                              **self.monitor_options)
+            with open(os.devnull, 'w') as devnull:
+                self.monitor.output = BackgroundWriter(devnull)
+                self.monitor.monitor()
+        finally:
+            self.real_seconds = time.perf_counter() - started
+        return self.monitor
+
+    def summary(self) -> str:
+        '''Compares the traffic of the replay with the recording and
+        describes the metrics of the replay.
+
+        :returns: The summary of the last replay.
+        :rtype: str
+        '''
+        if self.monitor is None or self.connection is None:
+            return 'Not replayed'
+
+        (recorded_queries, recorded_commands) = count_traffic(self.records)
+        virtual_seconds: float = self.connection.clock.monotonic()
+        return (f"Replayed {virtual_seconds:.1f} s in {self.real_seconds:.2f} s "
+                f"({virtual_seconds / max(self.real_seconds, 1e-9):.0f}x) | "
+                f"recorded {recorded_queries} queries {recorded_commands} commands | "
+                f"replayed {self.connection.queries} queries {self.connection.commands} commands\n"
+                f"{self.monitor.metrics.summary()}")
+
+
+def main() -> None:
+    '''Replays a recorded session from the command line and prints the summary.'''
+    parser = argparse.ArgumentParser(description='Replays a session recorded with --record.')
+    parser.add_argument('path', help='The recorded session.')
+    parser.add_argument('--dim-color', default=None, dest='dim_color', help='The color to dim to, such as 555555.')
+    parser.add_argument('--dim-ratio', default=2.0, type=float, dest='dim_ratio', help='Default 2. The ratio to dim by.')
+    parser.add_argument('--polling-delay', default=0.1, type=float, dest='polling_delay', help='Default 0.1 seconds. The delay between scans.')
+    parser.add_argument('--idle-sweep-share', default=1.0, type=float, dest='idle_sweep_share',
+                        help='Default 1. The share of the idle tracks scanned each cycle.')
+    parser.add_argument('--predict-clip-end', action='store_true', dest='predict_clip_end', help='Predicts the clip ends.')
+    args = parser.parse_args()
+
+    replay = SessionReplay(args.path, dim_color=args.dim_color, dim_ratio=args.dim_ratio, polling_delay=args.polling_delay,
+                           idle_sweep_share=args.idle_sweep_share, predict_clip_end=args.predict_clip_end)
+    replay.run()
+    print(replay.summary())
+
+
+if __name__ == '__main__':
+    main()
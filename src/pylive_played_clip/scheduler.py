@@ -0,0 +1,501 @@
+'''
+Scheduling for the monitor loop.
+'''
+import heapq
+import math
+import threading
+import time
+
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+OVERRUN_POLICIES: Tuple[str, ...] = ('skip', 'catch-up')
+
+# Live's clip_trigger_quantization values as a number of beats, or bars when
+# the second value is True. 0 is no quantization.
+TRIGGER_QUANTIZATION: Dict[int, Tuple[float, bool]] = {
+    1: (8, True),
+    2: (4, True),
+    3: (2, True),
+    4: (1, True),
+    5: (2.0, False),
+    6: (4.0/3.0, False),
+    7: (1.0, False),
+    8: (2.0/3.0, False),
+    9: (0.5, False),
+    10: (1.0/3.0, False),
+    11: (0.25, False),
+    12: (1.0/6.0, False),
+    13: (0.125, False),
+}
+
+
+def quantization_to_beats(quantization: int, signature_numerator: int = 4) -> Optional[float]:
+    '''Converts Live's clip_trigger_quantization value to a number of beats.
+
+    :param quantization: The value of /live/song/get/clip_trigger_quantization.
+    :type quantization: int
+    :param signature_numerator: The number of beats in a bar.
+    :type signature_numerator: int
+
+    :returns: The number of beats between launch boundaries, or None without quantization.
+    :rtype: Optional[float]
+    '''
+    if quantization not in TRIGGER_QUANTIZATION:
+        return None
+
+    (amount, in_bars) = TRIGGER_QUANTIZATION[quantization]
+    return amount * signature_numerator if in_bars else amount
+
+
+class FixedRateScheduler():
+    '''
+    Paces a loop at a fixed period on the monotonic clock. The time spent
+    doing work is subtracted from the wait, so the loop keeps its period and
+    does not drift as the work gets slower.
+
+    When the work takes longer than a period, the late tick runs at once.
+    The 'skip' policy then drops any other ticks that were missed and
+    returns to the original schedule, while 'catch-up' runs the missed ticks
+    back to back, up to max_catch_up of them.
+
+    **Class Properties**
+
+    * period: float - The target number of seconds between ticks.
+    * overrun: str - The overrun policy, 'skip' or 'catch-up'.
+    * ticks: int - The number of ticks so far.
+    * overruns: int - The number of ticks that started late because the work overran.
+    * skipped: int - The number of ticks dropped by the 'skip' policy.
+    * jitter_last: float - How late, in seconds, the last tick woke up.
+    * jitter_max: float - The latest any tick woke up.
+    * jitter_mean: float - The average of how late the ticks woke up.
+    '''
+    def __init__(
+            self,
+            period: float,
+            overrun: str = 'skip',
+            max_catch_up: int = 10,
+            clock: Callable[[], float] = time.monotonic,
+            sleep: Callable[[float], None] = time.sleep) -> None:
+        '''
+        :param period: The target number of seconds between ticks.
+        :type period: float
+        :param overrun: 'skip' or 'catch-up'.
+        :type overrun: str
+        :param max_catch_up: With 'catch-up', the most ticks run back to back before the schedule is reset.
+        :type max_catch_up: int
+        :param clock: The clock, in seconds. Defaults to time.monotonic.
+        :type clock: typing.Callable[[], float]
+        :param sleep: The function used to wait. Defaults to time.sleep.
+        :type sleep: typing.Callable[[float], None]
+
+        :returns: An instance of the FixedRateScheduler object.
+        :rtype: `FixedRateScheduler`
+        '''
+        if overrun not in OVERRUN_POLICIES:
+            raise ValueError(f"The overrun policy must be one of {', '.join(OVERRUN_POLICIES)}. We received \"{overrun}\".")
+
+        self.period: float = period
+        self.overrun: str = overrun
+        self.max_catch_up: int = max_catch_up
+        self.clock: Callable[[], float] = clock
+        self.sleep: Callable[[float], None] = sleep
+        self.next_tick: Optional[float] = None
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        '''Clears the tick, overrun and jitter measurements.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.ticks: int = 0
+        self.overruns: int = 0
+        self.skipped: int = 0
+        self.jitter_last: float = 0.0
+        self.jitter_max: float = 0.0
+        self.jitter_total: float = 0.0
+
+    @property
+    def jitter_mean(self) -> float:
+        '''The average of how late the ticks woke up, in seconds.'''
+        return self.jitter_total / self.ticks if self.ticks else 0.0
+
+    def start(self) -> None:
+        '''Starts the schedule now. The first tick is one period away.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.next_tick = self.clock()
+
+    def next_delay(self) -> float:
+        '''Moves the schedule to the next tick and returns how long to wait
+        for it. Call mark_woken once the wait is over. If start was not
+        called, the schedule starts now.
+
+        :returns: The number of seconds until the next tick, 0 if it is already due.
+        :rtype: float
+        '''
+        now: float = self.clock()
+        if self.next_tick is None:
+            self.next_tick = now
+        self.next_tick += self.period
+
+        if now > self.next_tick:
+            self.overruns += 1
+            behind: int = int((now - self.next_tick) / self.period) if self.period > 0 else 0
+            if self.overrun == 'skip' or behind >= self.max_catch_up:
+                # Run the late tick now and line the schedule back up.
+                self.skipped += behind
+                self.next_tick += behind * self.period
+
+        return max(0.0, self.next_tick - now)
+
+    def mark_woken(self) -> None:
+        '''Records how late the current tick woke up.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        if self.next_tick is None:
+            return
+
+        lateness: float = max(0.0, self.clock() - self.next_tick)
+        self.ticks += 1
+        self.jitter_last = lateness
+        self.jitter_max = max(self.jitter_max, lateness)
+        self.jitter_total += lateness
+
+    def wait(self) -> None:
+        '''Sleeps until the next tick.
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        delay: float = self.next_delay()
+        if delay > 0:
+            self.sleep(delay)
+        self.mark_woken()
+
+    def summary(self) -> str:
+        '''Describes the measured jitter in a form that is easy to put into logs.
+
+        :returns: The summary of the ticks, overruns and jitter.
+        :rtype: str
+        '''
+        return (f"period {self.period * 1000:.1f} ms, {self.ticks} ticks, {self.overruns} overruns, "
+                f"{self.skipped} skipped, jitter mean {self.jitter_mean * 1000:.2f} ms, "
+                f"max {self.jitter_max * 1000:.2f} ms")
+
+
+class AdaptivePollingDelay():
+    '''
+    Adjusts the polling delay to how fast Live answers, with additive
+    increase and multiplicative decrease (AIMD) of the polling rate. Each
+    sweep answered within latency_target seconds adds increase scans per
+    second to the rate, up to 1/min_delay. A slower sweep or a query that
+    timed out divides the rate by backoff, down to 1/max_delay. A busy Live
+    host is polled less, and an idle one is polled as fast as allowed.
+
+    **Class Properties**
+
+    * min_delay: float - The shortest delay between scans, in seconds.
+    * max_delay: float - The longest delay between scans, in seconds.
+    * latency_target: float - A sweep slower than this many seconds backs off the rate.
+    * increase: float - The scans per second added after each sweep within latency_target.
+    * backoff: float - The rate is divided by this after a slow sweep or a timeout.
+    * rate: float - The current number of scans per second.
+    '''
+    def __init__(
+            self,
+            min_delay: float,
+            max_delay: float,
+            latency_target: float = 0.05,
+            initial_delay: Optional[float] = None,
+            increase: float = 1.0,
+            backoff: float = 2.0) -> None:
+        '''
+        :param min_delay: The shortest delay between scans, in seconds.
+        :type min_delay: float
+        :param max_delay: The longest delay between scans, in seconds.
+        :type max_delay: float
+        :param latency_target: A sweep slower than this many seconds backs off the rate.
+        :type latency_target: float
+        :param initial_delay: The delay to start from. Defaults to max_delay.
+        :type initial_delay: Optional[float]
+        :param increase: The scans per second added after each sweep within latency_target.
+        :type increase: float
+        :param backoff: The rate is divided by this after a slow sweep or a timeout. Must be more than 1.
+        :type backoff: float
+
+        :returns: An instance of the AdaptivePollingDelay object.
+        :rtype: `AdaptivePollingDelay`
+        '''
+        if not 0 < min_delay <= max_delay:
+            raise ValueError(f"The polling delays must be greater than 0 with the minimum at most the maximum. We received {min_delay} and {max_delay}.")
+        if backoff <= 1.0:
+            raise ValueError(f"The backoff must be greater than 1. We received {backoff}.")
+
+        self.min_delay: float = min_delay
+        self.max_delay: float = max_delay
+        self.latency_target: float = latency_target
+        self.increase: float = increase
+        self.backoff: float = backoff
+        self.rate: float = 1.0 / min(max_delay, max(min_delay, max_delay if initial_delay is None else initial_delay))
+
+    @property
+    def delay(self) -> float:
+        '''The current number of seconds between scans.'''
+        return 1.0 / self.rate
+
+    def update(self, sweep_seconds: float, timed_out: bool = False) -> bool:
+        '''Adjusts the rate after a sweep.
+
+        :param sweep_seconds: The time the sweep took to be answered.
+        :type sweep_seconds: float
+        :param timed_out: If any query of the sweep was not answered in time.
+        :type timed_out: bool
+
+        :returns: A boolean indicating if the rate was backed off.
+        :rtype: bool
+        '''
+        (slowest, fastest) = (1.0 / self.max_delay, 1.0 / self.min_delay)
+        if timed_out or sweep_seconds > self.latency_target:
+            self.rate = max(slowest, self.rate / self.backoff)
+            return True
+
+        self.rate = min(fastest, self.rate + self.increase)
+        return False
+
+
+class ClipEndPredictor():
+    '''
+    Keeps a heap of the times the playing clips are predicted to end, so
+    the monitor can poll a track densely only around the end of its clip.
+
+    **Class Properties**
+
+    * window: float - How many seconds before its predicted end a track becomes due.
+    * heap: typing.List - The (end time, track index, clip index) predictions, soonest first.
+    * predictions: typing.Dict - The current (end time, clip index) prediction of each track.
+    * due: typing.Set[int] - The tracks whose clip is within window of its predicted end, or past it.
+    '''
+    def __init__(self, window: float = 0.25, clock: Callable[[], float] = time.monotonic) -> None:
+        '''
+        :param window: How many seconds before its predicted end a track becomes due.
+        :type window: float
+        :param clock: The clock, in seconds. Defaults to time.monotonic.
+        :type clock: typing.Callable[[], float]
+
+        :returns: An instance of the ClipEndPredictor object.
+        :rtype: `ClipEndPredictor`
+        '''
+        self.window: float = window
+        self.clock: Callable[[], float] = clock
+        self.heap: List[Tuple[float, int, int]] = []
+        self.predictions: Dict[int, Tuple[float, int]] = {}
+        self.due: Set[int] = set()
+
+    @staticmethod
+    def seconds_until_end(length: float, position: float, tempo: float) -> float:
+        '''Converts the beats left in a clip to seconds.
+
+        :param length: The length of the clip in beats.
+        :type length: float
+        :param position: The playing position in the clip in beats.
+        :type position: float
+        :param tempo: The song tempo in beats per minute.
+        :type tempo: float
+
+        :returns: The number of seconds until the clip ends.
+        :rtype: float
+        '''
+        return max(0.0, length - position) * 60.0 / tempo
+
+    def predict(self, track_index: int, clip_index: int, seconds_left: float) -> None:
+        '''Records when the clip playing on a track will end.
+
+        :param track_index: The index of the live set track.
+        :type track_index: int
+        :param clip_index: The index of the playing clip.
+        :type clip_index: int
+        :param seconds_left: The number of seconds until the clip ends.
+        :type seconds_left: float
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        end_time: float = self.clock() + seconds_left
+        self.predictions[track_index] = (end_time, clip_index)
+        self.due.discard(track_index)
+        heapq.heappush(self.heap, (end_time, track_index, clip_index))
+
+    def forget(self, track_index: int) -> None:
+        '''Drops the prediction of a track once its clip has ended. Its
+        entry in the heap is skipped when it comes up.
+
+        :param track_index: The index of the live set track.
+        :type track_index: int
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.predictions.pop(track_index, None)
+        self.due.discard(track_index)
+
+    def remap(self, track_map: Dict[int, int]) -> None:
+        '''Moves the predictions to new track indexes after tracks were added,
+        removed or moved. Predictions for tracks missing from track_map are
+        dropped.
+
+        :param track_map: The new index of each old track index that still exists.
+        :type track_map: typing.Dict[int, int]
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.predictions = {track_map[track_index]: prediction
+                            for (track_index, prediction) in self.predictions.items() if track_index in track_map}
+        self.due = {track_map[track_index] for track_index in self.due if track_index in track_map}
+        self.heap = [(end_time, track_index, clip_index) for (track_index, (end_time, clip_index)) in self.predictions.items()]
+        heapq.heapify(self.heap)
+
+    def has_prediction(self, track_index: int) -> bool:
+        '''Tests if the clip playing on a track has a predicted end.
+
+        :param track_index: The index of the live set track.
+        :type track_index: int
+
+        :returns: A boolean indicating if there is a prediction.
+        :rtype: bool
+        '''
+        return track_index in self.predictions
+
+    def due_tracks(self) -> Set[int]:
+        '''Moves the predictions that are within window of their end from the
+        heap to the due set.
+
+        :returns: The tracks whose clip is about to end or should have ended.
+        :rtype: typing.Set[int]
+        '''
+        horizon: float = self.clock() + self.window
+        while self.heap and self.heap[0][0] <= horizon:
+            (end_time, track_index, clip_index) = heapq.heappop(self.heap)
+            if self.predictions.get(track_index) == (end_time, clip_index):
+                self.due.add(track_index)
+
+        return self.due
+
+
+class BeatBoundaryScheduler():
+    '''
+    Follows the beat messages Live sends and works out when the next launch
+    quantization boundaries fall, so a scan can run just after each one.
+    Boundaries shorter than a beat are spread over the beat using the time
+    between the last two beat messages.
+
+    on_beat is called from the OSC server thread; the other methods from the
+    monitor loop.
+
+    **Class Properties**
+
+    * quantum: Optional[float] - The number of beats between boundaries, None to follow no boundaries.
+    * offset: float - How many seconds after a boundary the scan runs.
+    * beat_period: float - The measured number of seconds per beat.
+    * boundaries: typing.List[float] - The upcoming scan times, soonest first.
+    * beat_received: threading.Event - Set whenever a beat message arrives.
+    '''
+    def __init__(
+            self,
+            quantum: Optional[float] = None,
+            offset: float = 0.02,
+            beat_period: float = 0.5,
+            clock: Callable[[], float] = time.monotonic) -> None:
+        '''
+        :param quantum: The number of beats between boundaries, None to follow no boundaries.
+        :type quantum: Optional[float]
+        :param offset: How many seconds after a boundary the scan runs.
+        :type offset: float
+        :param beat_period: The number of seconds per beat until two beats have been measured.
+        :type beat_period: float
+        :param clock: The clock, in seconds. Defaults to time.monotonic.
+        :type clock: typing.Callable[[], float]
+
+        :returns: An instance of the BeatBoundaryScheduler object.
+        :rtype: `BeatBoundaryScheduler`
+        '''
+        self.quantum: Optional[float] = quantum
+        self.offset: float = offset
+        self.beat_period: float = beat_period
+        self.clock: Callable[[], float] = clock
+        self.boundaries: List[float] = []
+        self.beat_received: threading.Event = threading.Event()
+        self.last_beat: Optional[Tuple[float, float]] = None
+        self.lock: threading.Lock = threading.Lock()
+
+    def on_beat(self, beat: float, *args) -> None:
+        '''Handler for the /live/song/get/beat messages. Schedules a scan
+        after every boundary that falls within the beat that just started.
+
+        :param beat: The beat number.
+        :type beat: float
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        now: float = self.clock()
+        with self.lock:
+            if self.last_beat is not None and beat - self.last_beat[0] == 1:
+                self.beat_period = now - self.last_beat[1]
+            self.last_beat = (beat, now)
+
+            if self.quantum:
+                boundary: float = math.ceil(beat / self.quantum - 1e-9) * self.quantum
+                while boundary < beat + 1:
+                    heapq.heappush(self.boundaries, now + (boundary - beat) * self.beat_period + self.offset)
+                    boundary += self.quantum
+
+        self.beat_received.set()
+
+    def next_boundary(self) -> Optional[float]:
+        '''Looks up the time of the next scheduled scan.
+
+        :returns: The time of the next scan, or None if none is scheduled.
+        :rtype: Optional[float]
+        '''
+        with self.lock:
+            return self.boundaries[0] if self.boundaries else None
+
+    def pop_due(self) -> bool:
+        '''Removes the scans whose time has come.
+
+        :returns: A boolean indicating if a scan is due.
+        :rtype: bool
+        '''
+        now: float = self.clock()
+        due: bool = False
+        with self.lock:
+            while self.boundaries and self.boundaries[0] <= now:
+                heapq.heappop(self.boundaries)
+                due = True
+        return due
+
+    def wait(self, deadline: float) -> None:
+        '''Waits until the next boundary scan is due or the deadline passes,
+        whichever comes first.
+
+        :param deadline: The clock time to wait until if no boundary comes first.
+        :type deadline: float
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        while not self.pop_due():
+            now: float = self.clock()
+            next_boundary: Optional[float] = self.next_boundary()
+            target: float = deadline if next_boundary is None else min(deadline, next_boundary)
+            if now >= target:
+                return
+            # A beat message may schedule a boundary sooner than the target.
+            self.beat_received.wait(target - now)
+            self.beat_received.clear()
@@ -0,0 +1,231 @@
+'''
+The queue the clip color commands wait in before they are sent. AbletonOSC
+applies every command on Live's main thread, so a burst of them, such as a
+restore of a whole set or a scene change that dims many tracks at once, can
+make Live's interface stutter. A token bucket caps the rate at which the
+commands leave the queue, and dims are sent before restores.
+'''
+import time
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+# The priorities of the commands, most urgent first.
+DIM: int = 0
+RESTORE: int = 1
+
+
+class TokenBucket():
+    '''
+    Allows up to rate commands per second on average, and bursts of up to
+    burst commands after a pause.
+
+    **Class Properties**
+
+    * rate: float - The number of tokens added per second. 0 is unlimited.
+    * burst: int - The most tokens the bucket holds.
+    * tokens: float - The tokens available.
+    * updated: float - The clock value when the tokens were last added.
+    '''
+    def __init__(self, rate: float = 0.0, burst: int = 16, clock: Callable[[], float] = time.monotonic) -> None:
+        '''
+        :param rate: The number of tokens added per second. 0 is unlimited.
+        :type rate: float
+        :param burst: The most tokens the bucket holds. It starts full.
+        :type burst: int
+        :param clock: The clock, in seconds. Defaults to time.monotonic.
+        :type clock: typing.Callable[[], float]
+
+        :returns: An instance of the TokenBucket object.
+        :rtype: `TokenBucket`
+        '''
+        self.rate: float = max(0.0, rate)
+        self.burst: int = max(1, burst)
+        self.clock: Callable[[], float] = clock
+        self.tokens: float = float(self.burst)
+        self.updated: float = clock()
+
+    @property
+    def limited(self) -> bool:
+        '''If the rate is limited.'''
+        return self.rate > 0.0
+
+    def available(self) -> int:
+        '''Adds the tokens earned since the last call.
+
+        :returns: The number of whole tokens available.
+        :rtype: int
+        '''
+        now: float = self.clock()
+        self.tokens = min(float(self.burst), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return int(self.tokens)
+
+    def take(self, count: int) -> None:
+        '''Spends tokens. The count must not be more than available() returned.
+
+        :param count: The number of tokens.
+        :type count: int
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.tokens -= count
+
+
+class WriteQueue():
+    '''
+    Holds the clip color commands by priority. There is at most one command
+    per clip: queuing another color for a clip replaces the one waiting, so
+    only the last color is sent. A command can be held for a delay, which
+    lets a dim wait out the coalesce window of the monitor.
+
+    **Class Properties**
+
+    * bucket: TokenBucket - Limits the rate of the commands taken from the queue.
+    * lanes: typing.Tuple[typing.Dict, ...] - The commands of each priority,
+      (track index, clip index) to (color, ready time), in the order they
+      were queued.
+    '''
+    def __init__(self, rate: float = 0.0, burst: int = 16, clock: Callable[[], float] = time.monotonic) -> None:
+        '''
+        :param rate: The most commands taken per second. 0 is unlimited.
+        :type rate: float
+        :param burst: The most commands taken at once after a pause.
+        :type burst: int
+        :param clock: The clock, in seconds. Defaults to time.monotonic.
+        :type clock: typing.Callable[[], float]
+
+        :returns: An instance of the WriteQueue object.
+        :rtype: `WriteQueue`
+        '''
+        self.clock: Callable[[], float] = clock
+        self.bucket: TokenBucket = TokenBucket(rate, burst, clock)
+        self.lanes: Tuple[Dict[Tuple[int, int], Tuple[int, float]], ...] = ({}, {})
+
+    def __len__(self) -> int:
+        return sum(len(lane) for lane in self.lanes)
+
+    @property
+    def limited(self) -> bool:
+        '''If the rate of the commands is limited.'''
+        return self.bucket.limited
+
+    def get(self, track_index: int, clip_index: int) -> Optional[int]:
+        '''Looks up the color waiting to be sent to a clip.
+
+        :param track_index: The index of the live set track.
+        :type track_index: int
+        :param clip_index: The index of the clip in the live set track.
+        :type clip_index: int
+
+        :returns: The color, or None if no command is waiting for the clip.
+        :rtype: Optional[int]
+        '''
+        for lane in self.lanes:
+            queued: Optional[Tuple[int, float]] = lane.get((track_index, clip_index))
+            if queued is not None:
+                return queued[0]
+        return None
+
+    def put(self, priority: int, track_index: int, clip_index: int, color: int, delay: float = 0.0) -> None:
+        '''Queues a color command, replacing any command waiting for the clip.
+
+        :param priority: DIM or RESTORE.
+        :type priority: int
+        :param track_index: The index of the live set track.
+        :type track_index: int
+        :param clip_index: The index of the clip in the live set track.
+        :type clip_index: int
+        :param color: The clip color as an integer.
+        :type color: int
+        :param delay: The number of seconds before the command may be sent.
+        :type delay: float
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.cancel(track_index, clip_index)
+        self.lanes[priority][(track_index, clip_index)] = (color, self.clock() + delay)
+
+    def cancel(self, track_index: int, clip_index: int) -> bool:
+        '''Drops the command waiting for a clip.
+
+        :param track_index: The index of the live set track.
+        :type track_index: int
+        :param clip_index: The index of the clip in the live set track.
+        :type clip_index: int
+
+        :returns: A boolean indicating if a command was waiting.
+        :rtype: bool
+        '''
+        return any([lane.pop((track_index, clip_index), None) is not None for lane in self.lanes])
+
+    def colors(self, priority: int) -> Dict[Tuple[int, int], int]:
+        '''Returns the colors waiting in one lane.
+
+        :param priority: DIM or RESTORE.
+        :type priority: int
+
+        :returns: The colors keyed by (track index, clip index).
+        :rtype: typing.Dict[typing.Tuple[int, int], int]
+        '''
+        return {key: color for (key, (color, _)) in self.lanes[priority].items()}
+
+    def take(self, limit: int, force: bool = False) -> List[Tuple[int, int, int]]:
+        '''Removes the ready commands the token bucket allows, dims first.
+
+        :param limit: The most commands to take.
+        :type limit: int
+        :param force: If set to true, every command is ready and the token bucket is ignored.
+        :type force: bool
+
+        :returns: The (track index, clip index, color) commands.
+        :rtype: typing.List[typing.Tuple[int, int, int]]
+        '''
+        if not len(self):
+            return []
+        if self.limited and not force:
+            limit = min(limit, self.bucket.available())
+
+        now: float = self.clock()
+        commands: List[Tuple[int, int, int]] = []
+        for lane in self.lanes:
+            taken: List[Tuple[int, int, int]] = []
+            for ((track_index, clip_index), (color, ready)) in lane.items():
+                if len(commands) + len(taken) >= limit:
+                    break
+                if force or ready <= now:
+                    taken.append((track_index, clip_index, color))
+            for (track_index, clip_index, _) in taken:
+                del lane[(track_index, clip_index)]
+            commands.extend(taken)
+
+        if self.limited and not force:
+            self.bucket.take(len(commands))
+        return commands
+
+    def drain_time(self) -> float:
+        '''Estimates how long the commands waiting will take to send at the
+        rate of the token bucket.
+
+        :returns: The number of seconds, 0 when the rate is not limited.
+        :rtype: float
+        '''
+        if not self.limited:
+            return 0.0
+        return max(0.0, len(self) - self.bucket.tokens) / self.bucket.rate
+
+    def remap(self, track_map: Dict[int, int]) -> None:
+        '''Moves the commands to new track indexes after tracks were added,
+        removed or moved. Commands for tracks missing from track_map are
+        dropped.
+
+        :param track_map: The new index of each old track index that still exists.
+        :type track_map: typing.Dict[int, int]
+
+        :returns: Nothing
+        :rtype: None
+        '''
+        self.lanes = tuple({(track_map[track_index], clip_index): queued
+                            for ((track_index, clip_index), queued) in lane.items() if track_index in track_map}
+                           for lane in self.lanes)
@@ -1,9 +1,14 @@
 #!/usr/bin/python3
+import time
+
+from typing import List
+
 import pytest
 
 import enable_imports_from_src_folder  # noqa: F401
 
-from pylive_played_clip import AbletonClipMonitor, AbletonClipMonitorException
+from pylive_played_clip import AbletonClipMonitor, AbletonClipMonitorException, PendingQueries, PlayingClip, map_track_indexes
+from pylive_played_clip.write_queue import RESTORE
 
 
 def test_ableton_clip_monitor_constructor_upper() -> None:
@@ -61,3 +66,260 @@ def test_ableton_clip_monitor_constructor_with_color_bad_characters_error() -> N
     dim_color: str = 'FFFFFJ'
     with pytest.raises(AbletonClipMonitorException):
         _: AbletonClipMonitor = AbletonClipMonitor(dim_color=dim_color)
+
+
+def test_ableton_clip_monitor_constructor_events_mode() -> None:
+    ableton_monitor: AbletonClipMonitor = AbletonClipMonitor(mode='events', listener_timeout=5.0)
+
+    assert ableton_monitor.mode == 'events'
+    assert ableton_monitor.listener_timeout == 5.0
+    assert not ableton_monitor.listening
+
+
+def test_ableton_clip_monitor_constructor_with_mode_error() -> None:
+    with pytest.raises(AbletonClipMonitorException):
+        _: AbletonClipMonitor = AbletonClipMonitor(mode='push')
+
+
+def test_pending_queries_match_replies_by_track() -> None:
+    pending: PendingQueries = PendingQueries('/live/track/get/playing_slot_index', [(0,), (1,), (2,)])
+
+    pending.add_reply((2, -1))
+    pending.add_reply((0, 3))
+    pending.add_reply((7, 1))
+
+    assert not pending.complete.is_set()
+    assert pending.missing() == [(1,)]
+
+    pending.add_reply((1, 0))
+
+    assert pending.complete.is_set()
+    assert pending.replies == {(0,): (0, 3), (1,): (1, 0), (2,): (2, -1)}
+
+
+def test_pending_queries_match_replies_by_clip() -> None:
+    pending: PendingQueries = PendingQueries('/live/clip/get/color', [(0, 1), (0, 2)])
+
+    pending.add_reply((0, 2, 255))
+    pending.add_reply((0, 1, 65280))
+
+    assert pending.complete.is_set()
+    assert pending.replies[(0, 1)] == (0, 1, 65280)
+
+
+def test_ableton_clip_monitor_clip_color_grid() -> None:
+    ableton_monitor: AbletonClipMonitor = AbletonClipMonitor()
+    ableton_monitor.store_clip_color_grid_row(1, [0xFF0000, None, 0x00FF00])
+
+    assert ableton_monitor.get_known_clip_color(1, 0) == 0xFF0000
+    assert ableton_monitor.get_known_clip_color(1, 1) is None
+    assert ableton_monitor.get_known_clip_color(1, 5) is None
+    assert ableton_monitor.get_known_clip_color(0, 0) is None
+
+    ableton_monitor.set_known_clip_color(1, 4, 0x0000FF)
+
+    assert ableton_monitor.clip_color_grid[1] == [0xFF0000, None, 0x00FF00, None, 0x0000FF]
+    assert not ableton_monitor.needs_clip_color(1, 4)
+    assert ableton_monitor.needs_clip_color(1, 1)
+
+
+def test_ableton_clip_monitor_reload_keeps_the_colors_it_sent() -> None:
+    ableton_monitor: AbletonClipMonitor = AbletonClipMonitor()
+    ableton_monitor.store_clip_color_grid_row(0, [0xFF0000, 0x00FF00])
+    ableton_monitor.original_cell_color[(0, 0)] = 0xFF0000
+    ableton_monitor.set_known_clip_color(0, 0, 0x111111)
+
+    # The reply was sent by Live before the dim reached it.
+    ableton_monitor.store_clip_color_grid_row(0, [0xFF0000, 0x0000FF])
+    assert ableton_monitor.clip_color_grid[0] == [0x111111, 0x0000FF]
+
+
+def test_ableton_clip_monitor_tiered_scan() -> None:
+    ableton_monitor: AbletonClipMonitor = AbletonClipMonitor(idle_sweep_share=0.25)
+    ableton_monitor.num_tracks = 10
+    ableton_monitor.dim_clip_on_track = {3: PlayingClip(0, 0), 7: None}
+
+    assert ableton_monitor.get_tracks_to_scan() == [0, 1, 2, 3]
+    assert ableton_monitor.get_tracks_to_scan() == [3, 4, 5, 6]
+    assert ableton_monitor.get_tracks_to_scan() == [3, 7, 8, 9]
+    assert ableton_monitor.get_tracks_to_scan() == [0, 1, 2, 3]
+
+
+def test_ableton_clip_monitor_constructor_with_idle_sweep_share_error() -> None:
+    with pytest.raises(AbletonClipMonitorException):
+        _: AbletonClipMonitor = AbletonClipMonitor(idle_sweep_share=0.0)
+
+
+def test_ableton_clip_monitor_predicted_scan() -> None:
+    ableton_monitor: AbletonClipMonitor = AbletonClipMonitor(predict_clip_end=True, prediction_fallback_interval=60.0)
+    ableton_monitor.num_tracks = 4
+    ableton_monitor.dim_clip_on_track = {1: PlayingClip(0, 0), 2: PlayingClip(5, 0)}
+    ableton_monitor.last_scanned = {1: time.monotonic(), 2: time.monotonic()}
+    ableton_monitor.record_clip_end_prediction(1, 0, 16.0, 15.9, False, 120.0)
+    ableton_monitor.record_clip_end_prediction(2, 5, 16.0, 0.0, False, 120.0)
+
+    assert ableton_monitor.get_tracks_to_scan() == [0, 1, 3]
+
+
+def test_ableton_clip_monitor_constructor_with_prediction_in_events_mode_error() -> None:
+    with pytest.raises(AbletonClipMonitorException):
+        _: AbletonClipMonitor = AbletonClipMonitor(mode='events', predict_clip_end=True)
+
+
+class _QuantizationConnection():
+    def __init__(self) -> None:
+        self.handlers: dict = {}
+        self.commands: list = []
+
+    def query(self, address: str, args: tuple = ()) -> tuple:
+        return {'/live/song/get/clip_trigger_quantization': (4,),
+                '/live/song/get/signature_numerator': (3,)}[address]
+
+    def cmd(self, address: str, args: tuple = ()) -> None:
+        self.commands.append(address)
+
+    def add_handler(self, address: str, handler) -> None:
+        self.handlers[address] = handler
+
+
+def test_ableton_clip_monitor_quantized_mode() -> None:
+    connection = _QuantizationConnection()
+    ableton_monitor: AbletonClipMonitor = AbletonClipMonitor(mode='quantized', connection=connection, sparse_polling_delay=2.0)
+    ableton_monitor.load_quantization()
+    ableton_monitor.start_beat_listener()
+
+    assert ableton_monitor.beat_scheduler.quantum == 3
+    assert connection.commands == ['/live/song/start_listen/beat']
+    connection.handlers['/live/song/get/beat'](3)
+    assert ableton_monitor.beat_scheduler.next_boundary() is not None
+
+
+def test_map_track_indexes() -> None:
+    old_names: List[str] = ['1-Audio', 'Kick', 'Bass', 'Keys']
+
+    assert map_track_indexes(old_names, ['New', '2-Audio', 'Kick', 'Bass', 'Keys']) == {0: 1, 1: 2, 2: 3, 3: 4}
+    assert map_track_indexes(old_names, ['1-Audio', 'Bass', 'Keys']) == {0: 0, 2: 1, 3: 2}
+    assert map_track_indexes(old_names, ['1-Audio', 'Kick', 'Sub', 'Keys']) == {0: 0, 1: 1, 2: 2, 3: 3}
+
+
+def test_ableton_clip_monitor_update_track_layout() -> None:
+    ableton_monitor: AbletonClipMonitor = AbletonClipMonitor()
+    ableton_monitor.track_names = ['Kick', 'Bass', 'Keys']
+    ableton_monitor.num_tracks = 3
+    ableton_monitor.original_cell_color = {(0, 1): 10, (1, 2): 20, (2, 0): 30}
+    ableton_monitor.dim_clip_on_track = {1: PlayingClip(2, 20), 2: None}
+    ableton_monitor.clip_color_grid = {0: [None, 10], 1: [None, None, 20], 2: [30]}
+
+    assert ableton_monitor.update_track_layout(['Kick', 'Keys']) == []
+    assert ableton_monitor.update_track_layout(['Vox', 'Kick', 'Keys']) == [0]
+    assert ableton_monitor.update_track_layout(['Vox', 'Kick', 'Keys']) is None
+
+    assert ableton_monitor.num_tracks == 3
+    assert ableton_monitor.original_cell_color == {(1, 1): 10, (2, 0): 30}
+    assert ableton_monitor.dim_clip_on_track == {2: None}
+    assert ableton_monitor.clip_color_grid == {1: [None, 10], 2: [30]}
+
+
+def test_ableton_clip_monitor_capture_playing_clip() -> None:
+    ableton_monitor: AbletonClipMonitor = AbletonClipMonitor()
+    ableton_monitor.capture_playing_clip_info(3, 1, 0xFF0000)
+    ableton_monitor.dim_clip_on_track[3] = None
+    ableton_monitor.capture_playing_clip_info(3, 1, 0x7F0000)
+
+    assert ableton_monitor.dim_clip_on_track == {3: PlayingClip(1, 0x7F0000)}
+    assert ableton_monitor.original_cell_color == {(3, 1): 0xFF0000}
+    assert not hasattr(ableton_monitor.dim_clip_on_track[3], '__dict__')
+
+
+class _CommandConnection():
+    def __init__(self) -> None:
+        self.commands: list = []
+
+    def query(self, address: str, args: tuple = ()) -> tuple:
+        return tuple(args) + (0,)
+
+    def cmd(self, address: str, args: tuple = ()) -> None:
+        self.commands.append((address,) + tuple(args))
+
+    def send_bundle(self, address: str, args_list: list) -> None:
+        self.commands.extend((address,) + tuple(args) for args in args_list)
+
+
+def test_ableton_clip_monitor_skips_redundant_color_writes() -> None:
+    connection = _CommandConnection()
+    ableton_monitor: AbletonClipMonitor = AbletonClipMonitor(dim_color='111111', connection=connection)
+    ableton_monitor.clip_color_grid = {0: [0xFF0000, 0x111111], 1: [0x00FF00]}
+    for (track_index, clip_index) in ((0, 0), (0, 1), (1, 0)):
+        ableton_monitor.capture_playing_clip_info(track_index, clip_index)
+        if track_index == 0:
+            ableton_monitor.dim_color_of_played_clip(track_index)
+
+    assert connection.commands == [('/live/clip/set/color', 0, 0, 0x111111)]
+    assert ableton_monitor.metrics.counters['skipped_commands'] == 1
+
+    # Clip 1 of track 0 was already dimmed before and track 1 never ended.
+    ableton_monitor.original_cell_color[(0, 1)] = 0x0000FF
+    assert ableton_monitor.restore_clip_colors() == 2
+    assert connection.commands[1:] == [('/live/clip/set/color', 0, 0, 0xFF0000), ('/live/clip/set/color', 0, 1, 0x0000FF)]
+    assert ableton_monitor.metrics.counters['skipped_commands'] == 2
+
+
+def test_ableton_clip_monitor_coalesces_a_dim_and_a_restore() -> None:
+    connection = _CommandConnection()
+    ableton_monitor: AbletonClipMonitor = AbletonClipMonitor(dim_color='111111', connection=connection, coalesce_window=60.0)
+    ableton_monitor.clip_color_grid = {0: [0xFF0000], 1: [0x00FF00]}
+    for track_index in range(2):
+        ableton_monitor.capture_playing_clip_info(track_index, 0)
+        ableton_monitor.dim_color_of_played_clip(track_index)
+
+    assert ableton_monitor.flush_clip_colors() == 0
+    assert ableton_monitor.restore_clip_colors() == 0
+    assert connection.commands == []
+    assert ableton_monitor.metrics.counters['skipped_commands'] == 4
+
+    ableton_monitor.capture_playing_clip_info(0, 0)
+    ableton_monitor.dim_color_of_played_clip(0)
+    assert ableton_monitor.flush_clip_colors(force=True) == 1
+    assert connection.commands == [('/live/clip/set/color', 0, 0, 0x111111)]
+
+
+def test_ableton_clip_monitor_adaptive_polling() -> None:
+    with pytest.raises(AbletonClipMonitorException):
+        _: AbletonClipMonitor = AbletonClipMonitor(mode='events', adaptive_polling=True)
+    with pytest.raises(AbletonClipMonitorException):
+        _ = AbletonClipMonitor(adaptive_polling=True, min_polling_delay=0.2, max_polling_delay=0.1)
+
+    ableton_monitor: AbletonClipMonitor = AbletonClipMonitor(
+        polling_delay=1.0, adaptive_polling=True, min_polling_delay=0.05, max_polling_delay=0.2, latency_target=0.01)
+    assert ableton_monitor.scheduler.period == pytest.approx(0.2)
+
+    for sweep in range(20):
+        ableton_monitor.adapt_polling_delay(0.002, False)
+    assert ableton_monitor.polling_delay == ableton_monitor.scheduler.period == pytest.approx(0.05)
+
+    ableton_monitor.adapt_polling_delay(0.002, True)
+    assert ableton_monitor.scheduler.period == pytest.approx(0.1)
+
+
+def test_ableton_clip_monitor_idle_back_off() -> None:
+    ableton_monitor: AbletonClipMonitor = AbletonClipMonitor(polling_delay=0.1, max_idle_delay=0.5)
+    delays: List[float] = [ableton_monitor.next_idle_delay() for _ in range(5)]
+    assert delays == pytest.approx([0.1, 0.2, 0.4, 0.5, 0.5])
+
+    assert AbletonClipMonitor(polling_delay=0.1).max_idle_delay == pytest.approx(0.1)
+
+
+def test_ableton_clip_monitor_idle_back_off_waits_for_the_write_queue() -> None:
+    ableton_monitor: AbletonClipMonitor = AbletonClipMonitor(
+        polling_delay=0.1, max_idle_delay=5.0, write_rate=10.0, write_burst=1)
+    ableton_monitor.next_idle_delay()
+    for clip_index in range(3):
+        ableton_monitor.write_queue.put(RESTORE, 0, clip_index, 0xFF0000)
+
+    delays: List[float] = [ableton_monitor.next_idle_delay() for _ in range(5)]
+    assert delays == pytest.approx([0.1] * 5)
+
+    ableton_monitor.write_queue.take(3, force=True)
+    delays = [ableton_monitor.next_idle_delay() for _ in range(3)]
+    assert delays == pytest.approx([0.1, 0.2, 0.4])
+    assert AbletonClipMonitor(polling_delay=0.1, max_idle_delay=0.05).max_idle_delay == pytest.approx(0.1)
@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+import asyncio
+import os
+
+from typing import Any, Dict, List, Tuple
+
+import pytest
+
+import enable_imports_from_src_folder  # noqa: F401
+
+from pythonosc.osc_message_builder import OscMessageBuilder
+from pythonosc.osc_packet import OscPacket
+
+from pylive_played_clip import AbletonClipMonitorException, AsyncAbletonClipMonitor
+from pylive_played_clip.fake_ableton import FakeAbletonOSCServer
+from pylive_played_clip.journal import ColorJournal, read_journal
+
+
+class _SetResponder(asyncio.DatagramProtocol):
+    '''Answers the few AbletonOSC queries the scan makes.'''
+    def __init__(self, playing: Dict[int, int], colors: Dict[Tuple[int, int], int]) -> None:
+        self.playing = playing
+        self.colors = colors
+        self.commands: List[Tuple] = []
+        self.transport: asyncio.DatagramTransport
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport  # type: ignore
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]) -> None:
+        for timed_message in OscPacket(data).messages:
+            self._message_received(timed_message.message.address, tuple(timed_message.message.params), addr)
+
+    def _message_received(self, address: str, params: Tuple, addr: Tuple[str, int]) -> None:
+        if address == '/live/track/get/playing_slot_index':
+            self._reply(address, (params[0], self.playing[params[0]]), addr)
+        elif address == '/live/clip/get/color':
+            self._reply(address, params + (self.colors[params],), addr)
+        else:
+            if address == '/live/clip/set/color':
+                self.colors[params[0:2]] = params[2]
+            self.commands.append((address,) + params)
+
+    def _reply(self, address: str, values: Tuple, addr: Tuple[str, int]) -> None:
+        builder = OscMessageBuilder(address)
+        for value in values:
+            builder.add_arg(value)
+        self.transport.sendto(builder.build().dgram, addr)
+
+
+async def _open(responder: _SetResponder, **kwargs: Any) -> Tuple[asyncio.DatagramTransport, AsyncAbletonClipMonitor]:
+    loop = asyncio.get_running_loop()
+    (transport, _) = await loop.create_datagram_endpoint(lambda: responder, local_addr=('127.0.0.1', 0))
+    port: int = transport.get_extra_info('sockname')[1]
+    return (transport, AsyncAbletonClipMonitor(port=port, listen_port=0, **kwargs))
+
+
+async def _scan_twice() -> Tuple[AsyncAbletonClipMonitor, _SetResponder]:
+    responder = _SetResponder({0: 1, 1: -1, 2: 0}, {(0, 1): 0xFF0000, (2, 0): 0x00FF00})
+    (transport, monitor) = await _open(responder, dim_color='111111')
+    async with monitor:
+        monitor.clip_monitor.num_tracks = 3
+        await monitor.scan_tracks()
+        responder.playing[0] = -1
+        await monitor.scan_tracks()
+        await asyncio.sleep(0.05)
+
+    transport.close()
+    return (monitor, responder)
+
+
+def test_async_monitor_scan_tracks() -> None:
+    (monitor, responder) = asyncio.run(_scan_twice())
+
+    assert monitor.clip_monitor.original_cell_color == {(0, 1): 0xFF0000, (2, 0): 0x00FF00}
+    assert responder.commands == [('/live/clip/set/color', 0, 1, 0x111111)]
+
+
+async def _restore(restored_colors: Dict[Tuple[int, int], int]) -> Tuple[int, _SetResponder]:
+    responder = _SetResponder({}, {})
+    (transport, monitor) = await _open(responder, restore_bundle_size=2, restore_max_in_flight=3)
+    async with monitor:
+        monitor.clip_monitor.original_cell_color = dict(restored_colors)
+        restored: int = await monitor.restore_clip_colors()
+
+    transport.close()
+    return (restored, responder)
+
+
+def test_async_monitor_restore_clip_colors() -> None:
+    (restored, responder) = asyncio.run(_restore({(1, 0): 10, (0, 2): 20, (0, 1): 30, (2, 4): 40, (1, 1): 50}))
+
+    assert restored == 5
+    assert responder.commands == [
+        ('/live/clip/set/color', 0, 1, 30),
+        ('/live/clip/set/color', 0, 2, 20),
+        ('/live/clip/set/color', 1, 0, 10),
+        ('/live/clip/set/color', 1, 1, 50),
+        ('/live/clip/set/color', 2, 4, 40)]
+
+
+async def _restore_on_a_fixed_clock() -> AsyncAbletonClipMonitor:
+    responder = _SetResponder({}, {})
+    (transport, monitor) = await _open(responder, clock=lambda: 100.0)
+    async with monitor:
+        monitor.clip_monitor.original_cell_color = {(0, 0): 10, (1, 0): 20}
+        await monitor.restore_clip_colors()
+
+    transport.close()
+    return monitor
+
+
+def test_async_monitor_times_on_the_monitor_clock() -> None:
+    monitor: AsyncAbletonClipMonitor = asyncio.run(_restore_on_a_fixed_clock())
+
+    histograms = monitor.clip_monitor.metrics.histograms
+    assert histograms['restore_seconds'].maximum == 0.0
+    assert histograms['query_seconds'].maximum == 0.0
+
+
+def test_async_monitor_rejects_unsupported_options(tmp_path) -> None:
+    with pytest.raises(AbletonClipMonitorException):
+        AsyncAbletonClipMonitor(listen_port=0, mode='events')
+    with pytest.raises(AbletonClipMonitorException):
+        AsyncAbletonClipMonitor(listen_port=0, mode='quantized')
+    with pytest.raises(AbletonClipMonitorException):
+        AsyncAbletonClipMonitor(listen_port=0, record=os.path.join(tmp_path, 'show.plpc'))
+
+
+async def _recover(server: FakeAbletonOSCServer, path: str) -> AsyncAbletonClipMonitor:
+    monitor = AsyncAbletonClipMonitor(port=server.port, listen_port=0, journal=path, recover=True)
+    task = asyncio.ensure_future(monitor.monitor())
+    for _ in range(100):
+        if ('/live/clip/set/color', 1, 0, 0xFF0000) in server.commands:
+            break
+        await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    return monitor
+
+
+def test_async_monitor_recovers_and_closes_the_journal(tmp_path) -> None:
+    path: str = os.path.join(tmp_path, 'colors.plpj')
+    journal = ColorJournal(path)
+    journal.record(1, 0, 0xFF0000)
+    journal.close()
+
+    with FakeAbletonOSCServer(num_tracks=2, num_scenes=1, port=0, reply_port=None) as server:
+        server.clip_colors[1][0] = 0x111111
+        monitor = asyncio.run(_recover(server, path))
+
+        assert server.clip_colors[1][0] == 0xFF0000
+    assert monitor.clip_monitor.journal is not None and monitor.clip_monitor.journal.file.closed
+    assert read_journal(path) == {}
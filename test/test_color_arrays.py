@@ -0,0 +1,51 @@
+#!/usr/bin/python3
+from typing import List
+
+import pytest
+
+import enable_imports_from_src_folder  # noqa: F401
+import pylive_played_clip
+
+from pylive_played_clip import color_arrays
+
+COLORS: List[int] = list(pylive_played_clip.LIVE_CLIP_COLOR_PALETTE) + [0x000000, 0x808080, 0x123456]
+
+
+def test_hex_to_color_int_batch() -> None:
+    assert color_arrays.hexToColorIntBatch(['ffffff', 'ff0000', '0000ff'], backend='python') == [0xFFFFFF, 0xFF0000, 0x0000FF]
+
+
+def test_rgb_round_trip_batch_python() -> None:
+    (reds, greens, blues) = color_arrays.colorIntToRgbBatch(COLORS, backend='python')
+
+    assert color_arrays.rgbToColorIntBatch(reds, greens, blues, backend='python') == COLORS
+
+
+def test_color_int_to_rgb_string_batch() -> None:
+    assert color_arrays.colorIntToRgbStringBatch([0xFF0000, 0x00FF00]) == ['[255, 0, 0]', '[0, 255, 0]']
+
+
+def test_dim_color_int_batch_python() -> None:
+    expected: List[int] = [pylive_played_clip.dimColorInt(color, 2.0) for color in COLORS]
+
+    assert color_arrays.dimColorIntBatch(COLORS, 2.0, backend='python') == expected
+
+
+def test_dim_color_int_batch_numpy_matches_python() -> None:
+    pytest.importorskip('numpy')
+    for dim_ratio in (1.5, 2.0, 4.0):
+        expected: List[int] = color_arrays.dimColorIntBatch(COLORS, dim_ratio, backend='python')
+
+        assert color_arrays.dimColorIntBatch(COLORS, dim_ratio, backend='numpy').tolist() == expected
+
+
+def test_rgb_round_trip_batch_numpy() -> None:
+    pytest.importorskip('numpy')
+    (reds, greens, blues) = color_arrays.colorIntToRgbBatch(COLORS, backend='numpy')
+
+    assert color_arrays.rgbToColorIntBatch(reds, greens, blues, backend='numpy').tolist() == COLORS
+
+
+def test_unknown_backend_error() -> None:
+    with pytest.raises(ValueError):
+        color_arrays.dimColorIntBatch(COLORS, 2.0, backend='cuda')
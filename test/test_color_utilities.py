@@ -1,4 +1,6 @@
 #!/usr/bin/python3
+import colorsys
+
 import enable_imports_from_src_folder  # noqa: F401
 import pylive_played_clip
 
@@ -108,3 +110,21 @@ def _rgb_to_color_to_rgb(red: int, green: int, blue: int) -> None:
     assert red == red_from_int
     assert green == green_from_int
     assert blue == blue_from_int
+
+
+def test_dim_color_int_matches_hls_dimming() -> None:
+    for color in pylive_played_clip.LIVE_CLIP_COLOR_PALETTE:
+        (red, green, blue) = pylive_played_clip.colorIntToRgb(color)
+        (hue, lightness, saturation) = colorsys.rgb_to_hls(red, green, blue)
+        (dim_red, dim_green, dim_blue) = colorsys.hls_to_rgb(hue, lightness / 2.0, saturation)
+        expected: int = pylive_played_clip.rgbToColorInt(int(dim_red), int(dim_green), int(dim_blue))
+
+        assert pylive_played_clip.dimColorInt(color, 2.0) == expected
+
+
+def test_dim_color_int_is_memoized() -> None:
+    pylive_played_clip.dimColorInt.cache_clear()
+    pylive_played_clip.dimColorInt(0xFF94A6, 3.0)
+    pylive_played_clip.dimColorInt(0xFF94A6, 3.0)
+
+    assert pylive_played_clip.dimColorInt.cache_info().hits == 1
@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+import threading
+import time
+
+from typing import Iterator, List, Optional, Tuple
+
+import pytest
+
+import enable_imports_from_src_folder  # noqa: F401
+
+from pylive_played_clip import AbletonClipMonitor, PlayingClip
+from pylive_played_clip.fake_ableton import FakeAbletonOSCServer
+from pylive_played_clip.lazy_import import LazyModule
+from pylive_played_clip.osc_connection import OscConnection
+
+live = LazyModule('live')
+
+
+@pytest.fixture
+def fake_set() -> Iterator[Tuple[FakeAbletonOSCServer, AbletonClipMonitor]]:
+    with FakeAbletonOSCServer(num_tracks=4, num_scenes=3, port=0, reply_port=None, clip_length=0.2) as server:
+        connection = OscConnection(port=server.port)
+        monitor = AbletonClipMonitor(dim_color='111111', connection=connection, sweep_timeout=0.5)
+        monitor.num_tracks = monitor.get_number_of_tracks()
+        monitor.load_clip_color_grid()
+        yield (server, monitor)
+        connection.close()
+
+
+def test_fake_ableton_scan_dim_and_restore(fake_set: Tuple[FakeAbletonOSCServer, AbletonClipMonitor]) -> None:
+    (server, monitor) = fake_set
+    original_color: Optional[int] = server.clip_colors[2][1]
+    assert original_color is not None
+    server.launch_clip(2, 1)
+    assert monitor.is_playing()
+
+    monitor.scan_tracks()
+    assert monitor.dim_clip_on_track[2] == PlayingClip(1, original_color)
+
+    time.sleep(0.15)
+    monitor.scan_tracks()
+    assert monitor.dim_clip_on_track[2] is None
+    assert monitor.metrics.counters['dims'] == 1
+
+    server.set_playing(False)
+    assert monitor.restore_clip_colors() == 1
+    time.sleep(0.05)
+    assert server.clip_colors[2][1] == original_color
+    assert ('/live/clip/set/color', 2, 1, 0x111111) in server.commands
+
+
+def test_fake_ableton_clip_recolored_while_playing(fake_set: Tuple[FakeAbletonOSCServer, AbletonClipMonitor]) -> None:
+    (server, monitor) = fake_set
+    server.launch_clip(0, 0)
+    monitor.scan_tracks()
+
+    # The user recolors a clip while Live plays, after the grid was loaded.
+    server.clip_colors[1][2] = 0x00FFFF
+    assert not monitor.refresh_clip_color_grid()
+    monitor.clip_color_grid_loaded -= monitor.color_refresh_interval + 1.0
+    assert monitor.refresh_clip_color_grid()
+    assert monitor.get_known_clip_color(1, 2) == 0x00FFFF
+
+    queries: int = monitor.metrics.counters['queries']
+    server.launch_clip(1, 2)
+    monitor.scan_tracks()
+    assert monitor.original_cell_color[(1, 2)] == 0x00FFFF
+    # The launch was detected without a color query.
+    assert monitor.metrics.counters['queries'] - queries == monitor.num_tracks
+
+
+def test_fake_ableton_track_layout(fake_set: Tuple[FakeAbletonOSCServer, AbletonClipMonitor]) -> None:
+    (server, monitor) = fake_set
+    monitor.track_names = monitor.get_track_names()
+    server.add_track('Vox', index=0)
+    monitor.layout_checked = 0.0
+
+    assert monitor.check_track_layout()
+    assert monitor.num_tracks == 5
+    assert monitor.clip_color_grid[0] == server.clip_colors[0]
+
+
+def test_fake_ableton_reports_errors_and_keeps_serving() -> None:
+    with FakeAbletonOSCServer(num_tracks=2, port=0, reply_port=None) as server:
+        connection = OscConnection(port=server.port, timeout=0.2)
+        errors: List[Tuple] = []
+        connection.add_handler('/live/error', lambda *data: errors.append(data))
+        server.remove_track(1)
+
+        with pytest.raises(live.exceptions.LiveConnectionError):
+            connection.query('/live/track/get/playing_slot_index', (1,))
+        assert errors and 'Error handling OSC message' in errors[0][0]
+        assert connection.query('/live/song/get/num_tracks') == (1,)
+        connection.close()
+
+
+def test_fake_ableton_latency() -> None:
+    with FakeAbletonOSCServer(num_tracks=2, port=0, reply_port=None, latency=0.05) as server:
+        connection = OscConnection(port=server.port)
+        start: float = time.monotonic()
+        assert connection.query('/live/song/get/num_tracks') == (2,)
+        assert time.monotonic() - start >= 0.05
+        connection.close()
+
+
+def test_fake_ableton_transport_listener_wakes_the_loop() -> None:
+    with FakeAbletonOSCServer(num_tracks=2, num_scenes=1, port=0, reply_port=None) as server:
+        connection = OscConnection(port=server.port)
+        monitor = AbletonClipMonitor(
+            connection=connection, polling_delay=5.0, max_idle_delay=5.0, transport_listener=True)
+        monitor.start_transport_listener()
+        assert not monitor.is_playing()
+
+        threading.Timer(0.1, server.set_playing, (True,)).start()
+        start: float = time.perf_counter()
+        monitor.wait_while_stopped()
+        assert time.perf_counter() - start < 1.0
+        assert monitor.is_playing()
+
+        # The restore must not wait for the next scan once the transport stops.
+        threading.Timer(0.1, server.set_playing, (False,)).start()
+        start = time.perf_counter()
+        monitor.wait_for_next_scan()
+        assert time.perf_counter() - start < 1.0
+        assert not monitor.is_playing()
+
+        monitor.stop_transport_listener()
+        connection.close()
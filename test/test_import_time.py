@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+import os
+import subprocess
+import sys
+import textwrap
+
+from typing import Dict
+
+import enable_imports_from_src_folder  # noqa: F401
+
+from enable_imports_from_src_folder import get_parent_directory
+
+import pylive_played_clip
+
+# The most time importing the package may take. Importing pylive alone
+# takes several times longer.
+IMPORT_TIME_BUDGET: float = 0.25
+
+# Makes any import of pylive fail, as if it was not installed.
+BLOCK_PYLIVE: str = textwrap.dedent('''\
+    import importlib.abc
+    import sys
+
+    class BlockPylive(importlib.abc.MetaPathFinder):
+        def find_spec(self, name, path, target=None):
+            if name == 'live' or name.startswith('live.'):
+                raise ImportError('pylive is blocked')
+            return None
+
+    sys.meta_path.insert(0, BlockPylive())
+    ''')
+
+
+def run_python(code: str, *args: str) -> subprocess.CompletedProcess:
+    environment: Dict[str, str] = dict(os.environ, PYTHONPATH=get_parent_directory())
+    return subprocess.run([sys.executable, *args, '-c', code], capture_output=True, text=True, env=environment, timeout=60)
+
+
+def test_import_does_not_load_pylive() -> None:
+    result = run_python(textwrap.dedent('''\
+        import sys
+        import pylive_played_clip
+        monitor = pylive_played_clip.AbletonClipMonitor(dim_color='111111')
+        assert monitor.connection is None and monitor.ableton is None
+        print(sorted(name for name in ('asyncio', 'live', 'pythonosc') if name in sys.modules))
+        '''))
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == '[]'
+
+
+def test_import_time() -> None:
+    result = run_python('import pylive_played_clip', '-X', 'importtime')
+
+    assert result.returncode == 0, result.stderr
+    microseconds: int = min(
+        int(line.split('|')[1])
+        for line in result.stderr.splitlines()
+        if line.rstrip().endswith('| pylive_played_clip'))
+    assert microseconds / 1_000_000 < IMPORT_TIME_BUDGET
+
+
+def test_version_and_help_without_pylive() -> None:
+    for (option, expected) in (('--version', pylive_played_clip.__version__), ('--help', 'usage:')):
+        result = run_python(BLOCK_PYLIVE + textwrap.dedent(f'''\
+            import runpy
+            sys.argv = ['pylive-played-clip', '{option}']
+            runpy.run_module('pylive_played_clip', run_name='__main__')
+            '''))
+
+        assert result.returncode == 0, result.stderr
+        assert expected in result.stdout
+
+
+def test_color_utilities_without_pylive() -> None:
+    result = run_python(BLOCK_PYLIVE + textwrap.dedent('''\
+        from pylive_played_clip import colorIntToRgbString, dimColorInt
+        print(colorIntToRgbString(dimColorInt(0xFF0000, 2.0)))
+        '''))
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == pylive_played_clip.colorIntToRgbString(pylive_played_clip.dimColorInt(0xFF0000, 2.0))
@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+import os
+import time
+
+from typing import Optional
+
+import pytest
+
+import enable_imports_from_src_folder  # noqa: F401
+
+from pylive_played_clip import AbletonClipMonitor, AbletonClipMonitorException
+from pylive_played_clip.fake_ableton import FakeAbletonOSCServer
+from pylive_played_clip.journal import MAGIC, RECORD, ColorJournal, read_journal
+from pylive_played_clip.osc_connection import OscConnection
+
+
+def test_journal_round_trip(tmp_path) -> None:
+    path: str = os.path.join(tmp_path, 'colors.plpj')
+    journal = ColorJournal(path)
+    journal.record(2, 1, 0xFF0000)
+    journal.record(0, 3, 0x00FF00)
+    journal.record(2, 1, 0x111111)
+    assert journal.flush()
+    journal.close()
+
+    assert read_journal(path) == {(2, 1): 0xFF0000, (0, 3): 0x00FF00}
+    assert os.path.getsize(path) == len(MAGIC) + 3 * RECORD.size
+
+
+def test_journal_torn_record_is_ignored(tmp_path) -> None:
+    path: str = os.path.join(tmp_path, 'colors.plpj')
+    journal = ColorJournal(path)
+    journal.record(1, 1, 0x0000FF)
+    journal.close()
+    with open(path, 'ab') as journal_file:
+        journal_file.write(RECORD.pack(4, 2, 0x00FF00)[:5])
+
+    assert read_journal(path) == {(1, 1): 0x0000FF}
+
+    journal = ColorJournal(path)
+    journal.record(4, 2, 0x00FF00)
+    journal.close()
+    assert read_journal(path) == {(1, 1): 0x0000FF, (4, 2): 0x00FF00}
+
+
+def test_journal_rewrite_compacts(tmp_path) -> None:
+    path: str = os.path.join(tmp_path, 'colors.plpj')
+    journal = ColorJournal(path)
+    for clip_index in range(100):
+        journal.record(0, clip_index, clip_index)
+    journal.rewrite({(1, 5): 0x123456})
+    journal.record(2, 0, 0x654321)
+    journal.close()
+
+    assert read_journal(path) == {(1, 5): 0x123456, (2, 0): 0x654321}
+    assert not os.path.exists(path + '.tmp')
+
+    with open(path, 'wb') as journal_file:
+        journal_file.write(b'not a journal')
+    with pytest.raises(AbletonClipMonitorException):
+        read_journal(path)
+
+
+def test_monitor_journals_the_original_colors(tmp_path) -> None:
+    path: str = os.path.join(tmp_path, 'colors.plpj')
+    with pytest.raises(AbletonClipMonitorException):
+        AbletonClipMonitor(recover=True)
+
+    with FakeAbletonOSCServer(num_tracks=3, num_scenes=2, port=0, reply_port=None, clip_length=0.2) as server:
+        original: Optional[int] = server.clip_colors[1][0]
+        assert original is not None
+        connection = OscConnection(port=server.port)
+        monitor = AbletonClipMonitor(dim_color='111111', connection=connection, sweep_timeout=0.5, journal=path)
+        monitor.num_tracks = monitor.get_number_of_tracks()
+        monitor.load_clip_color_grid()
+        server.launch_clip(1, 0)
+        monitor.scan_tracks()
+        time.sleep(0.25)
+        monitor.scan_tracks()
+        assert monitor.journal is not None and monitor.journal.flush()
+        assert monitor.metrics.counters['dims'] == 1
+        assert read_journal(path) == {(1, 0): original}
+
+        monitor.restore_clip_colors()
+        assert monitor.journal.flush()
+        assert read_journal(path) == {}
+        monitor.journal.close()
+        connection.close()
+
+
+def test_recover_restores_the_journal(tmp_path) -> None:
+    path: str = os.path.join(tmp_path, 'colors.plpj')
+    with FakeAbletonOSCServer(num_tracks=3, num_scenes=2, port=0, reply_port=None) as server:
+        originals = {(0, 1): server.clip_colors[0][1], (2, 0): server.clip_colors[2][0], (7, 0): 0x00FF00}
+        journal = ColorJournal(path)
+        for ((track_index, clip_index), color) in originals.items():
+            assert color is not None
+            journal.record(track_index, clip_index, color)
+            if track_index < 3:
+                server.clip_colors[track_index][clip_index] = 0x111111
+        journal.close()
+
+        connection = OscConnection(port=server.port)
+        monitor = AbletonClipMonitor(dim_color='111111', connection=connection, journal=path, recover=True)
+        monitor.num_tracks = monitor.get_number_of_tracks()
+        monitor.load_clip_color_grid()
+
+        assert monitor.recover_clip_colors() == 2
+        assert server.clip_colors[0][1] == originals[(0, 1)]
+        assert server.clip_colors[2][0] == originals[(2, 0)]
+        assert monitor.journal is not None and monitor.journal.flush()
+        assert read_journal(path) == {}
+        monitor.journal.close()
+        connection.close()
@@ -0,0 +1,43 @@
+#!/usr/bin/python3
+import os
+
+import pytest
+
+import enable_imports_from_src_folder  # noqa: F401
+
+from pylive_played_clip.metrics import Histogram, MonitorMetrics, write_atomically
+
+
+def test_histogram_quantiles() -> None:
+    histogram = Histogram(buckets=(0.001, 0.01, 0.1))
+    for value in (0.0005, 0.002, 0.003, 0.004, 0.05):
+        histogram.observe(value)
+
+    assert histogram.counts == [1, 3, 1, 0]
+    assert histogram.count == 5
+    assert histogram.mean == pytest.approx(0.0119)
+    assert histogram.quantile(0.5) == 0.01
+    assert histogram.quantile(1.0) == 0.05
+
+
+def test_monitor_metrics_prometheus() -> None:
+    metrics = MonitorMetrics()
+    metrics.increment('sweeps', 3)
+    metrics.observe('sweep_seconds', 0.002)
+    text: str = metrics.to_prometheus(labels={'host': 'stage'})
+
+    assert 'pylive_played_clip_sweeps_total{host="stage"} 3\n' in text
+    assert 'pylive_played_clip_sweep_seconds_bucket{host="stage",le="+Inf"} 1\n' in text
+    assert 'pylive_played_clip_sweep_seconds_count{host="stage"} 1\n' in text
+    assert '# TYPE pylive_played_clip_dim_lag_seconds histogram\n' in text
+    assert metrics.summary().startswith('3 sweeps p50 2.0 ms')
+
+
+def test_write_atomically(tmp_path) -> None:
+    path: str = os.path.join(str(tmp_path), 'metrics.prom')
+    write_atomically(path, 'first\n')
+    write_atomically(path, 'second\n')
+
+    with open(path) as metrics_file:
+        assert metrics_file.read() == 'second\n'
+    assert os.listdir(str(tmp_path)) == ['metrics.prom']
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+import os
+import socket
+import sys
+import time
+
+from typing import Iterator, List, Tuple
+
+import pytest
+
+import enable_imports_from_src_folder  # noqa: F401
+
+from pylive_played_clip import AbletonClipMonitorException
+from pylive_played_clip.__main__ import _main
+from pylive_played_clip.fake_ableton import FakeAbletonOSCServer
+from pylive_played_clip.multi_host import MultiHostMonitor, parse_host
+
+
+@pytest.fixture
+def two_hosts() -> Iterator[Tuple[FakeAbletonOSCServer, FakeAbletonOSCServer, MultiHostMonitor]]:
+    with FakeAbletonOSCServer(num_tracks=3, num_scenes=2, port=0, reply_port=None, clip_length=0.2) as main, \
+            FakeAbletonOSCServer(num_tracks=5, num_scenes=2, port=0, reply_port=None, clip_length=0.2) as backup:
+        monitor = MultiHostMonitor([f"127.0.0.1:{main.port}", f"localhost:{backup.port}"], listen_port=0,
+                                   dim_color='111111', sweep_timeout=0.5)
+        yield (main, backup, monitor)
+        monitor.close()
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def _wait_for_command(server: FakeAbletonOSCServer, command: Tuple, timeout: float = 1.0) -> bool:
+    # Commands are not answered, so the fake may still be handling one the monitor has sent.
+    deadline: float = time.monotonic() + timeout
+    while command not in server.commands and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return command in server.commands
+
+
+def test_parse_host() -> None:
+    assert parse_host('192.168.1.20') == ('192.168.1.20', 11000)
+    assert parse_host('backup.local:11010') == ('backup.local', 11010)
+    with pytest.raises(AbletonClipMonitorException):
+        parse_host('backup.local:osc')
+
+
+def test_multi_host_rejects_other_modes() -> None:
+    with pytest.raises(AbletonClipMonitorException):
+        MultiHostMonitor(['127.0.0.1'], listen_port=0, mode='events')
+    with pytest.raises(AbletonClipMonitorException):
+        MultiHostMonitor([], listen_port=0)
+    with pytest.raises(AbletonClipMonitorException):
+        MultiHostMonitor(['127.0.0.1'], listen_port=0, transport_listener=True)
+
+
+def test_multi_host_command_line_rejects_record(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    path: str = os.path.join(tmp_path, 'show.plpc')
+    monkeypatch.setattr(sys, 'argv', ['pylive-played-clip', '--record', path, '--host', '127.0.0.1', '--host', '127.0.0.2'])
+    with pytest.raises(AbletonClipMonitorException):
+        _main()
+    assert not os.path.exists(path)
+
+
+def test_multi_host_shares_one_socket(two_hosts: Tuple[FakeAbletonOSCServer, FakeAbletonOSCServer, MultiHostMonitor]) -> None:
+    (main, backup, monitor) = two_hosts
+    connections = [host_monitor.connection for host_monitor in monitor.monitors.values()]
+
+    assert all(connection.osc_socket is monitor.osc_socket for connection in connections)
+    assert list(monitor.monitors) == [f"127.0.0.1:{main.port}", f"localhost:{backup.port}"]
+
+
+def test_multi_host_dims_each_host(two_hosts: Tuple[FakeAbletonOSCServer, FakeAbletonOSCServer, MultiHostMonitor]) -> None:
+    (main, backup, monitor) = two_hosts
+    (main_name, backup_name) = list(monitor.monitors)
+    assert monitor.start_host(main_name) and monitor.start_host(backup_name)
+    assert monitor.monitors[backup_name].num_tracks == 5
+
+    main.launch_clip(1, 0)
+    backup.launch_clip(4, 1)
+    monitor.cycle()
+    time.sleep(0.25)
+    monitor.cycle()
+
+    assert _wait_for_command(main, ('/live/clip/set/color', 1, 0, 0x111111))
+    assert _wait_for_command(backup, ('/live/clip/set/color', 4, 1, 0x111111))
+    assert monitor.monitors[main_name].metrics.counters['dims'] == 1
+    assert monitor.monitors[backup_name].metrics.counters['dims'] == 1
+    assert monitor.monitors[main_name].metrics.counters['sweeps'] == 2
+
+
+def test_multi_host_stats_file_is_labelled_by_host(
+        tmp_path, two_hosts: Tuple[FakeAbletonOSCServer, FakeAbletonOSCServer, MultiHostMonitor]) -> None:
+    (main, backup, monitor) = two_hosts
+    monitor.stats_file = os.path.join(tmp_path, 'metrics.prom')
+    for name in monitor.monitors:
+        monitor.start_host(name)
+    main.launch_clip(0, 0)
+    monitor.cycle()
+    monitor.report_stats(force=True)
+
+    with open(monitor.stats_file) as stats_file:
+        text: str = stats_file.read()
+    assert text.count('# TYPE pylive_played_clip_sweeps_total counter') == 1
+    assert f'pylive_played_clip_sweeps_total{{host="127.0.0.1:{main.port}"}} 1' in text
+    assert f'pylive_played_clip_sweeps_total{{host="localhost:{backup.port}"}} 0' in text
+
+
+def test_multi_host_runs_on_the_given_clock(tmp_path) -> None:
+    now: List[float] = [0.0]
+    with FakeAbletonOSCServer(num_tracks=2, port=0, reply_port=None) as main:
+        monitor = MultiHostMonitor([f"127.0.0.1:{main.port}"], listen_port=0, stats_interval=10.0,
+                                   stats_file=os.path.join(tmp_path, 'metrics.prom'), clock=lambda: now[0])
+        try:
+            host_monitor = monitor.monitors[f"127.0.0.1:{main.port}"]
+            assert monitor.scheduler.clock() == host_monitor.clock() == 0.0
+            monitor.report_stats()
+            assert monitor.stats_file is not None and not os.path.exists(monitor.stats_file)
+
+            now[0] = 10.5
+            assert host_monitor.scheduler.clock() == 10.5
+            monitor.report_stats()
+            assert os.path.exists(monitor.stats_file)
+        finally:
+            monitor.close()
+
+
+def test_multi_host_offline_host_does_not_slow_the_others() -> None:
+    offline_port: int = _free_port()
+    with FakeAbletonOSCServer(num_tracks=2, port=0, reply_port=None) as main:
+        monitor = MultiHostMonitor([f"127.0.0.1:{main.port}", f"127.0.0.1:{offline_port}"], listen_port=0,
+                                   timeout=0.2, sweep_timeout=0.5)
+        try:
+            (main_name, offline_name) = list(monitor.monitors)
+            assert monitor.start_host(main_name)
+            assert not monitor.start_host(offline_name)
+            main.set_playing(True)
+
+            start: float = time.perf_counter()
+            for _ in range(3):
+                monitor.cycle()
+            assert time.perf_counter() - start < 0.3
+            assert monitor.online == {main_name: True, offline_name: False}
+            assert monitor.monitors[main_name].metrics.counters['sweeps'] == 3
+        finally:
+            monitor.close()
@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+import io
+import logging
+import logging.handlers
+import time
+
+from typing import List
+
+import enable_imports_from_src_folder  # noqa: F401
+
+from pylive_played_clip.output import BackgroundWriter, start_background_logging
+
+
+class _SlowStream(io.StringIO):
+    def write(self, text: str) -> int:
+        time.sleep(0.2)
+        return super().write(text)
+
+
+def test_background_writer_writes_lines_in_order() -> None:
+    stream = io.StringIO()
+    writer = BackgroundWriter(stream)
+    for index in range(100):
+        writer.write(f"line {index}")
+
+    assert writer.flush()
+    assert stream.getvalue() == ''.join(f"line {index}\n" for index in range(100))
+
+
+def test_background_writer_does_not_block_on_a_slow_stream() -> None:
+    stream = _SlowStream()
+    writer = BackgroundWriter(stream)
+    start: float = time.perf_counter()
+    for index in range(10):
+        writer.write(f"line {index}")
+
+    assert time.perf_counter() - start < 0.1
+    assert writer.flush(5.0)
+    assert stream.getvalue().splitlines() == [f"line {index}" for index in range(10)]
+
+
+def test_background_writer_flush_without_lines() -> None:
+    assert BackgroundWriter(io.StringIO()).flush()
+
+
+def test_start_background_logging() -> None:
+    root: logging.Logger = logging.getLogger()
+    saved_handlers: List[logging.Handler] = list(root.handlers)
+    saved_level: int = root.level
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    for saved_handler in saved_handlers:
+        root.removeHandler(saved_handler)
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    try:
+        listener = start_background_logging()
+        assert [type(root_handler) for root_handler in root.handlers] == [logging.handlers.QueueHandler]
+        logging.info('Dimming track %d', 3)
+        listener.stop()
+        assert stream.getvalue() == 'Dimming track 3\n'
+    finally:
+        for root_handler in list(root.handlers):
+            root.removeHandler(root_handler)
+        for saved_handler in saved_handlers:
+            root.addHandler(saved_handler)
+        root.setLevel(saved_level)
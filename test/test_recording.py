@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+import os
+import time
+
+from typing import List
+
+import enable_imports_from_src_folder  # noqa: F401
+
+import pylive_played_clip
+from pylive_played_clip import AbletonClipMonitor
+from pylive_played_clip.fake_ableton import FakeAbletonOSCServer
+from pylive_played_clip.osc_connection import OscConnection
+from pylive_played_clip.recording import (COMMAND, MESSAGE, QUERY, REPLY, RecordingConnection, SessionRecord,
+                                          SessionRecorder, SessionReplay, measure_round_trip, read_session)
+
+
+class _Clock():
+    def __init__(self) -> None:
+        self.now: float = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_session_round_trip(tmp_path) -> None:
+    path: str = os.path.join(tmp_path, 'session.plpc')
+    recorder = SessionRecorder(path)
+    recorder.write(QUERY, '/live/song/get/is_playing')
+    recorder.write(REPLY, '/live/song/get/is_playing', (True,))
+    recorder.write(COMMAND, '/live/clip/set/color', (2, 1, 0x111111))
+    recorder.write(MESSAGE, '/live/song/get/track_names', ('Drums', 'Bass', 2.5, None))
+    recorder.close()
+
+    records: List[SessionRecord] = list(read_session(path))
+    assert [(record.kind, record.address, record.values) for record in records] == [
+        (QUERY, '/live/song/get/is_playing', ()),
+        (REPLY, '/live/song/get/is_playing', (True,)),
+        (COMMAND, '/live/clip/set/color', (2, 1, 0x111111)),
+        (MESSAGE, '/live/song/get/track_names', ('Drums', 'Bass', 2.5, None)),
+    ]
+    assert all(earlier.time <= later.time for (earlier, later) in zip(records, records[1:]))
+
+
+def test_session_is_compact(tmp_path) -> None:
+    path: str = os.path.join(tmp_path, 'session.plpc')
+    recorder = SessionRecorder(path)
+    for track_index in range(1000):
+        recorder.write(MESSAGE, '/live/track/get/playing_slot_index', (track_index, -1))
+    recorder.close()
+
+    assert os.path.getsize(path) < 1000 * 24
+
+
+def test_session_truncated_record_is_ignored(tmp_path) -> None:
+    path: str = os.path.join(tmp_path, 'session.plpc')
+    recorder = SessionRecorder(path)
+    recorder.write(QUERY, '/live/song/get/num_tracks')
+    recorder.write(REPLY, '/live/song/get/num_tracks', (4,))
+    recorder.close()
+    with open(path, 'r+b') as log:
+        log.truncate(os.path.getsize(path) - 2)
+
+    assert [record.kind for record in read_session(path)] == [QUERY]
+
+
+def test_recording_connection_against_fake_ableton(tmp_path) -> None:
+    path: str = os.path.join(tmp_path, 'session.plpc')
+    with FakeAbletonOSCServer(num_tracks=4, num_scenes=3, port=0, reply_port=None, clip_length=0.2) as server:
+        connection = OscConnection(port=server.port)
+        recorder = SessionRecorder(path)
+        monitor = AbletonClipMonitor(dim_color='111111', connection=RecordingConnection(connection, recorder), sweep_timeout=0.5)
+        monitor.num_tracks = monitor.get_number_of_tracks()
+        monitor.load_clip_color_grid()
+        server.launch_clip(2, 1)
+        monitor.scan_tracks()
+        time.sleep(0.25)
+        monitor.scan_tracks()
+        recorder.close()
+        connection.close()
+
+    records: List[SessionRecord] = list(read_session(path))
+    assert [(record.kind, record.values) for record in records[:2]] == [(QUERY, ()), (REPLY, (4,))]
+    assert sum(1 for record in records if record.kind == COMMAND and record.address == '/live/track/get/playing_slot_index') == 8
+    assert any(record.kind == MESSAGE and record.values == (2, 1) for record in records)
+    assert any(record.kind == COMMAND and record.values == (2, 1, 0x111111) for record in records)
+
+
+def test_measure_round_trip_of_a_pipelined_sweep() -> None:
+    address: str = '/live/track/get/playing_slot_index'
+    records: List[SessionRecord] = [SessionRecord(0.001 * track_index, QUERY, address, (track_index,)) for track_index in range(4)]
+    records += [SessionRecord(0.010 + 0.001 * track_index, REPLY, address, (track_index, -1)) for track_index in range(4)]
+
+    assert round(measure_round_trip(records), 6) == 0.010
+
+
+def test_replay_detects_the_recorded_clip_end(tmp_path) -> None:
+    path: str = os.path.join(tmp_path, 'session.plpc')
+    clock = _Clock()
+    recorder = SessionRecorder(path, clock=clock)
+    recorder.write(REPLY, '/live/song/get/num_tracks', (2,))
+    recorder.write(REPLY, '/live/song/get/track_names', ('Drums', 'Bass'))
+    for track_index in range(2):
+        recorder.write(MESSAGE, '/live/track/get/clips/color', (track_index, 0x00FF00, 0x0000FF))
+        recorder.write(MESSAGE, '/live/track/get/playing_slot_index', (track_index, -1))
+    recorder.write(REPLY, '/live/clip/get/color', (1, 1, 0x0000FF))
+    recorder.write(REPLY, '/live/song/get/is_playing', (True,))
+    clock.now = 10.0
+    recorder.write(MESSAGE, '/live/track/get/playing_slot_index', (1, 1))
+    clock.now = 70.0
+    recorder.write(MESSAGE, '/live/track/get/playing_slot_index', (1, -1))
+    clock.now = 100.0
+    recorder.write(REPLY, '/live/song/get/is_playing', (False,))
+    clock.now = 110.0
+    recorder.write(REPLY, '/live/song/get/is_playing', (False,))
+    recorder.close()
+
+    replay = SessionReplay(path, dim_color='111111', polling_delay=0.1)
+    started: float = time.perf_counter()
+    monitor: AbletonClipMonitor = replay.run()
+
+    assert time.perf_counter() - started < 30.0
+    assert monitor.metrics.counters['dims'] == 1
+    assert monitor.metrics.histograms['dim_lag_seconds'].maximum <= 0.2
+    assert monitor.metrics.counters['restored_clips'] == 1
+    assert replay.connection is not None
+    assert replay.connection.clock.monotonic() >= 110.0
+    # The replay runs on its own clock and leaves the real one alone.
+    assert monitor.clock() == replay.connection.clock.monotonic()
+    assert pylive_played_clip.time is time
+    assert 'replayed' in replay.summary()
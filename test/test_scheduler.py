@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+from typing import List
+
+import pytest
+
+import enable_imports_from_src_folder  # noqa: F401
+
+from pylive_played_clip.scheduler import AdaptivePollingDelay, BeatBoundaryScheduler, ClipEndPredictor, FixedRateScheduler, quantization_to_beats
+
+
+class _VirtualClock():
+    def __init__(self) -> None:
+        self.now: float = 100.0
+        self.sleeps: List[float] = []
+
+    def clock(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_fixed_rate_scheduler_does_not_drift() -> None:
+    virtual = _VirtualClock()
+    scheduler = FixedRateScheduler(0.1, clock=virtual.clock, sleep=virtual.sleep)
+    scheduler.start()
+
+    for _ in range(5):
+        virtual.now += 0.03
+        scheduler.wait()
+
+    assert virtual.now == pytest.approx(100.5)
+    assert scheduler.ticks == 5
+    assert scheduler.overruns == 0
+    assert scheduler.jitter_max == pytest.approx(0.0)
+
+
+def test_fixed_rate_scheduler_skip() -> None:
+    virtual = _VirtualClock()
+    scheduler = FixedRateScheduler(0.1, overrun='skip', clock=virtual.clock, sleep=virtual.sleep)
+    scheduler.start()
+
+    virtual.now += 0.35
+    scheduler.wait()
+    scheduler.wait()
+
+    assert scheduler.overruns == 1
+    assert scheduler.skipped == 2
+    assert scheduler.jitter_last == pytest.approx(0.0)
+    assert virtual.now == pytest.approx(100.4)
+
+
+def test_fixed_rate_scheduler_catch_up() -> None:
+    virtual = _VirtualClock()
+    scheduler = FixedRateScheduler(0.1, overrun='catch-up', clock=virtual.clock, sleep=virtual.sleep)
+    scheduler.start()
+
+    virtual.now += 0.35
+    for _ in range(4):
+        scheduler.wait()
+
+    assert virtual.sleeps == [pytest.approx(0.05)]
+    assert scheduler.overruns == 3
+    assert scheduler.skipped == 0
+    assert scheduler.jitter_max == pytest.approx(0.25)
+
+
+def test_fixed_rate_scheduler_bad_policy() -> None:
+    with pytest.raises(ValueError):
+        FixedRateScheduler(0.1, overrun='drop')
+
+
+def test_adaptive_polling_delay_aimd() -> None:
+    adaptive = AdaptivePollingDelay(min_delay=0.05, max_delay=0.5, latency_target=0.02, initial_delay=0.1, increase=2.0)
+
+    assert adaptive.delay == pytest.approx(0.1)
+    assert not adaptive.update(0.005)
+    assert adaptive.rate == pytest.approx(12.0)
+    for _ in range(10):
+        adaptive.update(0.005)
+    assert adaptive.delay == pytest.approx(0.05)
+
+    assert adaptive.update(0.03)
+    assert adaptive.rate == pytest.approx(10.0)
+    assert adaptive.update(0.001, timed_out=True)
+    for _ in range(10):
+        adaptive.update(0.5)
+    assert adaptive.delay == pytest.approx(0.5)
+
+    with pytest.raises(ValueError):
+        AdaptivePollingDelay(min_delay=0.5, max_delay=0.1)
+
+
+def test_clip_end_predictor_due_tracks() -> None:
+    virtual = _VirtualClock()
+    predictor = ClipEndPredictor(window=0.25, clock=virtual.clock)
+    predictor.predict(1, 0, ClipEndPredictor.seconds_until_end(8.0, 4.0, 120.0))
+    predictor.predict(2, 3, 5.0)
+
+    assert predictor.due_tracks() == set()
+
+    virtual.now += 1.8
+
+    assert predictor.due_tracks() == {1}
+
+    predictor.forget(1)
+    virtual.now += 10.0
+
+    assert predictor.due_tracks() == {2}
+
+
+def test_clip_end_predictor_replaced_prediction() -> None:
+    virtual = _VirtualClock()
+    predictor = ClipEndPredictor(window=0.0, clock=virtual.clock)
+    predictor.predict(1, 0, 1.0)
+    predictor.predict(1, 2, 3.0)
+    virtual.now += 2.0
+
+    assert predictor.due_tracks() == set()
+    assert predictor.has_prediction(1)
+
+
+def test_quantization_to_beats() -> None:
+    assert quantization_to_beats(0) is None
+    assert quantization_to_beats(4) == 4
+    assert quantization_to_beats(4, signature_numerator=3) == 3
+    assert quantization_to_beats(2) == 16
+    assert quantization_to_beats(9) == 0.5
+
+
+def test_beat_boundary_scheduler_bars() -> None:
+    virtual = _VirtualClock()
+    beats = BeatBoundaryScheduler(quantum=4, offset=0.02, clock=virtual.clock)
+
+    beats.on_beat(0)
+    assert beats.next_boundary() == pytest.approx(100.02)
+    virtual.now += 0.02
+    assert beats.pop_due()
+
+    for beat in range(1, 4):
+        virtual.now = 100.0 + beat * 0.5
+        beats.on_beat(beat)
+        assert beats.next_boundary() is None
+
+    virtual.now = 102.0
+    beats.on_beat(4)
+    assert beats.next_boundary() == pytest.approx(102.02)
+    assert beats.beat_period == pytest.approx(0.5)
+
+
+def test_beat_boundary_scheduler_sub_beat() -> None:
+    virtual = _VirtualClock()
+    beats = BeatBoundaryScheduler(quantum=0.5, offset=0.0, clock=virtual.clock)
+    beats.on_beat(0)
+    virtual.now += 0.4
+    beats.on_beat(1)
+
+    assert beats.boundaries == pytest.approx([100.0, 100.25, 100.4, 100.6])
+    assert beats.pop_due()
+    assert beats.boundaries == pytest.approx([100.6])
+
+
+def test_beat_boundary_scheduler_wait() -> None:
+    virtual = _VirtualClock()
+    beats = BeatBoundaryScheduler(quantum=1, offset=0.0, clock=virtual.clock)
+
+    beats.on_beat(0)
+    beats.wait(200.0)
+    assert virtual.now == 100.0
+
+    virtual.now += 1.0
+    beats.wait(100.5)
+    assert virtual.now == 101.0
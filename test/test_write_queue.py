@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+import os
+
+import enable_imports_from_src_folder  # noqa: F401
+
+from pylive_played_clip import AbletonClipMonitor
+from pylive_played_clip.journal import read_journal
+from pylive_played_clip.write_queue import DIM, RESTORE, TokenBucket, WriteQueue
+
+
+class _Clock():
+    def __init__(self) -> None:
+        self.now: float = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class _CommandConnection():
+    def __init__(self) -> None:
+        self.commands: list = []
+
+    def query(self, address: str, args: tuple = ()) -> tuple:
+        return tuple(args) + (0,)
+
+    def cmd(self, address: str, args: tuple = ()) -> None:
+        self.commands.append(tuple(args))
+
+    def send_bundle(self, address: str, args_list: list) -> None:
+        self.commands.extend(tuple(args) for args in args_list)
+
+
+def test_token_bucket() -> None:
+    clock = _Clock()
+    bucket = TokenBucket(rate=10.0, burst=4, clock=clock)
+
+    assert bucket.available() == 4
+    bucket.take(4)
+    assert bucket.available() == 0
+    clock.now = 0.25
+    assert bucket.available() == 2
+    clock.now = 10.0
+    assert bucket.available() == 4
+    assert not TokenBucket().limited
+
+
+def test_write_queue_sends_dims_first_at_the_rate() -> None:
+    clock = _Clock()
+    write_queue = WriteQueue(rate=2.0, burst=2, clock=clock)
+    for clip_index in range(3):
+        write_queue.put(RESTORE, 0, clip_index, 10 + clip_index)
+    write_queue.put(DIM, 1, 0, 1)
+    write_queue.put(DIM, 0, 2, 1)
+
+    assert write_queue.get(0, 2) == 1
+    assert len(write_queue) == 4
+    assert write_queue.take(16) == [(1, 0, 1), (0, 2, 1)]
+    assert write_queue.take(16) == []
+    assert write_queue.drain_time() == 1.0
+    clock.now = 0.5
+    assert write_queue.take(16) == [(0, 0, 10)]
+    write_queue.remap({0: 3})
+    assert write_queue.take(16, force=True) == [(3, 1, 11)]
+
+
+def test_monitor_spreads_a_restore_over_the_write_rate(tmp_path) -> None:
+    path: str = os.path.join(tmp_path, 'colors.plpj')
+    clock = _Clock()
+    connection = _CommandConnection()
+    monitor = AbletonClipMonitor(dim_color='111111', connection=connection, write_rate=10.0, write_burst=2, journal=path,
+                                 clock=clock)
+    monitor.clip_color_grid = {0: [0x111111] * 4, 1: [0x00FF00]}
+    monitor.original_cell_color = {(0, clip_index): 0xFF0000 for clip_index in range(4)}
+
+    assert monitor.restore_clip_colors() == 4
+    assert connection.commands == [(0, 0, 0xFF0000), (0, 1, 0xFF0000)]
+    assert monitor.write_backlog_since == 0.0
+
+    # A clip ending while the restore drains is dimmed first.
+    monitor.capture_playing_clip_info(1, 0)
+    monitor.dim_color_of_played_clip(1)
+    clock.now = 0.2
+    monitor.flush_clip_colors()
+    assert connection.commands[2:] == [(1, 0, 0x111111), (0, 2, 0xFF0000)]
+
+    # A clip relaunched before its restore is sent keeps its original color.
+    monitor.capture_playing_clip_info(0, 3)
+    assert monitor.original_cell_color[(0, 3)] == 0xFF0000
+    clock.now = 1.0
+    monitor.flush_clip_colors()
+    assert connection.commands[4:] == [(0, 3, 0xFF0000)]
+    assert monitor.write_backlog_since is None
+
+    assert monitor.journal is not None and monitor.journal.flush()
+    assert read_journal(path) == {(0, 2): 0xFF0000, (0, 3): 0xFF0000, (1, 0): 0x00FF00}
+    monitor.journal.close()
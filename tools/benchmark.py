@@ -0,0 +1,380 @@
+#!/usr/bin/python3
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import textwrap
+import time
+
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List
+
+__project_dir__: Path = Path(__file__).parent.parent
+sys.path.insert(0, str(Path(__project_dir__, 'src')))
+import pylive_played_clip  # noqa: E402
+from pylive_played_clip import AbletonClipMonitor  # noqa: E402
+from pylive_played_clip.fake_ableton import FakeAbletonOSCServer  # noqa: E402
+from pylive_played_clip.osc_connection import OscConnection  # noqa: E402
+from pylive_played_clip.output import BackgroundWriter  # noqa: E402
+
+
+__version_info__: List[str] = ['1', '0', '0']
+__version__: str = '.'.join(__version_info__)
+
+
+# --------------------------------------------------------------------------- #
+# Script subroutines.
+# --------------------------------------------------------------------------- #
+def main() -> None:
+    args: argparse.Namespace = _parse_arguments()
+    set_log_level(args)
+
+    results: List[Dict[str, Any]] = []
+    for num_tracks in args.tracks:
+        logging.info(f"Benchmarking {num_tracks} tracks")
+        result: Dict[str, Any] = benchmark_tracks(args, num_tracks)
+        print(format_result(result))
+        results.append(result)
+
+    report: Dict[str, Any] = {
+        'executable': Path(__file__).name,
+        'version': pylive_played_clip.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'settings': {
+            'scenes': args.scenes,
+            'sweeps': args.sweeps,
+            'polling_delay': args.polling_delay,
+            'latency': args.latency,
+            'playing_share': args.playing_share,
+            'clip_length': args.clip_length,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as output_file:
+        json.dump(report, output_file, indent=4)
+    print(f"Results written to {args.output}")
+
+
+def benchmark_tracks(args: argparse.Namespace, num_tracks: int) -> Dict[str, Any]:
+    """Runs every benchmark against a simulated set of num_tracks tracks.
+    The simulated set runs in its own process so its work does not count
+    against the CPU time of the monitor.
+
+    :param args: The argparse namespace
+    :type args: :py:class:`argparse.Namespace`
+    :param num_tracks: The number of tracks in the simulated set.
+    :type num_tracks: int
+
+    :returns: The measurements.
+    :rtype: Dict[str, Any]
+    """
+    (port_receiver, port_sender) = multiprocessing.Pipe(duplex=False)
+    server_process = multiprocessing.Process(
+        target=run_fake_server,
+        args=(port_sender, num_tracks, args.scenes, args.latency, args.clip_length),
+        daemon=True)
+    server_process.start()
+    port: int = port_receiver.recv()
+
+    connection = OscConnection(port=port, timeout=10.0)
+    try:
+        return run_benchmarks(args, connection, num_tracks)
+    finally:
+        connection.close()
+        server_process.terminate()
+        server_process.join()
+
+
+def run_benchmarks(args: argparse.Namespace, connection: OscConnection, num_tracks: int) -> Dict[str, Any]:
+    """Runs every benchmark through a connection to the simulated set.
+
+    :returns: The measurements.
+    :rtype: Dict[str, Any]
+    """
+    monitor = AbletonClipMonitor(connection=connection, polling_delay=args.polling_delay, sweep_timeout=5.0)
+    # The monitor writes a line per clip, which is not what is measured here.
+    monitor.output = BackgroundWriter(open(os.devnull, 'w'))
+    monitor.num_tracks = monitor.get_number_of_tracks()
+    start: float = time.monotonic()
+    monitor.load_clip_color_grid()
+    grid_load_seconds: float = time.monotonic() - start
+
+    result: Dict[str, Any] = {'tracks': num_tracks, 'grid_load_ms': grid_load_seconds * 1000}
+    result.update(benchmark_sweeps(args, monitor))
+    result.update(benchmark_detection(args, monitor))
+    result.update(benchmark_restore(args, monitor))
+    return result
+
+
+def run_fake_server(port_sender: Any, num_tracks: int, num_scenes: int, latency: float, clip_length: float) -> None:
+    """The target of the simulated set process. It sends back the port it
+    listens on and serves until it is terminated.
+    """
+    server = FakeAbletonOSCServer(num_tracks, num_scenes, port=0, reply_port=None,
+                                  latency=latency, clip_length=clip_length)
+    port_sender.send(server.port)
+    with server:
+        while True:
+            time.sleep(1.0)
+
+
+def launch_clips(args: argparse.Namespace, monitor: AbletonClipMonitor, looping: bool) -> Dict[int, float]:
+    """Fires a clip on playing_share of the tracks, spread over the set.
+
+    :returns: The time.monotonic() value each track was fired at.
+    :rtype: Dict[int, float]
+    """
+    step: int = max(1, round(1 / args.playing_share)) if args.playing_share > 0 else monitor.num_tracks + 1
+    fired: Dict[int, float] = {}
+    for track_index in range(0, monitor.num_tracks, step):
+        clip_index: int = track_index % args.scenes
+        monitor.connection.cmd('/live/clip/set/looping', (track_index, clip_index, int(looping)))
+        monitor.connection.cmd('/live/clip/fire', (track_index, clip_index))
+        fired[track_index] = time.monotonic()
+    return fired
+
+
+def benchmark_sweeps(args: argparse.Namespace, monitor: AbletonClipMonitor) -> Dict[str, Any]:
+    """Measures back to back sweeps with looping clips playing, so no
+    clip ends during the measurement.
+
+    :returns: The sweep time, the OSC messages per second and the CPU time per sweep.
+    :rtype: Dict[str, Any]
+    """
+    monitor.connection.cmd('/live/song/start_playing')
+    for track_index in range(monitor.num_tracks):
+        monitor.connection.cmd('/live/clip/stop', (track_index,))
+    launch_clips(args, monitor, looping=True)
+    monitor.scan_tracks()
+
+    sweep_seconds: List[float] = []
+    messages_before: int = monitor.metrics.counters['queries'] + monitor.metrics.counters['commands']
+    cpu_start: float = time.process_time()
+    start: float = time.monotonic()
+    for _ in range(args.sweeps):
+        sweep_start: float = time.monotonic()
+        monitor.scan_tracks()
+        sweep_seconds.append(time.monotonic() - sweep_start)
+    elapsed: float = time.monotonic() - start
+    cpu_seconds: float = time.process_time() - cpu_start
+    messages: int = monitor.metrics.counters['queries'] + monitor.metrics.counters['commands'] - messages_before
+
+    return {
+        'sweeps': args.sweeps,
+        'sweep_ms': summarize(sweep_seconds),
+        'osc_messages_per_second': messages / elapsed if elapsed else 0.0,
+        'cpu_ms_per_cycle': cpu_seconds * 1000 / args.sweeps,
+    }
+
+
+def benchmark_detection(args: argparse.Namespace, monitor: AbletonClipMonitor) -> Dict[str, Any]:
+    """Fires clips and runs the monitor loop at polling_delay until every
+    clip has been dimmed, measuring the time from the end of each clip to
+    its dim command.
+
+    :returns: The clip end detection latency.
+    :rtype: Dict[str, Any]
+    """
+    dimmed: Dict[int, float] = {}
+    dim_color_of_played_clip = monitor.dim_color_of_played_clip
+
+    def record_dim(track_index: int) -> None:
+        dimmed.setdefault(track_index, time.monotonic())
+        dim_color_of_played_clip(track_index)
+
+    monitor.dim_color_of_played_clip = record_dim  # type: ignore
+    for track_index in range(monitor.num_tracks):
+        monitor.connection.cmd('/live/clip/stop', (track_index,))
+    monitor.scan_tracks()
+    dimmed.clear()
+
+    fired: Dict[int, float] = launch_clips(args, monitor, looping=False)
+    clip_seconds: float = args.clip_length * 60.0 / 120.0
+    deadline: float = time.monotonic() + clip_seconds + 10.0
+    monitor.scheduler.start()
+    while len(dimmed) < len(fired) and time.monotonic() < deadline:
+        monitor.scan_tracks()
+        monitor.scheduler.wait()
+    monitor.dim_color_of_played_clip = dim_color_of_played_clip  # type: ignore
+
+    latencies: List[float] = [dimmed[track_index] - (fired[track_index] + clip_seconds)
+                              for track_index in fired if track_index in dimmed]
+    return {
+        'clips_ended': len(fired),
+        'clips_detected': len(latencies),
+        'detection_latency_ms': summarize(latencies),
+    }
+
+
+def benchmark_restore(args: argparse.Namespace, monitor: AbletonClipMonitor) -> Dict[str, Any]:
+    """Restores the color of every clip slot in the set.
+
+    :returns: The restore time.
+    :rtype: Dict[str, Any]
+    """
+    monitor.connection.cmd('/live/song/stop_playing')
+    for (track_index, row) in monitor.clip_color_grid.items():
+        for (clip_index, color) in enumerate(row):
+            if color is not None:
+                monitor.original_cell_color[(track_index, clip_index)] = color
+
+    start: float = time.monotonic()
+    restored: int = monitor.restore_clip_colors()
+    return {'restored_clips': restored, 'restore_ms': (time.monotonic() - start) * 1000}
+
+
+def summarize(seconds: List[float]) -> Dict[str, float]:
+    """Summarizes a list of durations in milliseconds.
+
+    :param seconds: The durations in seconds.
+    :type seconds: List[float]
+
+    :returns: The mean, median, 99th percentile and maximum.
+    :rtype: Dict[str, float]
+    """
+    if not seconds:
+        return {'mean': 0.0, 'p50': 0.0, 'p99': 0.0, 'max': 0.0}
+
+    milliseconds: List[float] = sorted(value * 1000 for value in seconds)
+    return {
+        'mean': statistics.mean(milliseconds),
+        'p50': statistics.median(milliseconds),
+        'p99': milliseconds[min(len(milliseconds) - 1, int(len(milliseconds) * 0.99))],
+        'max': milliseconds[-1],
+    }
+
+
+def format_result(result: Dict[str, Any]) -> str:
+    """Describes the measurements of one set size in a line."""
+    return (f"{result['tracks']:>5} tracks: "
+            f"sweep p50 {result['sweep_ms']['p50']:.2f} ms p99 {result['sweep_ms']['p99']:.2f} ms, "
+            f"{result['osc_messages_per_second']:.0f} msg/s, "
+            f"cpu {result['cpu_ms_per_cycle']:.2f} ms/cycle, "
+            f"detection p50 {result['detection_latency_ms']['p50']:.1f} ms "
+            f"max {result['detection_latency_ms']['max']:.1f} ms "
+            f"({result['clips_detected']}/{result['clips_ended']}), "
+            f"restore {result['restored_clips']} clips in {result['restore_ms']:.1f} ms")
+
+
+# --------------------------------------------------------------------------- #
+# General Script Utilities
+# --------------------------------------------------------------------------- #
+def _get_argument_parser() -> argparse.ArgumentParser:
+    """Returns the argument parser. This function is used by
+    sphinx to include the command line usage in the documentation.
+
+    :return: The argparse.ArgumentParser before the arguments have been parsed.
+    :rtype: :class:`argparse.ArgumentParser`
+    """
+    basename: str = Path(__file__).name
+    usage = textwrap.dedent(f"""\
+{basename} [--tracks 8 64 256 1024] [--output benchmark_results.json]
+
+Command Line Examples
+> {basename}
+> {basename} --tracks 64 --sweeps 200
+> {basename} --latency 0.002 --output results-1.1.7.json
+
+Selected Options:
+    --tracks 8 64 256 1024          The set sizes to benchmark.
+    --output FILE                   Where to write the JSON results.
+    -h                              Show the full help, including all options.
+""")
+
+    description: str = textwrap.dedent('''\
+This is a script to benchmark the monitor against a simulated Live set of
+different sizes. It measures the sweep time, the OSC messages per second,
+the CPU time per cycle, the clip end detection latency and the time to
+restore the whole grid, and writes them to a JSON file so releases can be
+compared.
+''')
+
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        usage=usage,
+        description=description,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('--tracks', nargs='+', type=int,
+                        default=[8, 64, 256, 1024],
+                        dest='tracks',
+                        help='Default: 8 64 256 1024. The set sizes to benchmark.')
+    parser.add_argument('--scenes', type=int, default=8,
+                        dest='scenes',
+                        help='Default: 8. The number of clip slots per track.')
+    parser.add_argument('--sweeps', type=int, default=50,
+                        dest='sweeps',
+                        help='Default: 50. The number of sweeps timed per set size.')
+    parser.add_argument('--polling-delay', type=float, default=0.05,
+                        dest='polling_delay',
+                        help=('Default: 0.05 seconds. The polling delay used '
+                              'while measuring the detection latency.'))
+    parser.add_argument('--latency', type=float, default=0.0,
+                        dest='latency',
+                        help='Default: 0 seconds. The simulated delay of every reply.')
+    parser.add_argument('--playing-share', type=float, default=0.25,
+                        dest='playing_share',
+                        help='Default: 0.25. The share of the tracks with a clip playing.')
+    parser.add_argument('--clip-length', type=float, default=2.0,
+                        dest='clip_length',
+                        help='Default: 2 beats at 120 BPM. The length of every clip.')
+    parser.add_argument('--output', default='benchmark_results.json',
+                        dest='output',
+                        help='Default: benchmark_results.json. The results file.')
+    parser.add_argument('--log-level', '-l',
+                        dest='log_level',
+                        default='info',
+                        choices=['fatal', 'error', 'warn', 'info', 'debug'],
+                        help='Sets the logging level.')
+
+    return parser
+
+
+def _parse_arguments(test_args: List[str] = []) -> argparse.Namespace:
+    """Used to parse the command line arguments
+
+    :param test_args: Used during unit testing, defaults to None
+    :type test_args: List[str]
+
+    :return: The argparse argument parser with the arguments parsed.
+    :rtype: :class:`argparse.Namespace`
+    """
+    parser: argparse.ArgumentParser = _get_argument_parser()
+    if test_args:
+        return parser.parse_args(test_args)
+    else:
+        return parser.parse_args()
+
+
+def set_log_level(args: argparse.Namespace) -> None:
+    """Sets the logging level.
+
+    Defaults to **logging.INFO**
+    See :py:class:`logging.Logger`
+
+    :param args: The argument parser
+    :type args: :class:`argparse.ArgumentParser`
+
+    :returns: Nothing
+    :rtype: None
+    """
+    levels: Dict[str, int] = {
+        'fatal': logging.CRITICAL,
+        'error': logging.ERROR,
+        'warn': logging.WARNING,
+        'debug': logging.DEBUG,
+    }
+    logging.basicConfig(level=levels.get(args.log_level.lower(), logging.INFO))
+
+
+# --------------------------------------------------------------------------- #
+# Main script.
+# --------------------------------------------------------------------------- #
+if __name__ == '__main__':
+    main()